@@ -0,0 +1,419 @@
+"""Benchmarks for the sync, restore, API and SSE hot paths.
+
+Every scenario runs in its own interpreter with its own backups and data directories, so peak RSS
+and database state don't leak between scenarios. Results are written as JSON:
+
+    python benchmarks/bench.py --profile smoke --output results.json
+    python benchmarks/bench.py compare before.json after.json
+
+The run exits with status 1 when content-defined chunking is slower than --min-chunking-mb-per-s, the chunked
+backup mode can't keep up with zip archives below that.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from tree import PROFILES, generate_tree, touch_fraction
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SUITES = ("sync", "api", "sse")
+SYNC_TIMEOUT = 3600
+MIN_CHUNKING_MB_PER_S = 30.0
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        # Windows has no getrusage
+        return None
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _latency(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def _run_sync(facade, event_bus, app_id) -> dict:
+    after_id = event_bus.last_id
+    started = time.perf_counter()
+    sync_id = facade.submit_sync(app_id)
+
+    while time.perf_counter() - started < SYNC_TIMEOUT:
+        events, after_id = event_bus.wait(after_id, {"syncs"}, 1)
+        for event in events:
+            if event.event == "sync_finished" and event.data["sync_id"] == sync_id:
+                duration = time.perf_counter() - started
+                status = event.data["status"]
+                return {
+                    "state": status["state"],
+                    "seconds": round(duration, 3),
+                    "files": status["current"],
+                    "bytes_processed": status["bytes_processed"],
+                    "bytes_read": status["bytes_read"],
+                    "bytes_written": status["bytes_written"],
+                    "mb_per_s": round(status["bytes_processed"] / duration / 1_000_000, 2),
+                    "files_per_s": round(status["current"] / duration, 1),
+                }
+
+    raise TimeoutError("Sync did not finish in time")
+
+
+def _run_restores(facade, app_id, tree: Path, repeat: int) -> dict:
+    backup = facade.get_app_backups(app_id)[-1]
+
+    # A small file, so the timing is the lookup rather than decompressing it. The first restore reads every
+    # central directory in the chain, later ones come from the index cache.
+    file = min((path for path in tree.rglob("*") if path.is_file()), key=lambda path: path.stat().st_size)
+    pattern = file.relative_to(tree).as_posix()
+    samples = []
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        _restore_id, target = facade.restore_backup(backup.backup_id, [pattern], wait=True)
+        samples.append(time.perf_counter() - started)
+        shutil.rmtree(target, ignore_errors=True)
+
+    started = time.perf_counter()
+    _restore_id, target = facade.restore_backup(backup.backup_id, wait=True)
+    duration = time.perf_counter() - started
+    shutil.rmtree(target, ignore_errors=True)
+
+    return {
+        "single_file": {
+            "bytes": file.stat().st_size,
+            "cold_ms": round(samples[0] * 1000, 3),
+            **_latency(samples[1:]),
+        },
+        "full": {
+            "seconds": round(duration, 3),
+            "files": backup.file_count,
+            "mb_per_s": round(backup.logical_size / duration / 1_000_000, 2),
+        },
+    }
+
+
+def scenario_sync(tree: str, backup_mode: str, compression: str) -> dict:
+    from upback.facades.facade import UpBackFacade
+    from upback.services.event_service import event_bus
+
+    facade = UpBackFacade()
+    facade.init_db()
+    facade.save_tracked_apps({
+        "file_path": str(tree),
+        "auto_update": False,
+        "cron": "0 3 * * *",
+        "backup_mode": backup_mode,
+        "incremental": True,
+        "compression": compression,
+    })
+    app_id = facade.get_tracked_app_by_file_path(str(tree)).uuid
+
+    results = {"full": _run_sync(facade, event_bus, app_id)}
+    results["unchanged"] = _run_sync(facade, event_bus, app_id)
+    touched = touch_fraction(Path(tree), 0.05)
+    results["changed_5pct"] = {**_run_sync(facade, event_bus, app_id), "touched": touched}
+    results["restore"] = _run_restores(facade, app_id, Path(tree), repeat=10)
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def scenario_chunking(size_mb: int) -> dict:
+    from upback.services.chunk_store import iter_chunks
+
+    # Random data has no repeats, so this only measures finding the boundaries
+    data = os.urandom(size_mb * 1_000_000)
+    started = time.perf_counter()
+    chunks = sum(1 for _ in iter_chunks(io.BytesIO(data)))
+    duration = time.perf_counter() - started
+
+    return {
+        "seconds": round(duration, 3),
+        "chunks": chunks,
+        "mb_per_s": round(size_mb / duration, 2),
+    }
+
+
+def _seed_backups(rows: int, apps: int) -> list:
+    from upback.facades.facade import UpBackFacade
+
+    facade = UpBackFacade()
+    facade.init_db()
+
+    app_ids = []
+    for index in range(apps):
+        facade.save_tracked_apps({"file_path": f"/bench/app_{index}", "auto_update": True, "cron": f"{index % 60} * * * *"})
+        app_ids.append(str(facade.get_tracked_app_by_file_path(f"/bench/app_{index}").uuid))
+
+    now = time.time()
+    with facade.db.connections.transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO backups (uuid, app_id, file_path, timestamp, logical_size, physical_size, file_count, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'succeeded')
+            """,
+            (
+                (f"bench-{i:08d}", app_ids[i % apps], f"/bench/backups/bench-{i:08d}.zip", str(now - i * 60),
+                 10_000_000, 4_000_000, 1000)
+                for i in range(rows)
+            )
+        )
+
+    return app_ids
+
+
+def scenario_api(rows: int, apps: int, repeat: int) -> dict:
+    app_ids = _seed_backups(rows, apps)
+
+    from upback.app import app
+
+    client = app.test_client()
+    endpoints = {
+        "dashboard": "/",
+        "tracked_apps": "/api/tracked-apps",
+        "app_backups": f"/api/tracked-apps/{app_ids[0]}/backups",
+        "backup_stats": "/api/backups/stats",
+        "app_stats": f"/api/tracked-apps/{app_ids[0]}/stats",
+        "upcoming": "/api/schedule/upcoming",
+        "catalog_search": f"/api/tracked-apps/{app_ids[0]}/files/search?pattern=*.db",
+    }
+
+    results = {}
+    for name, url in endpoints.items():
+        client.get(url)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(url)
+            samples.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+        results[name] = _latency(samples)
+
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def scenario_sse(clients: int, events: int) -> dict:
+    from upback.facades.facade import UpBackFacade
+    from upback.services.event_service import event_bus
+
+    facade = UpBackFacade()
+    done = threading.Barrier(clients + 1)
+    received = [0] * clients
+    ready = threading.Semaphore(0)
+
+    def consume(index: int):
+        stream = facade.stream_all_syncs()
+        try:
+            for message in stream:
+                if "event: progress" in message:
+                    ready.release()
+                    continue
+                received[index] += 1
+                if "event: bench_done" in message:
+                    break
+        finally:
+            stream.close()
+        done.wait()
+
+    for index in range(clients):
+        threading.Thread(target=consume, args=(index,), daemon=True).start()
+    for _ in range(clients):
+        ready.acquire()
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for index in range(events):
+        event_bus.publish("syncs", "sync_progress", {"sync_id": f"bench-{index % 16}", "status": {"current": index}})
+    publish_seconds = time.perf_counter() - started
+    event_bus.publish("syncs", "bench_done", {"sync_id": "bench-done"})
+
+    done.wait()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "clients": clients,
+        "events": events,
+        "publish_us_per_event": round(publish_seconds / events * 1_000_000, 2),
+        "delivery_seconds": round(elapsed, 3),
+        "cpu_seconds": round(time.process_time() - cpu_started, 3),
+        "messages_per_client": round(statistics.fmean(received), 1),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+SCENARIOS = {"sync": scenario_sync, "chunking": scenario_chunking, "api": scenario_api, "sse": scenario_sse}
+
+
+def _run_isolated(workdir: Path, name: str, scenario: str, params: dict) -> dict:
+    scenario_dir = workdir / "runs" / name
+    shutil.rmtree(scenario_dir, ignore_errors=True)
+    scenario_dir.mkdir(parents=True)
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT_DIR / "src"), os.environ.get("PYTHONPATH")])),
+        "UPBACK_BACKUPS_DIR": str(scenario_dir / "backups"),
+        "UPBACK_DATA_DIR": str(scenario_dir / "data"),
+        "UPBACK_RECONCILE_INTERVAL_MINUTES": "0",
+        "UPBACK_PRUNE_INTERVAL_MINUTES": "0",
+    }
+    command = [sys.executable, __file__, "run", scenario, json.dumps(params)]
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=False)
+
+    if output.returncode != 0:
+        print(output.stderr, file=sys.stderr)
+        raise RuntimeError(f"Scenario {name} failed")
+
+    # The app prints while importing, the result is always the last line
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="upback-bench-"))
+    profile = PROFILES[args.profile]
+    suites = args.suites.split(",")
+    results = {}
+
+    meta = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "profile": args.profile,
+    }
+
+    if "sync" in suites:
+        print("Running chunking", file=sys.stderr)
+        results["chunking"] = _run_isolated(workdir, "chunking", "chunking", {"size_mb": 64})
+
+        for backup_mode, compression in (("zip", "deflate"), ("zip", "lzma"), ("chunked", "deflate")):
+            name = f"sync_{backup_mode}_{compression}"
+            # Incremental runs modify the tree, every sync scenario starts from the same generated copy
+            tree = workdir / "tree" / name / "app"
+            shutil.rmtree(tree.parent, ignore_errors=True)
+            meta["tree"] = generate_tree(tree, profile, seed=args.seed)
+            print("Running", name, file=sys.stderr)
+            results[name] = _run_isolated(workdir, name, "sync", {
+                "tree": str(tree), "backup_mode": backup_mode, "compression": compression,
+            })
+            shutil.rmtree(tree.parent, ignore_errors=True)
+
+    if "api" in suites:
+        for rows in (10_000, 100_000):
+            name = f"api_{rows}_rows"
+            print("Running", name, file=sys.stderr)
+            results[name] = _run_isolated(workdir, name, "api", {"rows": rows, "apps": 20, "repeat": args.repeat})
+
+    if "sse" in suites:
+        for clients in (1, 10, 100):
+            name = f"sse_{clients}_clients"
+            print("Running", name, file=sys.stderr)
+            results[name] = _run_isolated(workdir, name, "sse", {"clients": clients, "events": 10_000})
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    gates = {}
+    if "chunking" in results:
+        gates["chunking_mb_per_s"] = {
+            "value": results["chunking"]["mb_per_s"],
+            "minimum": args.min_chunking_mb_per_s,
+            "passed": results["chunking"]["mb_per_s"] >= args.min_chunking_mb_per_s,
+        }
+
+    return {"meta": meta, "results": results, "gates": gates}
+
+
+def _flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(before_path: Path, after_path: Path):
+    before = _flatten(json.loads(before_path.read_text())["results"])
+    after = _flatten(json.loads(after_path.read_text())["results"])
+
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{key:<60} {old:>14} {new:>14} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UpBack benchmarks")
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help=argparse.SUPPRESS)
+    run.add_argument("scenario", choices=SCENARIOS)
+    run.add_argument("params")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("before", type=Path)
+    compare_parser.add_argument("after", type=Path)
+
+    parser.add_argument("--profile", choices=PROFILES, default="default")
+    parser.add_argument("--suites", default=",".join(SUITES))
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep generated trees and databases here instead of a temp dir")
+    parser.add_argument("--output", "-o", type=Path)
+    parser.add_argument("--min-chunking-mb-per-s", type=float, default=MIN_CHUNKING_MB_PER_S)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(json.dumps(SCENARIOS[args.scenario](**json.loads(args.params))))
+        return
+
+    if args.command == "compare":
+        compare(args.before, args.after)
+        return
+
+    benchmarks = run_benchmarks(args)
+    report = json.dumps(benchmarks, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    else:
+        print(report)
+
+    failed = [name for name, gate in benchmarks["gates"].items() if not gate["passed"]]
+    if failed:
+        print("Below the minimum:", ", ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import random
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+TEXT_WORDS = [
+    "backup", "restore", "service", "config", "volume", "container", "database", "schedule", "archive", "chunk",
+    "upback", "tracked", "folder", "status", "failed", "succeeded", "nginx", "plex", "media", "library",
+]
+
+
+@dataclass
+class TreeProfile:
+    tiny_files: int = 5000
+    tiny_max_size: int = 4096
+    huge_files: int = 2
+    huge_size_mb: int = 64
+    media_files: int = 8
+    media_size_mb: int = 4
+    nesting_depth: int = 24
+    nested_files: int = 200
+    sqlite_files: int = 4
+    sqlite_rows: int = 20000
+
+
+PROFILES = {
+    "smoke": TreeProfile(
+        tiny_files=200, huge_files=1, huge_size_mb=4, media_files=2, media_size_mb=1,
+        nesting_depth=8, nested_files=20, sqlite_files=1, sqlite_rows=1000,
+    ),
+    "default": TreeProfile(),
+    "large": TreeProfile(
+        tiny_files=50000, huge_files=4, huge_size_mb=512, media_files=32, media_size_mb=16,
+        nesting_depth=64, nested_files=2000, sqlite_files=8, sqlite_rows=200000,
+    ),
+}
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(TEXT_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).encode()[:size]
+
+
+def _write_huge(path: Path, rng: random.Random, size: int):
+    # Log-like content: compressible, but not so repetitive that every block dedupes
+    block = 1024 * 1024
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            line = f"{written:012d} {rng.getrandbits(64):016x} ".encode() + _text(rng, 96) + b"\n"
+            chunk = line * (block // len(line))
+            f.write(chunk[:size - written])
+            written += min(len(chunk), size - written)
+
+
+def _write_sqlite(path: Path, rng: random.Random, rows: int):
+    # Same shape as the databases under samples/, a handful of small tables with text and blobs
+    with sqlite3.connect(path) as conn:
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT NOT NULL, email TEXT NOT NULL);
+            CREATE TABLE events (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, kind TEXT, payload BLOB);
+            CREATE INDEX idx_events_user_id ON events (user_id);
+        """)
+        conn.executemany(
+            "INSERT INTO users (name, email) VALUES (?, ?)",
+            ((f"user {i}", f"user{i}@example.com") for i in range(max(1, rows // 10)))
+        )
+        conn.executemany(
+            "INSERT INTO events (user_id, kind, payload) VALUES (?, ?, ?)",
+            ((rng.randrange(max(1, rows // 10)), rng.choice(TEXT_WORDS), rng.randbytes(rng.randrange(16, 256)))
+             for _ in range(rows))
+        )
+
+
+def generate_tree(root: Path, profile: TreeProfile, seed: int = 0) -> dict:
+    """Builds a deterministic source tree for the given profile and returns its file count and size."""
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+
+    tiny_dir = root / "tiny"
+    for i in range(profile.tiny_files):
+        directory = tiny_dir / f"{i % 100:02d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"file_{i}.txt").write_bytes(_text(rng, rng.randrange(1, profile.tiny_max_size)))
+
+    huge_dir = root / "huge"
+    huge_dir.mkdir(exist_ok=True)
+    for i in range(profile.huge_files):
+        _write_huge(huge_dir / f"huge_{i}.log", rng, profile.huge_size_mb * 1024 * 1024)
+
+    media_dir = root / "media"
+    media_dir.mkdir(exist_ok=True)
+    for i in range(profile.media_files):
+        extension = (".jpg", ".mp4", ".mkv", ".png")[i % 4]
+        (media_dir / f"media_{i}{extension}").write_bytes(rng.randbytes(profile.media_size_mb * 1024 * 1024))
+
+    nested = root / "nested"
+    for depth in range(profile.nesting_depth):
+        nested = nested / f"level_{depth}"
+    nested.mkdir(parents=True, exist_ok=True)
+    for i in range(profile.nested_files):
+        (nested / f"deep_{i}.json").write_bytes(b'{"value": "' + _text(rng, 200) + b'"}')
+
+    data_dir = root / "data"
+    data_dir.mkdir(exist_ok=True)
+    for i in range(profile.sqlite_files):
+        _write_sqlite(data_dir / f"database_{i}.db", rng, profile.sqlite_rows)
+
+    files = 0
+    size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+
+    return {"files": files, "bytes": size}
+
+
+def touch_fraction(root: Path, fraction: float, seed: int = 1) -> int:
+    """Rewrites a fraction of the tiny files so incremental runs have something to pick up."""
+    rng = random.Random(seed)
+    files = sorted((root / "tiny").rglob("*.txt"))
+    changed = rng.sample(files, int(len(files) * fraction))
+
+    for path in changed:
+        path.write_bytes(_text(rng, rng.randrange(1, 4096)))
+
+    return len(changed)
@@ -1,15 +1,20 @@
 import argparse
 import os
+import shutil
 from dataclasses import asdict
 from typing import List
 from uuid import UUID
 from flask import Flask, Response, request, render_template, jsonify, current_app
 
 from upback.config.global_exception_handler import GlobalExceptionHandler
+from upback.config.settings import settings
+from upback.exceptions.exceptions import ApiException
 from upback.facades.facade import UpBackFacade
 from upback.scheduled import scheduled
 from upback.models.models import TrackedApp
+from upback.services.metrics_service import registry, METRICS_DIR
 from upback.services.synchronization_service import running_syncs
+from upback.services.throttle_service import THROTTLE_FILE
 from upback.utils.utils import get_cron_description, stream_next_cron, get_folder_data, get_home_directory, sort_by_cron
 
 here = os.path.dirname(os.path.abspath(__file__))
@@ -23,6 +28,12 @@ upBackFacade = UpBackFacade()
 global_exception_handler = GlobalExceptionHandler(app)
 
 
+@app.teardown_appcontext
+def close_db_connection(_exception):
+    # Request threads come and go, each would otherwise keep its connection open for the life of the process
+    upBackFacade.db.connections.close()
+
+
 @app.route("/api/tracked-apps", methods=["GET"])
 def get_tracked_apps_api() -> List[TrackedApp]:
     return upBackFacade.get_tracked_apps()
@@ -40,16 +51,16 @@ def get_tracked_app_status_api(uuid: UUID) -> Response:
 def update_tracked_app_api(uuid: UUID) -> Response:
     data = request.get_json()
     upBackFacade.update_tracked_app(data, uuid)
-    scheduled.load_backup_jobs()
+    scheduled.update_backup_job(uuid)
     return Response(status=200)
 
 
 @app.route("/api/tracked-apps", methods=["POST"])
 def save_tracked_apps_api():
     data = request.get_json()
-    status = upBackFacade.save_tracked_apps(data)
-    scheduled.load_backup_jobs()
-    return Response(status=status)
+    tracked_app = upBackFacade.save_tracked_apps(data)
+    scheduled.update_backup_job(tracked_app.uuid)
+    return Response(status=201)
 
 
 @app.route("/api/tracked-apps/sync", methods=["POST"])
@@ -59,9 +70,23 @@ def sync_all_tracked_apps_api():
 
 @app.route("/api/tracked-apps/sync/<uuid>", methods=["POST"])
 def sync_tracked_app_api(uuid: UUID):
+    data = request.get_json(silent=True) or {}
+    if data.get("dry_run"):
+        return jsonify(asdict(upBackFacade.plan_sync(uuid, bool(data.get("refresh", False)))))
     return Response(status=upBackFacade.sync_app_by_uuid(uuid))
 
 
+@app.route("/api/tracked-apps/<uuid>/plan", methods=["GET"])
+def get_tracked_app_plan_api(uuid: UUID) -> Response:
+    refresh = request.args.get("refresh", default="false").lower() == "true"
+    return jsonify(asdict(upBackFacade.plan_sync(uuid, refresh)))
+
+
+@app.route("/api/plan", methods=["POST"])
+def plan_folder_api() -> Response:
+    return jsonify(asdict(upBackFacade.plan_folder(request.get_json(silent=True) or {})))
+
+
 @app.route("/api/tracked-apps/<uuid>/backups", methods=["GET"])
 def get_tracked_apps_backups_api(uuid: UUID):
     backups = upBackFacade.get_app_backups(uuid)
@@ -70,17 +95,107 @@ def get_tracked_apps_backups_api(uuid: UUID):
             {
                 "file_path": b.file_path,
                 "timestamp": b.timestamp,
-                "backup_id": b.backup_id
+                "backup_id": b.backup_id,
+                "logical_size": b.logical_size,
+                "physical_size": b.physical_size,
+                "parent_id": b.parent_id,
+                "file_count": b.file_count,
+                "status": b.status
             }
             for b in backups
         ]
     })
 
 
+@app.route("/api/tracked-apps/<uuid>/stats", methods=["GET"])
+def get_tracked_app_stats_api(uuid: UUID) -> Response:
+    return jsonify(asdict(upBackFacade.get_app_backup_stats(uuid)))
+
+
+@app.route("/api/backups/stats", methods=["GET"])
+def get_backup_stats_api() -> Response:
+    return jsonify(asdict(upBackFacade.get_backup_stats()))
+
+
+@app.route("/api/backups/reconcile", methods=["POST"])
+def reconcile_backups_api() -> Response:
+    return jsonify(upBackFacade.reconcile_backups())
+
+
+@app.route("/api/backups/prune", methods=["POST"])
+def prune_backups_api() -> Response:
+    data = request.get_json(silent=True) or {}
+    return jsonify(upBackFacade.prune_backups(data.get("app_id"), bool(data.get("dry_run", False))))
+
+
+@app.route("/api/backups/scrub", methods=["POST"])
+def start_scrub_api() -> Response:
+    return Response(status=upBackFacade.start_scrub())
+
+
+@app.route("/api/backups/scrub", methods=["GET"])
+def get_scrub_status_api() -> Response:
+    return jsonify(upBackFacade.get_scrub_status())
+
+
+@app.route("/api/backups/<backup_id>/scrub", methods=["GET"])
+def get_backup_scrub_api(backup_id: str) -> Response:
+    return jsonify(upBackFacade.get_backup_scrub(backup_id))
+
+
+@app.route("/api/backups/<backup_id>/files", methods=["GET"])
+def get_backup_files_api(backup_id: str) -> Response:
+    cursor = request.args.get("cursor")
+    limit = request.args.get("limit", default=100, type=int)
+    return jsonify(upBackFacade.get_backup_catalog(backup_id, cursor, limit))
+
+
+@app.route("/api/tracked-apps/<uuid>/files/search", methods=["GET"])
+def search_tracked_app_files_api(uuid: UUID) -> Response:
+    pattern = request.args.get("pattern")
+    if not pattern:
+        raise ApiException("Missing pattern", code=400)
+
+    limit = request.args.get("limit", default=100, type=int)
+    return jsonify({"files": upBackFacade.search_backup_files(uuid, pattern, limit)})
+
+
+@app.route("/api/backups/<backup_id>/restore", methods=["POST"])
+def restore_backup_api(backup_id: str) -> Response:
+    data = request.get_json(silent=True) or {}
+    patterns = data.get("paths") or None
+
+    if data.get("dry_run"):
+        items = upBackFacade.plan_restore(backup_id, patterns)
+        return jsonify({
+            "files": [{"path": item.path, "size": item.size} for item in items],
+            "total_bytes": sum(item.size for item in items),
+        })
+
+    restore_id, target_dir = upBackFacade.restore_backup(backup_id, patterns, data.get("target"))
+    return jsonify({"restore_id": restore_id, "target": str(target_dir)}), 202
+
+
+@app.route("/api/restores", methods=["GET"])
+def stream_all_restores():
+    return Response(
+        upBackFacade.stream_all_restores(request.headers.get("Last-Event-ID")),
+        mimetype="text/event-stream"
+    )
+
+
+@app.route("/api/schedule/upcoming", methods=["GET"])
+def get_upcoming_runs_api() -> Response:
+    limit = request.args.get("limit", default=20, type=int)
+    hours = request.args.get("hours", default=None, type=float)
+    enabled_only = request.args.get("enabled_only", default="true").lower() != "false"
+    return jsonify({"upcoming": upBackFacade.get_upcoming_runs(limit, hours, enabled_only)})
+
+
 @app.route("/api/tracked-apps/syncs", methods=["GET"])
 def stream_all_syncs():
     return Response(
-        upBackFacade.stream_all_syncs(),
+        upBackFacade.stream_all_syncs(request.headers.get("Last-Event-ID")),
         mimetype="text/event-stream"
     )
 
@@ -90,11 +205,32 @@ def get_tracked_apps_next_cron_api(uuid: UUID):
     tracked_app = upBackFacade.get_tracked_app_by_uuid(uuid)
 
     return Response(
-        stream_next_cron(tracked_app.cron),
+        stream_next_cron(str(tracked_app.uuid), tracked_app.cron),
         mimetype="text/event-stream"
     )
 
 
+@app.route("/api/storage", methods=["GET"])
+def get_storage_backends_api() -> Response:
+    return jsonify(upBackFacade.get_storage_backends())
+
+
+@app.route("/api/throttle", methods=["GET"])
+def get_throttle_api() -> Response:
+    return jsonify(upBackFacade.get_throttle())
+
+
+@app.route("/api/throttle", methods=["PUT"])
+def update_throttle_api() -> Response:
+    data = request.get_json(silent=True) or {}
+    return jsonify(upBackFacade.update_throttle(data))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api() -> Response:
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/api/file-system/api-path", methods=["GET"])
 def get_file_system_api_path_api():
     return jsonify({"path": str(get_home_directory())})
@@ -102,14 +238,21 @@ def get_file_system_api_path_api():
 
 @app.route("/api/file-system", methods=["GET"])
 def get_file_system_api():
-    path = request.args.get("path")
-    return jsonify(get_folder_data(path))
+    return jsonify(get_folder_data(
+        request.args.get("path"),
+        cursor=request.args.get("cursor"),
+        limit=request.args.get("limit", default=200, type=int),
+        sort=request.args.get("sort", default="name"),
+        order=request.args.get("order", default="asc"),
+        query=request.args.get("q"),
+        sizes=request.args.get("sizes", default="false").lower() == "true",
+    ))
 
 
 @app.route("/api/tracked-apps/<uuid>", methods=["DELETE"])
 def delete_tracked_api(uuid: UUID):
     upBackFacade.delete_tracked_app_by_uuid(uuid)
-    scheduled.load_backup_jobs()
+    scheduled.update_backup_job(uuid)
     return Response(status=200)
 
 
@@ -117,15 +260,8 @@ def delete_tracked_api(uuid: UUID):
 @app.route("/", methods=["GET"])
 def home_web():
     tracked_apps = upBackFacade.get_tracked_apps()
-    backups = upBackFacade.get_all_backups()
-    found_backup_files = []
-    size_bytes = 0
-
-    for backup in backups:
-        files = upBackFacade.get_backup_files(backup.backup_id)
-        if files is not None:
-            found_backup_files.append(files)
-            size_bytes += files.file_size
+    stats = upBackFacade.get_backup_stats()
+    size_bytes = stats.archive_size
 
     if size_bytes >= 1_000_000_000:
         total_filesize = f"{size_bytes / 1_000_000_000:.2f} GB"
@@ -137,9 +273,8 @@ def home_web():
         tracked_apps=sort_by_cron(tracked_apps),
         tracked_apps_enabled=[_app for _app in tracked_apps if _app.auto_update == True],
         tracked_apps_amount=len(tracked_apps),
-        backups=backups,
-        backups_amount=len(backups),
-        backup_files_found_amount=len(found_backup_files),
+        backups_amount=stats.backup_count,
+        backup_files_found_amount=stats.found_count,
         backup_files_size=total_filesize
     )
 
@@ -179,13 +314,47 @@ def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", "-p", type=int, default=8080)
+    parser.add_argument("--server", choices=("flask", "uvicorn"), default=settings.server)
+    parser.add_argument("--workers", type=int, default=settings.server_workers)
+    parser.add_argument("--compression-workers", type=int, default=settings.compression_workers)
+    parser.add_argument("--worker-memory-mb", type=int, default=settings.worker_memory_mb)
+    parser.add_argument("--max-concurrent-syncs", type=int, default=settings.max_concurrent_syncs)
+    parser.add_argument("--watch", action="store_true", default=settings.watch_enabled)
     args = parser.parse_args()
 
-    upBackFacade.init_db()
-
-    scheduled.load_backup_jobs()
-    scheduled.start_scheduler()
-
+    settings.compression_workers = args.compression_workers
+    settings.worker_memory_mb = args.worker_memory_mb
+    settings.max_concurrent_syncs = args.max_concurrent_syncs
+    settings.watch_enabled = args.watch
+    settings.server_workers = max(1, args.workers)
+
+    if args.server == "uvicorn":
+        import uvicorn
+
+        # Worker processes import the app on their own, the environment is how they get the command line settings
+        os.environ.update({
+            "UPBACK_COMPRESSION_WORKERS": str(settings.compression_workers),
+            "UPBACK_WORKER_MEMORY_MB": str(settings.worker_memory_mb),
+            "UPBACK_MAX_CONCURRENT_SYNCS": str(settings.max_concurrent_syncs),
+            "UPBACK_WATCH": str(int(settings.watch_enabled)),
+            "UPBACK_WORKERS": str(settings.server_workers),
+        })
+        # Throttle changes and metrics the workers share through the data directory last as long as the server,
+        # as with one process
+        THROTTLE_FILE.unlink(missing_ok=True)
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+        uvicorn.run(
+            "upback.asgi:app",
+            host="0.0.0.0",
+            port=args.port,
+            workers=settings.server_workers,
+            lifespan="on",
+            # Event streams never finish on their own
+            timeout_graceful_shutdown=5,
+        )
+        return
+
+    scheduled.start_background_services()
     app.run(host='0.0.0.0', port=args.port, threaded=True)
 
 
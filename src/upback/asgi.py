@@ -0,0 +1,124 @@
+import asyncio
+import json
+import re
+from contextlib import aclosing
+from typing import AsyncIterator
+
+from asgiref.wsgi import WsgiToAsgi
+
+from upback.app import app as flask_app, upBackFacade
+from upback.exceptions.exceptions import ApiException
+from upback.scheduled import scheduled
+from upback.utils.utils import stream_next_cron_async
+
+NEXT_CRON_PATH = re.compile(r"^/api/tracked-apps/next-cron/([^/]+)$")
+SYNCS_PATH = "/api/tracked-apps/syncs"
+
+
+class UpBackAsgi:
+    """Serves the Flask app under uvicorn, with the long-lived event streams as native coroutines.
+
+    Everything else goes through asgiref's WSGI adapter, which runs each request on a thread. The streams would
+    hold one of those threads for as long as a dashboard stays open.
+    """
+
+    def __init__(self):
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] == "http" and scope["method"] == "GET":
+            path = scope["path"]
+            if path == SYNCS_PATH:
+                last_event_id = _header(scope, b"last-event-id")
+                await _stream(receive, send, upBackFacade.stream_all_syncs_async(last_event_id))
+                return
+
+            match = NEXT_CRON_PATH.match(path)
+            if match:
+                await self._next_cron(receive, send, match.group(1))
+                return
+
+        await self.wsgi(scope, receive, send)
+
+    @staticmethod
+    async def _next_cron(receive, send, uuid: str):
+        try:
+            tracked_app = await asyncio.to_thread(upBackFacade.get_tracked_app_by_uuid, uuid)
+        except ApiException as e:
+            await _json(send, {"error": e.message, "code": e.code}, e.code)
+            return
+
+        await _stream(receive, send, stream_next_cron_async(str(tracked_app.uuid), tracked_app.cron))
+
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await asyncio.to_thread(scheduled.start_background_services)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                scheduled.stop_background_services()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def _header(scope, name: bytes) -> str | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def _json(send, data: dict, status: int):
+    body = json.dumps(data).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _stream(receive, send, messages: AsyncIterator[str]):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")],
+    })
+
+    async def pump():
+        async with aclosing(messages):
+            async for message in messages:
+                await send({"type": "http.response.body", "body": message.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    # The stream only ends on its own when the app is deleted, otherwise it runs until the client leaves
+    streaming = asyncio.create_task(pump())
+    disconnected = asyncio.create_task(_wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({streaming, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        streaming.cancel()
+        disconnected.cancel()
+        # Lets the generator unsubscribe before the connection is torn down
+        error, _ = await asyncio.gather(streaming, disconnected, return_exceptions=True)
+
+    if isinstance(error, Exception):
+        raise error
+
+
+app = UpBackAsgi()
@@ -0,0 +1,35 @@
+import argparse
+import sys
+
+from upback.exceptions.exceptions import ApiException
+from upback.facades.facade import UpBackFacade
+
+
+def restore_main():
+    parser = argparse.ArgumentParser(prog="upback-restore", description="Restore files from an UpBack backup")
+    parser.add_argument("backup_id")
+    parser.add_argument("--path", "-p", action="append", dest="paths",
+                        help="glob of paths to restore, may be given multiple times")
+    parser.add_argument("--target", "-t", help="directory to restore into, defaults to backups/restores/<id>")
+    parser.add_argument("--list", "-l", action="store_true", help="only list the files that would be restored")
+    args = parser.parse_args()
+
+    upBackFacade = UpBackFacade()
+    upBackFacade.init_db()
+
+    try:
+        if args.list:
+            for item in upBackFacade.plan_restore(args.backup_id, args.paths):
+                print(f"{item.size:>14}  {item.path}")
+            return
+
+        restore_id, target_dir = upBackFacade.restore_backup(args.backup_id, args.paths, args.target, wait=True)
+    except ApiException as e:
+        print(f"error: {e.message}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Restored backup {args.backup_id} into {target_dir}")
+
+
+if __name__ == '__main__':
+    restore_main()
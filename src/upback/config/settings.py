@@ -0,0 +1,34 @@
+import os
+from dataclasses import dataclass, field
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+@dataclass
+class Settings:
+    compression_workers: int = field(default_factory=lambda: _env_int("UPBACK_COMPRESSION_WORKERS", os.cpu_count() or 1))
+    worker_memory_mb: int = field(default_factory=lambda: _env_int("UPBACK_WORKER_MEMORY_MB", 8))
+    reconcile_interval_minutes: int = field(default_factory=lambda: _env_int("UPBACK_RECONCILE_INTERVAL_MINUTES", 60))
+    prune_interval_minutes: int = field(default_factory=lambda: _env_int("UPBACK_PRUNE_INTERVAL_MINUTES", 60))
+    scrub_interval_minutes: int = field(default_factory=lambda: _env_int("UPBACK_SCRUB_INTERVAL_MINUTES", 60))
+    scrub_max_age_days: int = field(default_factory=lambda: _env_int("UPBACK_SCRUB_MAX_AGE_DAYS", 7))
+    scrub_workers: int = field(default_factory=lambda: _env_int("UPBACK_SCRUB_WORKERS", 2))
+    scrub_read_limit_mb_per_s: int = field(default_factory=lambda: _env_int("UPBACK_SCRUB_READ_LIMIT_MB_PER_S", 50))
+    upload_resume_hours: int = field(default_factory=lambda: _env_int("UPBACK_UPLOAD_RESUME_HOURS", 24))
+    missed_run_grace_minutes: int = field(default_factory=lambda: _env_int("UPBACK_MISSED_RUN_GRACE_MINUTES", 24 * 60))
+    max_concurrent_syncs: int = field(default_factory=lambda: _env_int("UPBACK_MAX_CONCURRENT_SYNCS", 2))
+    read_limit_mb_per_s: int = field(default_factory=lambda: _env_int("UPBACK_READ_LIMIT_MB_PER_S", 0))
+    cpu_workers: int = field(default_factory=lambda: _env_int("UPBACK_CPU_WORKERS", 0))
+    sync_nice: int = field(default_factory=lambda: _env_int("UPBACK_SYNC_NICE", 0))
+    sync_ionice_class: int = field(default_factory=lambda: _env_int("UPBACK_SYNC_IONICE_CLASS", 0))
+    adaptive_throttle: bool = field(default_factory=lambda: bool(_env_int("UPBACK_ADAPTIVE_THROTTLE", 0)))
+    watch_enabled: bool = field(default_factory=lambda: bool(_env_int("UPBACK_WATCH", 0)))
+    server: str = field(default_factory=lambda: os.environ.get("UPBACK_SERVER") or "flask")
+    server_workers: int = field(default_factory=lambda: _env_int("UPBACK_WORKERS", 1))
+    continuous_debounce_seconds: int = field(default_factory=lambda: _env_int("UPBACK_CONTINUOUS_DEBOUNCE_SECONDS", 30))
+
+
+settings = Settings()
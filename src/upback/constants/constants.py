@@ -1,3 +1,12 @@
+import os
 from datetime import datetime
+from pathlib import Path
 
-SYSTEM_TIME_ZONE = datetime.now().astimezone().tzinfo
\ No newline at end of file
+SYSTEM_TIME_ZONE = datetime.now().astimezone().tzinfo
+
+ROOT_DIR = Path(__file__).parent.parent.parent.parent
+
+BACKUPS_DIR = Path(os.environ.get("UPBACK_BACKUPS_DIR") or ROOT_DIR / "backups")
+DATA_DIR = Path(os.environ.get("UPBACK_DATA_DIR") or ROOT_DIR / "upback_data")
+CHUNKS_DIR = BACKUPS_DIR / ".chunks"
+LOCKS_DIR = DATA_DIR / "locks"
@@ -1,168 +1,474 @@
-import sqlite3
-from pathlib import Path
+import json
+import time
+from functools import wraps
 from typing import List
 from uuid import UUID
 
-from upback.models.models import TrackedApp, Backup
+from upback.constants.constants import DATA_DIR
+from upback.database.connection import get_connection_manager
+from upback.database.migrations import migrate
+from upback.models.models import TrackedApp, Backup, ManifestEntry, CatalogEntry
+from upback.services.metrics_service import db_query_duration
+
+TRACKED_APP_COLUMNS = (
+    "uuid, file_path, auto_update, cron, backup_mode, incremental, compression, compression_level, "
+    "keep_last, keep_daily, keep_weekly, keep_monthly, continuous, read_limit_mb_per_s, cpu_workers, storage"
+)
+BACKUP_COLUMNS = "uuid, app_id, file_path, timestamp, logical_size, physical_size, parent_id, file_count, status"
+BACKUP_STATS_COLUMNS = "backup_count, found_count, archive_size, logical_size, file_count"
+SCRUB_COLUMNS = (
+    "b.uuid, b.app_id, b.file_path, COALESCE(s.next_member, 0), COALESCE(s.checked_members, 0), "
+    "COALESCE(s.checked_bytes, 0), COALESCE(s.corrupt_members, '[]')"
+)
+
+
+def _timed_query(method):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            db_query_duration.observe(time.perf_counter() - started, method.__name__)
+
+    return wrapper
 
 
 class DB:
     def __init__(self):
-        self.db_tracked_apps_path = Path(__file__).parent.parent.parent.parent / "upback_data" / "tracked_apps.db"
-        self.db_tracked_apps_path.parent.mkdir(parents=True, exist_ok=True)  # ensure directory exists
+        self.data_dir = DATA_DIR
+        self.data_dir.mkdir(parents=True, exist_ok=True)  # ensure directory exists
 
-        self.db_backups_path = Path(__file__).parent.parent.parent.parent / "upback_data" / "backups.db"
-        self.db_backups_path.parent.mkdir(parents=True, exist_ok=True)  # ensure directory exists
+        self.db_path = self.data_dir / "upback.db"
+        self.connections = get_connection_manager(self.db_path)
 
     def init_db(self):
-        tracked_apps_sql = """
-                           CREATE TABLE IF NOT EXISTS tracked_apps
-                           (
-                               uuid
-                               TEXT
-                               PRIMARY
-                               KEY
-                               NOT
-                               NULL,
-                               file_path
-                               TEXT
-                               NOT
-                               NULL,
-                               auto_update
-                               BOOLEAN
-                               NOT
-                               NULL,
-                               cron
-                               TEXT
-                               NOT
-                               NULL
-                           ) \
-                           """
-
-        backups_sql = """
-                      CREATE TABLE IF NOT EXISTS backups
-                      (
-                          uuid
-                          TEXT
-                          PRIMARY
-                          KEY
-                          NOT
-                          NULL,
-                          app_id
-                          TEXT
-                          NOT
-                          NULL,
-                          file_path
-                          TEXT
-                          NOT
-                          NULL,
-                          timestamp
-                          TEXT
-                          NOT
-                          NULL
-                      ) \
-                      """
-
-        with sqlite3.connect(self.db_tracked_apps_path) as conn:
-            conn.execute(tracked_apps_sql)
-            conn.commit()
-
-        with sqlite3.connect(self.db_backups_path) as conn:
-            conn.execute(backups_sql)
-            conn.commit()
+        migrate(self.connections.connection(), self.data_dir)
 
+    @_timed_query
     def save_tracked_app(self, tracked_app: TrackedApp):
-        sql = """
-              INSERT INTO tracked_apps (uuid, file_path, auto_update, cron)
-              VALUES (?, ?, ?, ?) \
+        sql = f"""
+              INSERT INTO tracked_apps ({TRACKED_APP_COLUMNS})
+              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) \
               """
         try:
-            with sqlite3.connect(self.db_tracked_apps_path) as conn:
+            with self.connections.transaction() as conn:
                 conn.execute(sql,
-                             (str(tracked_app.uuid), tracked_app.file_path, tracked_app.auto_update, tracked_app.cron))
-                conn.commit()
+                             (str(tracked_app.uuid), tracked_app.file_path, tracked_app.auto_update, tracked_app.cron,
+                              tracked_app.backup_mode, tracked_app.incremental, tracked_app.compression,
+                              tracked_app.compression_level, tracked_app.keep_last, tracked_app.keep_daily,
+                              tracked_app.keep_weekly, tracked_app.keep_monthly, tracked_app.continuous,
+                              tracked_app.read_limit_mb_per_s, tracked_app.cpu_workers, tracked_app.storage))
         except Exception as e:
             print("DB Error:", e)
 
+    @_timed_query
     def save_backup(self, backup: Backup):
-        sql = """
-              INSERT INTO backups (uuid, app_id, file_path, timestamp)
-              VALUES (?, ?, ?, ?) \
+        sql = f"""
+              INSERT INTO backups ({BACKUP_COLUMNS})
+              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) \
               """
         try:
-            with sqlite3.connect(self.db_backups_path) as conn:
-                conn.execute(sql, (backup.backup_id, backup.app_id, backup.file_path, backup.timestamp))
-                conn.commit()
+            with self.connections.transaction() as conn:
+                conn.execute(sql, (backup.backup_id, backup.app_id, backup.file_path, backup.timestamp,
+                                   backup.logical_size, backup.physical_size, backup.parent_id, backup.file_count,
+                                   backup.status))
         except Exception as e:
             print("DB Error:", e)
 
+    @_timed_query
+    def finish_backup(self, backup_id: str, logical_size: int, physical_size: int, file_count: int, status: str,
+                      bytes_read: int = 0, bytes_written: int = 0, duration_seconds: float = 0.0):
+        sql = """
+              UPDATE backups
+              SET logical_size     = ?,
+                  physical_size    = ?,
+                  file_count       = ?,
+                  status           = ?,
+                  bytes_read       = ?,
+                  bytes_written    = ?,
+                  duration_seconds = ?
+              WHERE uuid = ?
+              """
+        with self.connections.transaction() as conn:
+            conn.execute(sql, (logical_size, physical_size, file_count, status, bytes_read, bytes_written,
+                               duration_seconds, backup_id))
+
+    @_timed_query
+    def get_sync_measurements(self, app_id: str, status: str, limit: int) -> List[tuple]:
+        sql = """
+              SELECT bytes_read, bytes_written, duration_seconds
+              FROM backups
+              WHERE app_id = ?
+                AND status = ?
+                AND duration_seconds > 0
+              ORDER BY timestamp DESC
+              LIMIT ?
+              """
+        return self.connections.connection().execute(sql, (app_id, status, limit)).fetchall()
+
+    @_timed_query
+    def set_backup_status(self, backup_id: str, status: str):
+        sql = "UPDATE backups SET status = ? WHERE uuid = ?"
+        with self.connections.transaction() as conn:
+            conn.execute(sql, (status, backup_id))
+
+    @_timed_query
+    def replace_backup_status(self, backup_id: str, current: str, status: str) -> bool:
+        sql = "UPDATE backups SET status = ? WHERE uuid = ? AND status = ?"
+        with self.connections.transaction() as conn:
+            return conn.execute(sql, (status, backup_id, current)).rowcount > 0
+
+    @_timed_query
+    def update_backup_locations(self, updates: List[tuple]):
+        sql = "UPDATE backups SET status = ?, physical_size = ? WHERE uuid = ?"
+        with self.connections.transaction() as conn:
+            conn.executemany(sql, updates)
+
+    @_timed_query
+    def get_backup_locations(self, after_id: str, limit: int) -> List[tuple]:
+        sql = """
+              SELECT uuid, file_path, status, physical_size
+              FROM backups
+              WHERE uuid > ?
+              ORDER BY uuid
+              LIMIT ?
+              """
+        return self.connections.connection().execute(sql, (after_id, limit)).fetchall()
+
+    @_timed_query
+    def get_backup_totals(self) -> tuple:
+        sql = """
+              SELECT COALESCE(SUM(backup_count), 0),
+                     COALESCE(SUM(found_count), 0),
+                     COALESCE(SUM(archive_size), 0),
+                     COALESCE(SUM(logical_size), 0),
+                     COALESCE(SUM(file_count), 0)
+              FROM backup_stats
+              """
+        return self.connections.connection().execute(sql).fetchone()
+
+    @_timed_query
+    def get_app_backup_stats(self, app_id: str) -> tuple:
+        sql = f"SELECT {BACKUP_STATS_COLUMNS} FROM backup_stats WHERE app_id = ?"
+        return self.connections.connection().execute(sql, (app_id,)).fetchone()
+
+    @_timed_query
     def get_backups(self, app_id: UUID) -> List[tuple]:
-        sql = "SELECT * FROM backups WHERE app_id = ?"
-        with sqlite3.connect(self.db_backups_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, (app_id,))
-            return cursor.fetchall()
+        sql = f"SELECT {BACKUP_COLUMNS} FROM backups WHERE app_id = ? ORDER BY timestamp"
+        return self.connections.connection().execute(sql, (str(app_id),)).fetchall()
 
+    @_timed_query
     def get_tracked_apps(self):
-        sql = "SELECT * FROM tracked_apps"
-        with sqlite3.connect(self.db_tracked_apps_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql)
-            return cursor.fetchall()
+        sql = f"SELECT {TRACKED_APP_COLUMNS} FROM tracked_apps"
+        return self.connections.connection().execute(sql).fetchall()
 
+    @_timed_query
     def get_tracked_app_by_file_path(self, file_path: str) -> tuple:
-        sql = "SELECT * FROM tracked_apps WHERE file_path = ?"
-        with sqlite3.connect(self.db_tracked_apps_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, (file_path,))
-            return cursor.fetchone()
+        sql = f"SELECT {TRACKED_APP_COLUMNS} FROM tracked_apps WHERE file_path = ?"
+        return self.connections.connection().execute(sql, (file_path,)).fetchone()
 
+    @_timed_query
     def get_tracked_app_by_uuid(self, service_uuid: UUID) -> tuple:
-        sql = "SELECT * FROM tracked_apps WHERE uuid = ?"
-        with sqlite3.connect(self.db_tracked_apps_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, (str(service_uuid),))
-            return cursor.fetchone()
+        sql = f"SELECT {TRACKED_APP_COLUMNS} FROM tracked_apps WHERE uuid = ?"
+        return self.connections.connection().execute(sql, (str(service_uuid),)).fetchone()
 
+    @_timed_query
     def delete_tracked_app(self, app_id: UUID):
         sql = "DELETE FROM tracked_apps WHERE uuid = ?"
-        with sqlite3.connect(self.db_tracked_apps_path) as conn:
+        with self.connections.transaction() as conn:
             conn.execute(sql, (str(app_id),))
-            conn.commit()
 
+    @_timed_query
     def delete_backup(self, backup_id: str):
         sql = "DELETE FROM backups WHERE uuid = ?"
-        with sqlite3.connect(self.db_backups_path) as conn:
+        with self.connections.transaction() as conn:
             conn.execute(sql, (backup_id,))
-            conn.commit()
 
+    @_timed_query
+    def delete_backups(self, backup_ids: List[str]):
+        with self.connections.transaction() as conn:
+            # Chunked manifests are complete snapshots, children of a pruned backup just lose the link
+            conn.executemany("UPDATE backups SET parent_id = NULL WHERE parent_id = ?", ((i,) for i in backup_ids))
+            conn.executemany("DELETE FROM backups WHERE uuid = ?", ((i,) for i in backup_ids))
+
+    @_timed_query
+    def get_backups_by_status(self, status: str) -> List[tuple]:
+        sql = "SELECT uuid, app_id, file_path FROM backups WHERE status = ?"
+        return self.connections.connection().execute(sql, (status,)).fetchall()
+
+    @_timed_query
+    def get_backup_paths(self, status: str) -> List[str]:
+        sql = "SELECT file_path FROM backups WHERE status = ?"
+        return [row[0] for row in self.connections.connection().execute(sql, (status,))]
+
+    @_timed_query
     def update_tracked_app(self, tracked_app):
         sql = """
               UPDATE tracked_apps
               SET auto_update = ?,
                   file_path   = ?,
-                  cron = ?
+                  cron = ?,
+                  backup_mode = ?,
+                  incremental = ?,
+                  compression = ?,
+                  compression_level = ?,
+                  keep_last = ?,
+                  keep_daily = ?,
+                  keep_weekly = ?,
+                  keep_monthly = ?,
+                  continuous = ?,
+                  read_limit_mb_per_s = ?,
+                  cpu_workers = ?,
+                  storage = ?
               WHERE uuid = ?
               """
-        with sqlite3.connect(self.db_tracked_apps_path) as conn:
+        with self.connections.transaction() as conn:
             conn.execute(sql, (
                 tracked_app.auto_update,
                 tracked_app.file_path,
                 tracked_app.cron,
-                tracked_app.uuid,
+                tracked_app.backup_mode,
+                tracked_app.incremental,
+                tracked_app.compression,
+                tracked_app.compression_level,
+                tracked_app.keep_last,
+                tracked_app.keep_daily,
+                tracked_app.keep_weekly,
+                tracked_app.keep_monthly,
+                tracked_app.continuous,
+                tracked_app.read_limit_mb_per_s,
+                tracked_app.cpu_workers,
+                tracked_app.storage,
+                str(tracked_app.uuid),
             ))
-            conn.commit()
 
+    @_timed_query
     def get_all_backups(self) -> List[tuple]:
-        sql = "SELECT * FROM backups"
-        with sqlite3.connect(self.db_backups_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql)
-            return cursor.fetchall()
+        sql = f"SELECT {BACKUP_COLUMNS} FROM backups ORDER BY timestamp"
+        return self.connections.connection().execute(sql).fetchall()
 
+    @_timed_query
     def get_backup(self, backup_id) -> tuple:
-        sql = "SELECT * FROM backups WHERE uuid = ?"
-        with sqlite3.connect(self.db_backups_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, (backup_id,))
-            return cursor.fetchone()
\ No newline at end of file
+        sql = f"SELECT {BACKUP_COLUMNS} FROM backups WHERE uuid = ?"
+        return self.connections.connection().execute(sql, (backup_id,)).fetchone()
+
+    @_timed_query
+    def get_manifest(self, app_id: str) -> tuple:
+        sql = "SELECT backup_id, backup_mode FROM app_manifests WHERE app_id = ?"
+        return self.connections.connection().execute(sql, (app_id,)).fetchone()
+
+    @_timed_query
+    def get_manifest_files(self, app_id: str) -> List[tuple]:
+        sql = "SELECT path, size, mtime_ns, inode, hash FROM manifest_files WHERE app_id = ?"
+        return self.connections.connection().execute(sql, (app_id,)).fetchall()
+
+    @_timed_query
+    def get_manifest_totals(self, app_id: str) -> tuple:
+        sql = "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM manifest_files WHERE app_id = ?"
+        return self.connections.connection().execute(sql, (app_id,)).fetchone()
+
+    @_timed_query
+    def save_manifest(self, app_id: str, backup_id: str, backup_mode: str, entries: List[ManifestEntry]):
+        with self.connections.transaction() as conn:
+            conn.execute("DELETE FROM manifest_files WHERE app_id = ?", (app_id,))
+            conn.executemany(
+                """
+                INSERT INTO manifest_files (app_id, path, size, mtime_ns, inode, hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                ((app_id, e.path, e.size, e.mtime_ns, e.inode, e.hash) for e in entries)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO app_manifests (app_id, backup_id, backup_mode) VALUES (?, ?, ?)",
+                (app_id, backup_id, backup_mode)
+            )
+
+    @_timed_query
+    def delete_manifest(self, app_id: str):
+        with self.connections.transaction() as conn:
+            conn.execute("DELETE FROM manifest_files WHERE app_id = ?", (app_id,))
+            conn.execute("DELETE FROM app_manifests WHERE app_id = ?", (app_id,))
+            conn.execute("DELETE FROM database_pages WHERE app_id = ?", (app_id,))
+            conn.execute("DELETE FROM change_journal WHERE app_id = ?", (app_id,))
+
+    @_timed_query
+    def add_journal_paths(self, rows: List[tuple]):
+        with self.connections.transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO change_journal (app_id, path) VALUES (?, ?)", rows)
+
+    @_timed_query
+    def drain_journal(self, app_id: str) -> List[str]:
+        with self.connections.transaction() as conn:
+            paths = [row[0] for row in conn.execute("SELECT path FROM change_journal WHERE app_id = ?", (app_id,))]
+            conn.execute("DELETE FROM change_journal WHERE app_id = ?", (app_id,))
+        return paths
+
+    @_timed_query
+    def get_database_pages(self, app_id: str) -> List[tuple]:
+        sql = "SELECT path, page_size, page_count, hashes FROM database_pages WHERE app_id = ?"
+        return self.connections.connection().execute(sql, (app_id,)).fetchall()
+
+    @_timed_query
+    def save_database_pages(self, app_id: str, pages: List[tuple]):
+        with self.connections.transaction() as conn:
+            conn.execute("DELETE FROM database_pages WHERE app_id = ?", (app_id,))
+            conn.executemany(
+                "INSERT INTO database_pages (app_id, path, page_size, page_count, hashes) VALUES (?, ?, ?, ?, ?)",
+                ((app_id, *page) for page in pages)
+            )
+
+    @_timed_query
+    def save_catalog(self, app_id: str, entries: List[CatalogEntry]):
+        sql = """
+              INSERT OR REPLACE INTO backup_files (backup_id, app_id, path, size, mtime_ns, crc, hash)
+              VALUES (?, ?, ?, ?, ?, ?, ?)
+              """
+        with self.connections.transaction() as conn:
+            conn.executemany(sql, ((e.backup_id, app_id, e.path, e.size, e.mtime_ns, e.crc, e.hash) for e in entries))
+
+    @_timed_query
+    def get_catalog(self, backup_id: str, after_path: str, limit: int) -> List[tuple]:
+        sql = """
+              SELECT backup_id, path, size, mtime_ns, crc, hash
+              FROM backup_files
+              WHERE backup_id = ?
+                AND path > ?
+              ORDER BY path
+              LIMIT ?
+              """
+        return self.connections.connection().execute(sql, (backup_id, after_path, limit)).fetchall()
+
+    @_timed_query
+    def get_full_catalog(self, backup_id: str) -> List[tuple]:
+        sql = "SELECT backup_id, path, size, mtime_ns, crc, hash FROM backup_files WHERE backup_id = ?"
+        return self.connections.connection().execute(sql, (backup_id,)).fetchall()
+
+    @_timed_query
+    def get_catalog_hash(self, backup_id: str, path: str) -> str | None:
+        sql = "SELECT hash FROM backup_files WHERE backup_id = ? AND path = ?"
+        row = self.connections.connection().execute(sql, (backup_id, path)).fetchone()
+        return row[0] if row else None
+
+    @_timed_query
+    def get_due_scrubs(self, backup_status: str, verified_before: str, exclude: List[str], limit: int) -> List[tuple]:
+        # Interrupted scrubs come first so a restart picks up where it left off, then the least recently verified
+        sql = f"""
+              SELECT {SCRUB_COLUMNS}
+              FROM backups b
+                       LEFT JOIN backup_scrubs s ON s.backup_id = b.uuid
+              WHERE b.status = ?
+                AND (s.backup_id IS NULL OR s.verified_at IS NULL OR s.verified_at < ?)
+                AND b.uuid NOT IN (SELECT value FROM json_each(?))
+              ORDER BY s.next_member > 0 DESC, s.verified_at IS NOT NULL, s.verified_at, b.timestamp
+              LIMIT ?
+              """
+        return self.connections.connection().execute(
+            sql, (backup_status, verified_before, json.dumps(exclude), limit)
+        ).fetchall()
+
+    @_timed_query
+    def save_scrub(self, backup_id: str, status: str, verified_at: str | None, next_member: int,
+                   checked_members: int, checked_bytes: int, corrupt_members: list, error: str | None):
+        sql = """
+              INSERT OR REPLACE INTO backup_scrubs (backup_id, status, verified_at, next_member, checked_members,
+                                                    checked_bytes, corrupt_members, error)
+              SELECT ?, ?, ?, ?, ?, ?, ?, ?
+              WHERE EXISTS (SELECT 1 FROM backups WHERE uuid = ?)
+              """
+        with self.connections.transaction() as conn:
+            conn.execute(sql, (backup_id, status, verified_at, next_member, checked_members, checked_bytes,
+                               json.dumps(corrupt_members), error, backup_id))
+
+    @_timed_query
+    def get_scrub(self, backup_id: str) -> tuple | None:
+        sql = """
+              SELECT backup_id, status, verified_at, next_member, checked_members, checked_bytes, corrupt_members, error
+              FROM backup_scrubs
+              WHERE backup_id = ?
+              """
+        return self.connections.connection().execute(sql, (backup_id,)).fetchone()
+
+    @_timed_query
+    def get_scrub_totals(self) -> List[tuple]:
+        sql = "SELECT status, COUNT(*), MIN(verified_at) FROM backup_scrubs GROUP BY status"
+        return self.connections.connection().execute(sql).fetchall()
+
+    @_timed_query
+    def get_scheduled_job(self, job_id: str) -> tuple | None:
+        sql = "SELECT id, job_state FROM scheduled_jobs WHERE id = ?"
+        return self.connections.connection().execute(sql, (job_id,)).fetchone()
+
+    @_timed_query
+    def get_scheduled_jobs(self, due_before: float | None = None) -> List[tuple]:
+        # Paused jobs have no next run time and sort last, like APScheduler's own stores
+        sql = f"""
+              SELECT id, job_state
+              FROM scheduled_jobs
+              {"WHERE next_run_time <= ?" if due_before is not None else ""}
+              ORDER BY next_run_time IS NULL, next_run_time, id
+              """
+        params = (due_before,) if due_before is not None else ()
+        return self.connections.connection().execute(sql, params).fetchall()
+
+    @_timed_query
+    def get_next_scheduled_run(self) -> float | None:
+        sql = "SELECT MIN(next_run_time) FROM scheduled_jobs"
+        return self.connections.connection().execute(sql).fetchone()[0]
+
+    @_timed_query
+    def insert_scheduled_job(self, job_id: str, next_run_time: float | None, job_state: bytes) -> bool:
+        sql = "INSERT OR IGNORE INTO scheduled_jobs (id, next_run_time, job_state) VALUES (?, ?, ?)"
+        with self.connections.transaction() as conn:
+            return conn.execute(sql, (job_id, next_run_time, job_state)).rowcount > 0
+
+    @_timed_query
+    def update_scheduled_job(self, job_id: str, next_run_time: float | None, job_state: bytes) -> bool:
+        sql = "UPDATE scheduled_jobs SET next_run_time = ?, job_state = ? WHERE id = ?"
+        with self.connections.transaction() as conn:
+            return conn.execute(sql, (next_run_time, job_state, job_id)).rowcount > 0
+
+    @_timed_query
+    def delete_scheduled_jobs(self, job_ids: List[str] | None = None) -> int:
+        with self.connections.transaction() as conn:
+            if job_ids is None:
+                return conn.execute("DELETE FROM scheduled_jobs").rowcount
+            return conn.executemany("DELETE FROM scheduled_jobs WHERE id = ?", [(i,) for i in job_ids]).rowcount
+
+    @_timed_query
+    def save_resumable_upload(self, app_id: str, backup_id: str, location: str, upload_id: str):
+        sql = """
+              INSERT OR REPLACE INTO resumable_uploads (app_id, backup_id, location, upload_id, created_at)
+              VALUES (?, ?, ?, ?, ?)
+              """
+        with self.connections.transaction() as conn:
+            conn.execute(sql, (app_id, backup_id, location, upload_id, time.time()))
+
+    @_timed_query
+    def get_resumable_upload(self, app_id: str) -> tuple | None:
+        sql = "SELECT backup_id, location, upload_id FROM resumable_uploads WHERE app_id = ?"
+        return self.connections.connection().execute(sql, (app_id,)).fetchone()
+
+    @_timed_query
+    def get_resumable_uploads(self) -> List[tuple]:
+        sql = "SELECT app_id, location, upload_id, created_at FROM resumable_uploads"
+        return self.connections.connection().execute(sql).fetchall()
+
+    @_timed_query
+    def delete_resumable_upload(self, app_id: str):
+        with self.connections.transaction() as conn:
+            conn.execute("DELETE FROM resumable_uploads WHERE app_id = ?", (app_id,))
+
+    @_timed_query
+    def search_catalog(self, app_id: str, paths: List[str], glob: bool, limit: int) -> List[tuple]:
+        condition = " OR ".join(["f.path GLOB ?" if glob else "f.path = ?"] * len(paths))
+        sql = f"""
+              SELECT f.backup_id, f.path, f.size, f.mtime_ns, f.crc, f.hash, b.timestamp
+              FROM backup_files f
+                       JOIN backups b ON b.uuid = f.backup_id
+              WHERE f.app_id = ?
+                AND ({condition})
+              ORDER BY b.timestamp DESC, f.path
+              LIMIT ?
+              """
+        return self.connections.connection().execute(sql, (app_id, *paths, limit)).fetchall()
@@ -0,0 +1,392 @@
+import sqlite3
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _execute_script(conn: sqlite3.Connection, script: str):
+    # executescript commits whatever is pending first, this keeps the statements inside the migration's transaction
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _create_schema(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS tracked_apps
+        (
+            uuid              TEXT PRIMARY KEY NOT NULL,
+            file_path         TEXT             NOT NULL,
+            auto_update       BOOLEAN          NOT NULL,
+            cron              TEXT             NOT NULL,
+            backup_mode       TEXT             NOT NULL DEFAULT 'zip',
+            incremental       BOOLEAN          NOT NULL DEFAULT 0,
+            compression       TEXT             NOT NULL DEFAULT 'deflate',
+            compression_level INTEGER          NOT NULL DEFAULT 6
+        );
+
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_tracked_apps_file_path ON tracked_apps (file_path);
+
+        CREATE TABLE IF NOT EXISTS backups
+        (
+            uuid          TEXT PRIMARY KEY NOT NULL,
+            app_id        TEXT             NOT NULL,
+            file_path     TEXT             NOT NULL,
+            timestamp     TEXT             NOT NULL,
+            logical_size  INTEGER          NOT NULL DEFAULT 0,
+            physical_size INTEGER          NOT NULL DEFAULT 0,
+            parent_id     TEXT
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_backups_app_id_timestamp ON backups (app_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_backups_timestamp ON backups (timestamp);
+
+        CREATE TABLE IF NOT EXISTS app_manifests
+        (
+            app_id      TEXT PRIMARY KEY NOT NULL,
+            backup_id   TEXT             NOT NULL,
+            backup_mode TEXT             NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS manifest_files
+        (
+            app_id   TEXT    NOT NULL,
+            path     TEXT    NOT NULL,
+            size     INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode    INTEGER NOT NULL,
+            hash     TEXT    NOT NULL,
+            PRIMARY KEY (app_id, path)
+        ) WITHOUT ROWID;
+    """)
+
+
+def _merge_duplicate_apps(conn: sqlite3.Connection, columns: List[str], rows, merged: Dict[str, str]) -> list:
+    uuid_index, path_index = columns.index("uuid"), columns.index("file_path")
+    kept = dict(conn.execute("SELECT file_path, uuid FROM main.tracked_apps"))
+
+    unique = []
+    for row in rows:
+        file_path = row[path_index]
+        if file_path in kept:
+            # file_path is unique now, the duplicate's backups move to the app that keeps the path
+            merged[row[uuid_index]] = kept[file_path]
+            print("Merged duplicate tracked app", row[uuid_index], "into", kept[file_path], "for", file_path)
+            continue
+
+        kept[file_path] = row[uuid_index]
+        unique.append(row)
+
+    return unique
+
+
+def _import_legacy_databases(conn: sqlite3.Connection, data_dir: Path):
+    # Before the single schema, tracked apps and backups lived in two separate database files
+    legacy = {
+        data_dir / "tracked_apps.db": ["tracked_apps"],
+        data_dir / "backups.db": ["backups", "app_manifests", "manifest_files"],
+    }
+    merged: Dict[str, str] = {}
+    imported: List[Path] = []
+
+    for path, tables in legacy.items():
+        if not path.exists():
+            continue
+
+        # ATTACH isn't allowed inside the migration's transaction, the legacy file is read through its own connection
+        source = sqlite3.connect(path)
+        try:
+            for table in tables:
+                legacy_columns = [row[1] for row in source.execute(f"PRAGMA table_info({table})")]
+                if not legacy_columns:
+                    continue
+
+                columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+                columns = [column for column in columns if column in legacy_columns]
+                rows = source.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+
+                if table == "tracked_apps":
+                    rows = _merge_duplicate_apps(conn, columns, rows, merged)
+                elif table == "backups":
+                    app_index = columns.index("app_id")
+                    rows = [
+                        row[:app_index] + (merged.get(row[app_index], row[app_index]),) + row[app_index + 1:]
+                        for row in rows
+                    ]
+                else:
+                    # A merged app's manifest describes files the kept app never saw, its next sync starts over
+                    app_index = columns.index("app_id")
+                    rows = [row for row in rows if row[app_index] not in merged]
+
+                conn.executemany(
+                    f"INSERT INTO main.{table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+                )
+        finally:
+            source.close()
+        imported.append(path)
+
+    def rename_imported():
+        for path in imported:
+            path.rename(path.with_name(f"{path.name}.migrated"))
+            print("Migrated legacy database", path)
+
+    return rename_imported
+
+
+def _add_backup_stats(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        ALTER TABLE backups ADD COLUMN file_count INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE backups ADD COLUMN status TEXT NOT NULL DEFAULT 'succeeded';
+
+        CREATE TABLE IF NOT EXISTS backup_stats
+        (
+            app_id       TEXT PRIMARY KEY NOT NULL,
+            backup_count INTEGER          NOT NULL DEFAULT 0,
+            found_count  INTEGER          NOT NULL DEFAULT 0,
+            archive_size INTEGER          NOT NULL DEFAULT 0,
+            logical_size INTEGER          NOT NULL DEFAULT 0,
+            file_count   INTEGER          NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO backup_stats (app_id, backup_count, found_count, archive_size, logical_size, file_count)
+        SELECT app_id,
+               COUNT(*),
+               SUM(status != 'missing'),
+               SUM(CASE WHEN status != 'missing' THEN physical_size ELSE 0 END),
+               SUM(logical_size),
+               SUM(file_count)
+        FROM backups
+        GROUP BY app_id;
+
+        CREATE TRIGGER IF NOT EXISTS trg_backups_stats_insert
+            AFTER INSERT
+            ON backups
+        BEGIN
+            INSERT INTO backup_stats (app_id, backup_count, found_count, archive_size, logical_size, file_count)
+            VALUES (NEW.app_id,
+                    1,
+                    NEW.status != 'missing',
+                    CASE WHEN NEW.status != 'missing' THEN NEW.physical_size ELSE 0 END,
+                    NEW.logical_size,
+                    NEW.file_count)
+            ON CONFLICT (app_id) DO UPDATE SET backup_count = backup_count + 1,
+                                               found_count  = found_count + excluded.found_count,
+                                               archive_size = archive_size + excluded.archive_size,
+                                               logical_size = logical_size + excluded.logical_size,
+                                               file_count   = file_count + excluded.file_count;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_backups_stats_update
+            AFTER UPDATE OF status, physical_size, logical_size, file_count
+            ON backups
+        BEGIN
+            UPDATE backup_stats
+            SET found_count  = found_count + (NEW.status != 'missing') - (OLD.status != 'missing'),
+                archive_size = archive_size
+                    + CASE WHEN NEW.status != 'missing' THEN NEW.physical_size ELSE 0 END
+                    - CASE WHEN OLD.status != 'missing' THEN OLD.physical_size ELSE 0 END,
+                logical_size = logical_size + NEW.logical_size - OLD.logical_size,
+                file_count   = file_count + NEW.file_count - OLD.file_count
+            WHERE app_id = NEW.app_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_backups_stats_delete
+            AFTER DELETE
+            ON backups
+        BEGIN
+            UPDATE backup_stats
+            SET backup_count = backup_count - 1,
+                found_count  = found_count - (OLD.status != 'missing'),
+                archive_size = archive_size - CASE WHEN OLD.status != 'missing' THEN OLD.physical_size ELSE 0 END,
+                logical_size = logical_size - OLD.logical_size,
+                file_count   = file_count - OLD.file_count
+            WHERE app_id = OLD.app_id;
+        END;
+    """)
+
+
+def _add_backup_catalog(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS backup_files
+        (
+            backup_id TEXT    NOT NULL,
+            app_id    TEXT    NOT NULL,
+            path      TEXT    NOT NULL,
+            size      INTEGER NOT NULL,
+            mtime_ns  INTEGER NOT NULL,
+            crc       INTEGER,
+            hash      TEXT    NOT NULL,
+            PRIMARY KEY (backup_id, path)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_backup_files_app_id_path ON backup_files (app_id, path);
+
+        CREATE TRIGGER IF NOT EXISTS trg_backups_catalog_delete
+            AFTER DELETE
+            ON backups
+        BEGIN
+            DELETE FROM backup_files WHERE backup_id = OLD.uuid;
+        END;
+    """)
+
+
+def _add_retention(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        ALTER TABLE tracked_apps ADD COLUMN keep_last INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE tracked_apps ADD COLUMN keep_daily INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE tracked_apps ADD COLUMN keep_weekly INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE tracked_apps ADD COLUMN keep_monthly INTEGER NOT NULL DEFAULT 0;
+
+        CREATE INDEX IF NOT EXISTS idx_backups_parent_id ON backups (parent_id);
+    """)
+
+
+def _add_database_pages(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS database_pages
+        (
+            app_id     TEXT    NOT NULL,
+            path       TEXT    NOT NULL,
+            page_size  INTEGER NOT NULL,
+            page_count INTEGER NOT NULL,
+            hashes     BLOB    NOT NULL,
+            PRIMARY KEY (app_id, path)
+        ) WITHOUT ROWID;
+    """)
+
+
+def _add_change_journal(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        ALTER TABLE tracked_apps ADD COLUMN continuous BOOLEAN NOT NULL DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS change_journal
+        (
+            app_id TEXT NOT NULL,
+            path   TEXT NOT NULL,
+            PRIMARY KEY (app_id, path)
+        ) WITHOUT ROWID;
+    """)
+
+
+def _add_throttling(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        ALTER TABLE tracked_apps ADD COLUMN read_limit_mb_per_s INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE tracked_apps ADD COLUMN cpu_workers INTEGER NOT NULL DEFAULT 0;
+    """)
+
+
+def _add_storage(conn: sqlite3.Connection, data_dir: Path):
+    conn.execute("ALTER TABLE tracked_apps ADD COLUMN storage TEXT NOT NULL DEFAULT 'local'")
+
+
+def _add_sync_measurements(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        ALTER TABLE backups ADD COLUMN bytes_read INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE backups ADD COLUMN bytes_written INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE backups ADD COLUMN duration_seconds REAL NOT NULL DEFAULT 0;
+    """)
+
+
+def _add_scrubbing(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS backup_scrubs
+        (
+            backup_id       TEXT PRIMARY KEY NOT NULL,
+            status          TEXT             NOT NULL,
+            verified_at     TEXT,
+            next_member     INTEGER          NOT NULL DEFAULT 0,
+            checked_members INTEGER          NOT NULL DEFAULT 0,
+            checked_bytes   INTEGER          NOT NULL DEFAULT 0,
+            corrupt_members TEXT             NOT NULL DEFAULT '[]',
+            error           TEXT
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_backup_scrubs_verified_at ON backup_scrubs (verified_at);
+
+        CREATE TRIGGER IF NOT EXISTS trg_backups_scrub_delete
+            AFTER DELETE
+            ON backups
+        BEGIN
+            DELETE FROM backup_scrubs WHERE backup_id = OLD.uuid;
+        END;
+    """)
+
+
+def _add_scheduled_jobs(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS scheduled_jobs
+        (
+            id            TEXT PRIMARY KEY NOT NULL,
+            next_run_time REAL,
+            job_state     BLOB             NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_next_run_time ON scheduled_jobs (next_run_time);
+    """)
+
+
+def _add_resumable_uploads(conn: sqlite3.Connection, data_dir: Path):
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS resumable_uploads
+        (
+            app_id     TEXT PRIMARY KEY NOT NULL,
+            backup_id  TEXT             NOT NULL,
+            location   TEXT             NOT NULL,
+            upload_id  TEXT             NOT NULL,
+            created_at REAL             NOT NULL
+        );
+    """)
+
+
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection, Path], Optional[Callable[[], None]]]]] = [
+    (1, _create_schema),
+    (2, _import_legacy_databases),
+    (3, _add_backup_stats),
+    (4, _add_backup_catalog),
+    (5, _add_retention),
+    (6, _add_database_pages),
+    (7, _add_change_journal),
+    (8, _add_throttling),
+    (9, _add_storage),
+    (10, _add_sync_measurements),
+    (11, _add_scrubbing),
+    (12, _add_scheduled_jobs),
+    (13, _add_resumable_uploads),
+]
+
+
+def migrate(conn: sqlite3.Connection, data_dir: Path):
+    isolation_level = conn.isolation_level
+    # Each migration commits together with its user_version, an interrupted upgrade resumes at that migration
+    conn.isolation_level = None
+
+    try:
+        for version, migration in MIGRATIONS:
+            if version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+                continue
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied it while this one waited for the write lock
+                if version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+                    conn.execute("ROLLBACK")
+                    continue
+
+                print("Applying database migration", version)
+                after_commit = migration(conn, data_dir)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+            if after_commit is not None:
+                after_commit()
+    finally:
+        conn.isolation_level = isolation_level
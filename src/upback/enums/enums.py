@@ -0,0 +1,34 @@
+from enum import IntEnum, StrEnum
+
+
+class BackupMode(StrEnum):
+    ZIP = "zip"
+    CHUNKED = "chunked"
+
+
+class CompressionCodec(StrEnum):
+    DEFLATE = "deflate"
+    BZIP2 = "bzip2"
+    LZMA = "lzma"
+    STORED = "stored"
+
+
+class SyncPriority(IntEnum):
+    MANUAL = 0
+    SCHEDULED = 10
+    CONTINUOUS = 20
+
+
+class BackupStatus(StrEnum):
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    MISSING = "missing"
+
+
+class ScrubStatus(StrEnum):
+    VERIFYING = "verifying"
+    OK = "ok"
+    CORRUPT = "corrupt"
+    MISSING = "missing"
+    ERROR = "error"
@@ -1,23 +1,61 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
 import threading
 import time
 import zipfile
 from dataclasses import asdict
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from http import HTTPStatus
-from typing import List
+from typing import BinaryIO, Dict, List
 from uuid import UUID
 
 import uuid
 
-from apscheduler.triggers.cron import CronTrigger
-
+from upback.config.settings import settings
+from upback.constants.constants import BACKUPS_DIR, CHUNKS_DIR
+from upback.enums.enums import BackupMode, BackupStatus, CompressionCodec, SyncPriority
 from upback.exceptions.exceptions import ApiException
-from upback.models.models import TrackedApp, Backup, SyncStatus, BackupFile
+from upback.models.models import (
+    TrackedApp, Backup, BackupFile, ManifestEntry, BackupStats, RestoreStatus, CatalogEntry, SyncPlan
+)
 
 from upback.database.database import DB
-from upback.services.synchronization_service import running_syncs
-from upback.utils.utils import sse, normalize_path, get_next_run
+from upback.services.chunk_store import ChunkStore, write_manifest, read_manifest, MANIFEST_VERSION
+from upback.services.compression_policy import CompressionPolicy
+from upback.services.compression_service import ParallelZipWriter
+from upback.services.file_lock import FileLock
+from upback.services.plan_service import HISTORY_RUNS, plan_tree, sync_planner
+from upback.services.retention_service import (
+    has_policy, select_retained, remove_backup_files, sweep_chunks, pending_sweep
+)
+from upback.services.scrub_service import scrubber
+from upback.services.restore_service import RestoreItem, plan_restore, run_restore, running_restores
+from upback.services.scan_service import FileScanner, JournalScanner
+from upback.services.sqlite_snapshot_service import (
+    SQLITE_MEMBER, PAGES_PREFIX, is_sqlite, sidecar_of, has_pending_wal, take_snapshot, write_changed_pages
+)
+from upback.services.schedule_service import get_cron_trigger, schedule_timeline
+from upback.services.manifest_service import DELETED_MEMBER, entry_matches, find_deleted, to_manifest_entry
+from upback.services.event_service import event_bus, HEARTBEAT_INTERVAL, RESET
+from upback.services.sync_queue_service import SYNCS_LOCK, app_lock, sync_executor
+from upback.services.storage_service import (
+    DEFAULT_STORAGE, S3Backend, StorageBackend, delete_location, stat_location, storage_registry
+)
+from upback.services.s3_client import S3Error
+from upback.services.synchronization_service import SyncProgress, running_syncs
+from upback.services.throttle_service import IONICE_CLASSES, MB, SyncThrottle, throttle
+from upback.services.watch_service import change_watcher
+from upback.utils.utils import sse, sse_heartbeat, parse_event_id, normalize_path
+
+
+MIN_PUSH_INTERVAL = 0.25
+MAX_PAGE_SIZE = 1000
+SQLITE_EXTENT_SIZE = 64 * 1024
+SWEEP_WAIT_SECONDS = 30
 
 
 class UpBackFacade:
@@ -33,12 +71,7 @@ class UpBackFacade:
         if data is None:
             raise ApiException("Tracked app not found", code=404)
 
-        return TrackedApp(
-            uuid=data[0],
-            file_path=data[1],
-            auto_update=bool(data[2]),
-            cron=str(data[3])
-        )
+        return _to_tracked_app(data)
 
     def get_tracked_app_by_uuid(self, service_uuid: UUID) -> TrackedApp | None:
         data = self.db.get_tracked_app_by_uuid(service_uuid)
@@ -46,25 +79,33 @@ class UpBackFacade:
         if data is None:
             raise ApiException("Tracked app not found", code=404)
 
-        return TrackedApp(
-            uuid=data[0],
-            file_path=data[1],
-            auto_update=bool(data[2]),
-            cron=str(data[3])
-        )
+        return _to_tracked_app(data)
 
-    def save_tracked_apps(self, data: dict) -> HTTPStatus:
+    def save_tracked_apps(self, data: dict) -> TrackedApp:
         try:
             generated_uuid: UUID = uuid.uuid4()
             file_path: str = normalize_path(data["file_path"])
-            CronTrigger.from_crontab(data["cron"])
+            get_cron_trigger(data["cron"])
 
             tracked_app = TrackedApp(
                 uuid=generated_uuid,
                 file_path=str(file_path),
                 auto_update=bool(data["auto_update"]),
                 cron=str(data["cron"]),
+                backup_mode=_parse_backup_mode(data.get("backup_mode", BackupMode.ZIP)),
+                incremental=bool(data.get("incremental", False)),
+                compression=_parse_compression(data.get("compression", CompressionCodec.DEFLATE)),
+                compression_level=_parse_compression_level(data.get("compression_level", 6)),
+                keep_last=_parse_retention(data.get("keep_last", 0)),
+                keep_daily=_parse_retention(data.get("keep_daily", 0)),
+                keep_weekly=_parse_retention(data.get("keep_weekly", 0)),
+                keep_monthly=_parse_retention(data.get("keep_monthly", 0)),
+                continuous=bool(data.get("continuous", False)),
+                read_limit_mb_per_s=_parse_limit(data.get("read_limit_mb_per_s", 0), "read_limit_mb_per_s"),
+                cpu_workers=_parse_limit(data.get("cpu_workers", 0), "cpu_workers"),
+                storage=_parse_storage(data.get("storage", DEFAULT_STORAGE)),
             )
+            _check_storage(tracked_app)
 
             existing_app = None
             try:
@@ -74,7 +115,8 @@ class UpBackFacade:
 
             if existing_app is None:
                 self.db.save_tracked_app(tracked_app)
-                return HTTPStatus.CREATED
+                event_bus.publish("tracked_apps", "created", {"uuid": str(tracked_app.uuid), "cron": tracked_app.cron})
+                return tracked_app
             else:
                 raise ApiException("Tracked app already exists", code=HTTPStatus.CONFLICT)
         except KeyError:
@@ -82,95 +124,510 @@ class UpBackFacade:
 
     def get_tracked_apps(self) -> List[TrackedApp]:
         raw_rows = self.db.get_tracked_apps()
-        tracked_apps: List[TrackedApp] = [
-            TrackedApp(
-                uuid=row[0],
-                file_path=row[1],
-                auto_update=bool(row[2]),
-                cron=str(row[3])
-            )
-            for row in raw_rows
-        ]
+        tracked_apps: List[TrackedApp] = [_to_tracked_app(row) for row in raw_rows]
         return tracked_apps
 
     def __sync_app(self, tracked_app: TrackedApp, sync_id):
         source_dir = Path(tracked_app.file_path)
         folder_name = source_dir.stem
-        backup_dir = Path(__file__).parent.parent.parent.parent / "backups" / folder_name
+        backup_dir = BACKUPS_DIR / folder_name
         backup_dir.mkdir(parents=True, exist_ok=True)
 
         if not source_dir.is_dir():
             raise FileNotFoundError(f"{source_dir} could not be found")
 
         timestamp = datetime.now().timestamp()
-        zip_path = backup_dir / f"{sync_id}_{folder_name}.zip"
-
-        self.db.save_backup(Backup(
-            backup_id=sync_id,
-            app_id=str(tracked_app.uuid),
-            file_path=normalize_path(str(zip_path)),
-            timestamp=str(timestamp)
-        ))
-
-        files = [p for p in source_dir.rglob("*") if p.is_file()]
-        total_files = len(files)
-
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for idx, file in enumerate(files, start=1):
-                arcname = file.relative_to(source_dir.parent)
-                zipf.write(file, arcname)
-                running_syncs[sync_id] = SyncStatus(
-                    app_id=str(tracked_app.uuid),
-                    current=idx,
-                    total=total_files,
-                    file=str(file),
+
+        upload_id = None
+        if tracked_app.backup_mode == BackupMode.CHUNKED:
+            # Manifests only make sense next to the chunk store they reference
+            storage = storage_registry.get(DEFAULT_STORAGE)
+            archive_key = f"{folder_name}/{sync_id}_{folder_name}.manifest.json"
+            self.__discard_upload(str(tracked_app.uuid))
+        else:
+            storage = storage_registry.get(tracked_app.storage)
+            archive_key = f"{folder_name}/{sync_id}_{folder_name}.zip"
+            resumed = self.__take_resumable_upload(tracked_app, storage)
+            if resumed is not None:
+                archive_key, upload_id = resumed
+        archive_location = storage.location(archive_key)
+
+        parent, previous = self.__load_previous_manifest(tracked_app)
+
+        lease = None
+        progress = None
+        snapshot_dir = None
+
+        # Once the RUNNING row exists any failure has to mark it, and hand drained journal paths back through end_sync
+        try:
+            self.db.save_backup(Backup(
+                backup_id=sync_id,
+                app_id=str(tracked_app.uuid),
+                file_path=archive_location,
+                timestamp=str(timestamp),
+                parent_id=parent.backup_id if parent else None,
+                status=BackupStatus.RUNNING,
+            ))
+
+            lease = change_watcher.begin_sync(str(tracked_app.uuid))
+            if previous and lease is not None and lease.paths is not None:
+                scanner = JournalScanner(source_dir, previous, lease.paths, lease.links)
+            else:
+                estimated_total, estimated_bytes = self.db.get_manifest_totals(str(tracked_app.uuid))
+                scanner = FileScanner(source_dir, estimated_total=estimated_total, estimated_bytes=estimated_bytes)
+            progress = SyncProgress(sync_id, str(tracked_app.uuid), scanner)
+            # Consistent copies of live SQLite databases are staged here before they are archived
+            snapshot_dir = Path(tempfile.mkdtemp(prefix=".sqlite-", dir=backup_dir))
+            page_states = {row[0]: row for row in self.db.get_database_pages(str(tracked_app.uuid))}
+            limiter = throttle.configure_app(
+                str(tracked_app.uuid), tracked_app.read_limit_mb_per_s, tracked_app.cpu_workers
+            )
+
+            if tracked_app.backup_mode == BackupMode.CHUNKED:
+                parent_path = Path(self.db.get_backup(parent.backup_id)[2]) if parent else None
+                physical_size, current, catalog = self.__write_chunked(
+                    tracked_app, sync_id, scanner, progress, limiter, Path(archive_location), snapshot_dir, previous,
+                    parent_path
                 )
+                page_states = {}
+            else:
+                # The archive streams straight into the backend, a failed sync discards what was written so far
+                with storage.open_writer(archive_key, upload_id) as archive:
+                    if getattr(archive, "upload_id", None) is not None:
+                        # Kept until the archive is complete, the app's next sync continues it if this one fails
+                        self.db.save_resumable_upload(
+                            str(tracked_app.uuid), sync_id, archive_location, archive.upload_id
+                        )
+                    physical_size, current, catalog = self.__write_zip(
+                        tracked_app, scanner, progress, limiter, archive, snapshot_dir, previous, page_states
+                    )
+                self.db.delete_resumable_upload(str(tracked_app.uuid))
+                if parent is not None:
+                    catalog += self.__inherited_catalog(parent.backup_id, sync_id, current, catalog)
 
-        running_syncs.pop(sync_id)
+            logical_size = sum(entry.size for entry in current.values())
+            committing = time.perf_counter()
+            self.db.finish_backup(
+                sync_id, logical_size, physical_size, len(current), BackupStatus.SUCCEEDED,
+                progress.status.bytes_read, progress.status.bytes_written, progress.elapsed_seconds,
+            )
+            self.db.save_manifest(str(tracked_app.uuid), sync_id, tracked_app.backup_mode, list(current.values()))
+            self.db.save_catalog(str(tracked_app.uuid), catalog)
+            self.db.save_database_pages(
+                str(tracked_app.uuid), [state for path, state in page_states.items() if path in current]
+            )
+            progress.timings["db_commit"] = time.perf_counter() - committing
+        except Exception as e:
+            self.db.set_backup_status(sync_id, BackupStatus.FAILED)
+            # A partial manifest can't be restored, chunks it already stored are left for the next sweep
+            if tracked_app.backup_mode == BackupMode.CHUNKED:
+                Path(archive_location).unlink(missing_ok=True)
+                pending_sweep.set()
+            change_watcher.end_sync(lease, False)
+            if progress is not None:
+                progress.finish(BackupStatus.FAILED, str(e))
+            raise
+        finally:
+            if snapshot_dir is not None:
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
 
-    def sync_all_apps(self):
-        tracked_apps = self.get_tracked_apps()
+        change_watcher.end_sync(lease, True, scanner.links)
+        # Incremental plans are measured against the manifest this sync just replaced
+        sync_planner.invalidate(str(tracked_app.uuid))
+        progress.finish(BackupStatus.SUCCEEDED)
 
-        def __sync():
-            for app_index, tracked_app in enumerate(tracked_apps):
-                app_sync_id = str(uuid.uuid4())
+    def __take_resumable_upload(self, tracked_app: TrackedApp, storage: StorageBackend) -> tuple[str, str] | None:
+        """Key and upload id of the archive the app's last failed sync left unfinished, if this sync can continue it."""
+        row = self.db.get_resumable_upload(str(tracked_app.uuid))
+        if row is None:
+            return None
 
-                self.__sync_app(tracked_app, app_sync_id)
+        backup_id, location, upload_id = row
+        prefix = storage.location("")
+        if not location.startswith(prefix):
+            # The app moved to another storage since
+            self.__discard_upload(str(tracked_app.uuid))
+            return None
 
-        threading.Thread(target=__sync).start()
+        # Its row would otherwise point at the archive this sync completes, and pruning it would delete that
+        self.db.delete_backups([backup_id])
+        return location.removeprefix(prefix), upload_id
 
-        return HTTPStatus.ACCEPTED.value
+    def __discard_upload(self, app_id: str):
+        row = self.db.get_resumable_upload(app_id)
+        if row is None:
+            return
 
-    def sync_app_by_uuid(self, service_uuid: UUID):
-        tracked_app = self.get_tracked_app_by_uuid(service_uuid)
-        sync_id = str(uuid.uuid4())
+        _backup_id, location, upload_id = row
+        try:
+            storage_registry.for_location(location).abort_upload(location, upload_id)
+        except (KeyError, OSError, S3Error) as e:
+            print("Storage Error:", location, e)
+        self.db.delete_resumable_upload(app_id)
 
-        def __sync(_sync_id):
-            self.__sync_app(tracked_app, _sync_id)
+    def __load_previous_manifest(self, tracked_app: TrackedApp) -> tuple[Backup | None, Dict[str, ManifestEntry]]:
+        if not tracked_app.incremental:
+            return None, {}
 
-        threading.Thread(target=__sync, args=(sync_id,)).start()
+        manifest = self.db.get_manifest(str(tracked_app.uuid))
+        if manifest is None or manifest[1] != tracked_app.backup_mode:
+            return None, {}
 
-        return HTTPStatus.ACCEPTED.value
+        parent = self.db.get_backup(manifest[0])
+        if parent is None or stat_location(parent[2]) is None:
+            return None, {}
 
-    def stream_all_syncs(self):
-        while True:
-            current_syncs = {sid: asdict(status) for sid, status in running_syncs.items()}
+        previous = {
+            row[0]: ManifestEntry(path=row[0], size=row[1], mtime_ns=row[2], inode=row[3], hash=row[4])
+            for row in self.db.get_manifest_files(str(tracked_app.uuid))
+        }
+        return _to_backup(parent), previous
 
-            if not current_syncs:
-                yield sse(
-                    data={
-                        "current_app_syncs": {}
-                    },
-                    event="progress",
-                )
+    def __inherited_catalog(self, parent_id: str, sync_id: str, current: Dict[str, ManifestEntry],
+                            written: List[CatalogEntry]) -> List[CatalogEntry]:
+        # Unchanged files stay in the parent's archive, their rows carry over so the catalog lists every file
+        written_paths = {entry.path for entry in written}
+        parent_rows = {row[1]: row for row in self.db.get_full_catalog(parent_id)}
+        inherited = []
+
+        for path, entry in current.items():
+            if path in written_paths:
+                continue
+
+            row = parent_rows.get(path)
+            if row is not None:
+                inherited.append(CatalogEntry(sync_id, *row[1:]))
             else:
-                yield sse(
-                    data={
-                        "current_app_syncs": current_syncs
-                    },
-                    event="progress",
+                inherited.append(CatalogEntry(sync_id, path, entry.size, entry.mtime_ns, None, entry.hash))
+
+        return inherited
+
+    @staticmethod
+    def __write_zip(tracked_app: TrackedApp, scanner: FileScanner, progress: SyncProgress, limiter: SyncThrottle,
+                    archive: BinaryIO, snapshot_dir: Path, previous: Dict[str, ManifestEntry],
+                    page_states: Dict[str, tuple]):
+        current: Dict[str, ManifestEntry] = {}
+        catalog: List[CatalogEntry] = []
+        # Archive member name -> (arcname, original stat, snapshot) for databases archived from a snapshot
+        snapshots = {}
+        sqlite_deltas = {}
+
+        def pending_members():
+            for file, arcname, stat in scanner:
+                if stat is None:
+                    # Untouched since the last sync according to the change journal
+                    current[arcname] = previous[arcname]
+                    progress.advance(file, previous[arcname].size)
+                    continue
+
+                if sidecar_of(file) is not None:
+                    continue
+
+                entry = previous.get(arcname)
+                database = is_sqlite(file, stat)
+
+                if entry_matches(entry, stat) and not (database and has_pending_wal(file)):
+                    current[arcname] = entry
+                    progress.advance(file, stat.st_size)
+                    continue
+
+                if not database:
+                    yield file, arcname, stat
+                    continue
+
+                snapshot = take_snapshot(file, snapshot_dir, stat)
+                state = page_states.get(arcname)
+                page_states[arcname] = (arcname, snapshot.page_size, snapshot.page_count, snapshot.hashes)
+
+                # Only the changed pages go into incremental archives, restore applies them onto the parent's copy
+                if entry is not None and state is not None and state[1] == snapshot.page_size:
+                    member = f"{PAGES_PREFIX}{arcname}.pages"
+                    pages_path = snapshot.path.with_suffix(".pages")
+                    sqlite_deltas[arcname] = {
+                        "member": member,
+                        "page_size": snapshot.page_size,
+                        "page_count": snapshot.page_count,
+                        "pages": write_changed_pages(snapshot, state[3], pages_path),
+                    }
+                    os.utime(pages_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                    snapshots[member] = (arcname, stat, snapshot)
+                    yield pages_path, member, pages_path.stat()
+                else:
+                    snapshots[arcname] = (arcname, stat, snapshot)
+                    yield snapshot.path, arcname, snapshot.path.stat()
+
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zipf:
+            policy = CompressionPolicy(tracked_app.compression, tracked_app.compression_level)
+            writer = ParallelZipWriter(zipf, policy, limiter)
+
+            for file, zinfo, stat, file_hash in writer.write_members(pending_members()):
+                arcname, size, crc = zinfo.filename, zinfo.file_size, zinfo.CRC
+
+                if zinfo.filename in snapshots:
+                    arcname, stat, snapshot = snapshots[zinfo.filename]
+                    file, file_hash = Path(scanner.source_dir.parent, arcname), snapshot.sha256
+                    size = snapshot.page_count * snapshot.page_size
+                    crc = crc if arcname == zinfo.filename else None
+
+                current[arcname] = to_manifest_entry(arcname, stat, file_hash)
+                catalog.append(CatalogEntry(
+                    backup_id=progress.sync_id,
+                    path=arcname,
+                    size=size,
+                    mtime_ns=stat.st_mtime_ns,
+                    crc=crc,
+                    hash=file_hash,
+                ))
+                progress.advance(file, stat.st_size, zinfo.file_size, zinfo.compress_size)
+
+            if sqlite_deltas:
+                zipf.writestr(SQLITE_MEMBER, json.dumps(sqlite_deltas))
+            if previous:
+                zipf.writestr(DELETED_MEMBER, json.dumps(find_deleted(previous, current)))
+
+        progress.timings.update(
+            read=writer.read_seconds, compress=writer.compress_seconds, hash=writer.hash_seconds,
+            write=writer.write_seconds,
+        )
+
+        return archive.tell(), current, catalog
+
+    @staticmethod
+    def __write_chunked(tracked_app: TrackedApp, sync_id, scanner: FileScanner, progress: SyncProgress,
+                        limiter: SyncThrottle, manifest_path: Path, snapshot_dir: Path,
+                        previous: Dict[str, ManifestEntry], parent_path: Path | None):
+        chunk_store = ChunkStore(CHUNKS_DIR, limiter)
+        current: Dict[str, ManifestEntry] = {}
+        manifest_files = []
+        catalog: List[CatalogEntry] = []
+        physical_size = 0
+
+        parent_chunks = {}
+        if previous and parent_path is not None:
+            parent_chunks = {f["path"]: f["chunks"] for f in read_manifest(parent_path)["files"]}
+
+        for file, arcname, stat in scanner:
+            if stat is None and arcname not in parent_chunks:
+                # Unchanged according to the change journal, but without chunks to reuse it's read again
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+
+            if stat is not None and sidecar_of(file) is not None:
+                continue
+
+            entry = previous.get(arcname)
+            database = stat is not None and is_sqlite(file, stat)
+            unchanged = stat is None or (entry_matches(entry, stat) and not (database and has_pending_wal(file)))
+
+            if unchanged and arcname in parent_chunks:
+                digests = parent_chunks[arcname]
+                bytes_read = written = 0
+            elif database:
+                # Page aligned extents instead of content defined chunks, unchanged pages dedupe against earlier runs
+                snapshot = take_snapshot(file, snapshot_dir, stat)
+                digests, bytes_read, written, file_hash = chunk_store.store_file(
+                    snapshot.path, max(snapshot.page_size, SQLITE_EXTENT_SIZE)
                 )
-            time.sleep(1)
+                snapshot.path.unlink()
+                entry = to_manifest_entry(arcname, stat, file_hash)
+                physical_size += written
+            else:
+                digests, bytes_read, written, file_hash = chunk_store.store_file(file)
+                entry = to_manifest_entry(arcname, stat, file_hash)
+                physical_size += written
+
+            current[arcname] = entry
+            catalog.append(CatalogEntry(
+                backup_id=sync_id,
+                path=arcname,
+                size=entry.size,
+                mtime_ns=entry.mtime_ns,
+                crc=None,
+                hash=entry.hash,
+            ))
+            manifest_files.append({
+                "path": arcname,
+                "size": entry.size,
+                "mtime_ns": entry.mtime_ns,
+                "hash": entry.hash,
+                "chunks": digests,
+            })
+            progress.advance(file, entry.size, bytes_read, written)
+
+        progress.timings.update(
+            read=chunk_store.read_seconds,
+            compress=chunk_store.compress_seconds,
+            write=chunk_store.write_seconds,
+        )
+
+        write_manifest(manifest_path, {
+            "version": MANIFEST_VERSION,
+            "backup_id": sync_id,
+            "app_id": str(tracked_app.uuid),
+            "files": manifest_files,
+        })
+
+        return physical_size + manifest_path.stat().st_size, current, catalog
+
+    def sync_all_apps(self, priority: int = SyncPriority.MANUAL):
+        for tracked_app in self.get_tracked_apps():
+            self.__submit_sync(tracked_app, priority)
+
+        return HTTPStatus.ACCEPTED.value
+
+    def sync_app_by_uuid(self, service_uuid: UUID, priority: int = SyncPriority.MANUAL):
+        self.submit_sync(service_uuid, priority)
+
+        return HTTPStatus.ACCEPTED.value
+
+    def submit_sync(self, service_uuid: UUID, priority: int = SyncPriority.MANUAL) -> str:
+        """Queues a sync and returns its id, or the id of the one already queued or running for the app."""
+        return self.__submit_sync(self.get_tracked_app_by_uuid(service_uuid), priority)
+
+    def plan_sync(self, app_id: UUID, refresh: bool = False) -> SyncPlan:
+        tracked_app = self.get_tracked_app_by_uuid(app_id)
+        return sync_planner.get(str(tracked_app.uuid), lambda: self.__plan(tracked_app), refresh)
+
+    def plan_folder(self, data: dict) -> SyncPlan:
+        """Plans a folder that isn't tracked yet, nothing is known about it so it is planned as a full sync."""
+        if not data.get("file_path"):
+            raise ApiException("Invalid parameters", code=400)
+
+        source_dir = Path(normalize_path(data["file_path"]))
+        if not source_dir.is_dir():
+            raise ApiException("Invalid path", code=400)
+
+        codec = _parse_compression(data.get("compression", CompressionCodec.DEFLATE))
+        return plan_tree(source_dir, {}, codec, [])
+
+    def __plan(self, tracked_app: TrackedApp) -> SyncPlan:
+        source_dir = Path(tracked_app.file_path)
+        if not source_dir.is_dir():
+            raise ApiException(f"{source_dir} could not be found", code=404)
+
+        _parent, previous = self.__load_previous_manifest(tracked_app)
+        measurements = self.db.get_sync_measurements(str(tracked_app.uuid), BackupStatus.SUCCEEDED, HISTORY_RUNS)
+        read_limits = [
+            limit * MB for limit in (tracked_app.read_limit_mb_per_s, settings.read_limit_mb_per_s) if limit > 0
+        ]
+        # Chunks are always deflated, the codec setting only applies to zip archives
+        codec = CompressionCodec.DEFLATE if tracked_app.backup_mode == BackupMode.CHUNKED else tracked_app.compression
+
+        return plan_tree(source_dir, previous, codec, measurements, min(read_limits, default=0))
+
+    def trigger_continuous_sync(self, app_id: str) -> bool:
+        """Called by the change watcher, returns False while a sync is running so the changes stay pending."""
+        if sync_executor.is_running(app_id):
+            return False
+
+        tracked_app = self.get_tracked_app_by_uuid(app_id)
+        if tracked_app.continuous:
+            self.__submit_sync(tracked_app, SyncPriority.CONTINUOUS)
+        return True
+
+    def __submit_sync(self, tracked_app: TrackedApp, priority: int) -> str:
+        sync_id, queued = sync_executor.submit(
+            str(tracked_app.uuid),
+            lambda _sync_id: self.__sync_app(tracked_app, _sync_id),
+            priority,
+        )
+
+        if not queued:
+            print("Sync already queued or running for", tracked_app.file_path)
+
+        return sync_id
+
+    def stream_all_syncs(self, last_event_id: str | None = None):
+        return self.__stream_topic("syncs", self.__syncs_snapshot, last_event_id)
+
+    def stream_all_syncs_async(self, last_event_id: str | None = None):
+        return self.__stream_topic_async("syncs", self.__syncs_snapshot, last_event_id)
+
+    def stream_all_restores(self, last_event_id: str | None = None):
+        return self.__stream_topic(
+            "restores",
+            lambda: {"current_restores": {rid: asdict(status) for rid, status in running_restores.items()}},
+            last_event_id,
+        )
+
+    @staticmethod
+    def __syncs_snapshot() -> dict:
+        return {
+            "current_app_syncs": {sid: asdict(status) for sid, status in running_syncs.items()},
+            "queue": sync_executor.snapshot(),
+        }
+
+    @staticmethod
+    def __stream_start(snapshot, last_event_id: str | None) -> tuple[int, str | None]:
+        after_id = parse_event_id(last_event_id)
+
+        # A full snapshot is only needed for new clients or when the resume point fell out of the history
+        if after_id is None or not event_bus.has_history(after_id):
+            after_id = event_bus.last_id
+            return after_id, sse(data=snapshot(), event="progress", id=after_id)
+        return after_id, None
+
+    @staticmethod
+    def __coalesce(events, snapshot) -> List[str]:
+        if events[0].event == RESET:
+            return [sse(data=snapshot(), event="progress", id=events[0].id)]
+
+        # Only push the latest state per job, progress can be published far faster than clients need it
+        latest = {}
+        for event in events:
+            key = (event.event, event.data.get("sync_id") or event.data.get("restore_id"))
+            latest.pop(key, None)
+            latest[key] = event
+
+        return [sse(data=event.data, event=event.event, id=event.id) for event in latest.values()]
+
+    @staticmethod
+    def __stream_topic(topic: str, snapshot, last_event_id: str | None):
+        event_bus.subscribe()
+        try:
+            after_id, message = UpBackFacade.__stream_start(snapshot, last_event_id)
+            if message:
+                yield message
+
+            while True:
+                events, after_id = event_bus.wait(after_id, {topic}, HEARTBEAT_INTERVAL)
+
+                if not events:
+                    yield sse_heartbeat()
+                    continue
+
+                yield from UpBackFacade.__coalesce(events, snapshot)
+                time.sleep(MIN_PUSH_INTERVAL)
+        finally:
+            event_bus.unsubscribe()
+
+    @staticmethod
+    async def __stream_topic_async(topic: str, snapshot, last_event_id: str | None):
+        event_bus.subscribe()
+        try:
+            after_id, message = UpBackFacade.__stream_start(snapshot, last_event_id)
+            if message:
+                yield message
+
+            while True:
+                events, after_id = await event_bus.wait_async(after_id, {topic}, HEARTBEAT_INTERVAL)
+
+                if not events:
+                    yield sse_heartbeat()
+                    continue
+
+                for message in UpBackFacade.__coalesce(events, snapshot):
+                    yield message
+                await asyncio.sleep(MIN_PUSH_INTERVAL)
+        finally:
+            event_bus.unsubscribe()
+
+    def get_upcoming_runs(self, limit: int = 20, hours: float | None = None, enabled_only: bool = True) -> List[dict]:
+        tracked_apps = [app for app in self.get_tracked_apps() if app.auto_update or not enabled_only]
+        horizon = timedelta(hours=hours) if hours is not None else None
+        return schedule_timeline.upcoming(tracked_apps, limit, horizon)
 
     def get_app_backups(self, app_id: UUID) -> List[Backup]:
         backup_data = self.db.get_backups(app_id)
@@ -178,22 +635,57 @@ class UpBackFacade:
         backups: List[Backup] = []
 
         for backup in backup_data:
-            backups.append(Backup(
-                backup_id=backup[0],
-                app_id=backup[1],
-                file_path=backup[2].split("/")[-1],
-                timestamp=backup[3],
-            ))
+            backups.append(_to_backup(backup, file_name_only=True))
 
         return backups
 
     def delete_tracked_app_by_uuid(self, app_id: UUID):
-        backups = self.get_app_backups(app_id)
+        backups = [_to_backup(row) for row in self.db.get_backups(app_id)]
 
-        for backup in backups:
-            self.db.delete_backup(backup.backup_id)
+        remove_backup_files(backups, _syncs_running)
+        self.db.delete_backups([backup.backup_id for backup in backups])
+        self.__discard_upload(str(app_id))
 
+        self.db.delete_manifest(str(app_id))
         self.db.delete_tracked_app(app_id)
+        throttle.remove_app(str(app_id))
+        schedule_timeline.invalidate(str(app_id))
+        sync_planner.invalidate(str(app_id))
+        event_bus.publish("tracked_apps", "deleted", {"uuid": str(app_id)})
+
+    def get_storage_backends(self) -> List[dict]:
+        return [storage.describe() for storage in storage_registry.all()]
+
+    def get_throttle(self) -> dict:
+        return throttle.snapshot()
+
+    def update_throttle(self, data: dict) -> dict:
+        read_limit = _parse_limit(data.get("read_limit_mb_per_s", settings.read_limit_mb_per_s), "read_limit_mb_per_s")
+        cpu_workers = _parse_limit(data.get("cpu_workers", settings.cpu_workers), "cpu_workers")
+
+        try:
+            nice = int(data.get("nice", settings.sync_nice))
+            ionice_class = int(data.get("ionice_class", settings.sync_ionice_class))
+        except (TypeError, ValueError):
+            raise ApiException("Invalid priority", code=400)
+
+        if not 0 <= nice <= 19:
+            raise ApiException("nice must be between 0 and 19", code=400)
+        if ionice_class not in IONICE_CLASSES:
+            raise ApiException(f"ionice_class must be one of {sorted(IONICE_CLASSES)}", code=400)
+
+        settings.read_limit_mb_per_s = read_limit
+        settings.cpu_workers = cpu_workers
+        settings.sync_nice = nice
+        settings.sync_ionice_class = ionice_class
+        settings.adaptive_throttle = bool(data.get("adaptive", settings.adaptive_throttle))
+        throttle.apply_settings()
+        try:
+            throttle.save()
+        except OSError as e:
+            print("Throttle Error:", e)
+
+        return throttle.snapshot()
 
     def get_tracked_app_status(self, app_id) -> bool:
         return self.get_tracked_app_by_uuid(app_id).auto_update
@@ -205,8 +697,28 @@ class UpBackFacade:
             file_path=normalize_path(tracked_app.file_path),
             auto_update=bool(data.get("auto_update")),
             cron=str(data.get("cron")),
+            backup_mode=_parse_backup_mode(data.get("backup_mode", tracked_app.backup_mode)),
+            incremental=bool(data.get("incremental", tracked_app.incremental)),
+            compression=_parse_compression(data.get("compression", tracked_app.compression)),
+            compression_level=_parse_compression_level(data.get("compression_level", tracked_app.compression_level)),
+            keep_last=_parse_retention(data.get("keep_last", tracked_app.keep_last)),
+            keep_daily=_parse_retention(data.get("keep_daily", tracked_app.keep_daily)),
+            keep_weekly=_parse_retention(data.get("keep_weekly", tracked_app.keep_weekly)),
+            keep_monthly=_parse_retention(data.get("keep_monthly", tracked_app.keep_monthly)),
+            continuous=bool(data.get("continuous", tracked_app.continuous)),
+            read_limit_mb_per_s=_parse_limit(
+                data.get("read_limit_mb_per_s", tracked_app.read_limit_mb_per_s), "read_limit_mb_per_s"
+            ),
+            cpu_workers=_parse_limit(data.get("cpu_workers", tracked_app.cpu_workers), "cpu_workers"),
+            storage=_parse_storage(data.get("storage", tracked_app.storage)),
         )
+        _check_storage(tracked_app)
         self.db.update_tracked_app(tracked_app)
+        # Running syncs look their limits up per read, so this applies without restarting them
+        throttle.configure_app(str(tracked_app.uuid), tracked_app.read_limit_mb_per_s, tracked_app.cpu_workers)
+        schedule_timeline.invalidate(str(tracked_app.uuid))
+        sync_planner.invalidate(str(tracked_app.uuid))
+        event_bus.publish("tracked_apps", "updated", {"uuid": str(tracked_app.uuid), "cron": tracked_app.cron})
 
     def get_all_backups(self) -> List[Backup]:
         backup_data = self.db.get_all_backups()
@@ -214,32 +726,450 @@ class UpBackFacade:
         backups: List[Backup] = []
 
         for backup in backup_data:
-            backups.append(Backup(
-                backup_id=backup[0],
-                app_id=backup[1],
-                file_path=backup[2].split("/")[-1],
-                timestamp=backup[3],
-            ))
+            backups.append(_to_backup(backup, file_name_only=True))
 
         return backups
 
     def get_backup_files(self, backup_id: str) -> BackupFile | None:
         backup = self.db.get_backup(backup_id)
-        file_path = Path(backup[2])
+        stored = stat_location(backup[2])
+
+        if stored is not None:
+            file_size = stored.size
+            physical_size = backup[5]
+
+            # Chunked backups only own the manifest file, the chunks they added live in the shared store
+            if backup[2].endswith(".json"):
+                file_size = physical_size
 
-        if file_path.exists():
-            file_size = file_path.stat().st_size
             return BackupFile(
                 backup_id=backup[0],
                 app_id=backup[1],
                 file_size=file_size,
-                file_path=str(file_path),
+                file_path=backup[2],
+                logical_size=backup[4],
+                physical_size=physical_size,
             )
 
         return None
 
+    def get_backup_stats(self) -> BackupStats:
+        return BackupStats(*self.db.get_backup_totals())
+
+    def get_app_backup_stats(self, app_id: UUID) -> BackupStats:
+        stats = self.db.get_app_backup_stats(str(app_id))
+
+        if stats is None:
+            return BackupStats(backup_count=0, found_count=0, archive_size=0, logical_size=0, file_count=0)
+
+        return BackupStats(*stats)
+
+    def fail_interrupted_backups(self) -> int:
+        """Marks backups left RUNNING by a worker that died mid-sync as FAILED and removes what they wrote."""
+        interrupted = 0
+        for backup_id, app_id, file_path in self.db.get_backups_by_status(BackupStatus.RUNNING):
+            # A sync holds its app lock for as long as it runs, in whichever worker it runs
+            lock = app_lock(app_id)
+            if not lock.acquire(timeout=0):
+                continue
+
+            try:
+                # The sync may have finished between the query and the lock
+                if not self.db.replace_backup_status(backup_id, BackupStatus.RUNNING, BackupStatus.FAILED):
+                    continue
+                interrupted += 1
+                try:
+                    delete_location(file_path)
+                except (KeyError, OSError, S3Error) as e:
+                    print("Storage Error:", file_path, e)
+            finally:
+                lock.release()
+
+            # Chunks an interrupted chunked sync already stored are only referenced by its partial manifest
+            if file_path.endswith(".manifest.json"):
+                pending_sweep.set()
+
+        return interrupted
+
+    def reconcile_backups(self, batch_size: int = 500) -> dict:
+        # Server workers that died mid-sync while another one kept the scheduler
+        interrupted = self.fail_interrupted_backups()
+        checked = 0
+        missing = 0
+        found = 0
+        after_id = ""
+
+        while rows := self.db.get_backup_locations(after_id, batch_size):
+            updates = []
+
+            for backup_id, file_path, status, physical_size in rows:
+                after_id = backup_id
+                checked += 1
+                if status not in (BackupStatus.SUCCEEDED, BackupStatus.MISSING):
+                    continue
+
+                stored = stat_location(file_path)
+
+                if status == BackupStatus.SUCCEEDED and stored is None:
+                    updates.append((BackupStatus.MISSING.value, physical_size, backup_id))
+                    missing += 1
+                elif stored is not None and (status == BackupStatus.MISSING or physical_size == 0):
+                    # Rows from before sizes were recorded get their archive size filled in once
+                    updates.append((BackupStatus.SUCCEEDED.value, physical_size or stored.size, backup_id))
+                    found += 1
+
+            if updates:
+                self.db.update_backup_locations(updates)
+
+        # Uploads of failed syncs wait this long for the app's next sync to resume them
+        expires = time.time() - settings.upload_resume_hours * 3600
+        resumable = set()
+        for app_id, location, _upload_id, created_at in self.db.get_resumable_uploads():
+            lock = app_lock(app_id)
+            if created_at >= expires or not lock.acquire(timeout=0):
+                resumable.add(location)
+                continue
+            try:
+                self.__discard_upload(app_id)
+            finally:
+                lock.release()
+
+        # Multipart uploads of syncs that died with the process would otherwise be billed forever
+        running = set(self.db.get_backup_paths(BackupStatus.RUNNING)) | resumable
+        aborted = 0
+        for storage in storage_registry.all():
+            if isinstance(storage, S3Backend):
+                try:
+                    aborted += storage.abort_uploads(running)
+                except (OSError, S3Error) as e:
+                    print("Storage Error:", storage.name, e)
+
+        return {
+            "checked": checked,
+            "missing": missing,
+            "found": found,
+            "interrupted": interrupted,
+            "aborted_uploads": aborted,
+        }
+
+    def prune_backups(self, app_id: UUID | None = None, dry_run: bool = False) -> dict:
+        tracked_apps = [self.get_tracked_app_by_uuid(app_id)] if app_id else self.get_tracked_apps()
+        apps = []
+        deleted = 0
+        reclaimed_bytes = 0
+
+        for tracked_app in tracked_apps:
+            if not has_policy(tracked_app):
+                continue
+
+            backups = [_to_backup(row) for row in self.db.get_backups(tracked_app.uuid)]
+            retained = select_retained(tracked_app, backups)
+            expired = [backup for backup in backups if backup.backup_id not in retained]
+
+            if not expired:
+                continue
+
+            if dry_run:
+                app_reclaimed = sum(_file_size(backup.file_path) for backup in expired)
+            else:
+                app_reclaimed = remove_backup_files(expired, _syncs_running)
+                self.db.delete_backups([backup.backup_id for backup in expired])
+                event_bus.publish("backups", "pruned", {
+                    "app_id": str(tracked_app.uuid),
+                    "deleted": len(expired),
+                    "reclaimed_bytes": app_reclaimed,
+                })
+
+            deleted += len(expired)
+            reclaimed_bytes += app_reclaimed
+            apps.append({
+                "app_id": str(tracked_app.uuid),
+                "retained": len(retained),
+                "deleted": [
+                    {"backup_id": b.backup_id, "timestamp": b.timestamp, "file_path": b.file_path, "status": b.status}
+                    for b in expired
+                ],
+                "reclaimed_bytes": app_reclaimed,
+            })
+
+        chunks_removed = 0
+        if not dry_run and pending_sweep.is_set():
+            # A running chunked sync writes its chunks before its manifest, so only sweep while no sync runs
+            # Other server workers hold the syncs lock shared while they sync
+            syncs = FileLock(SYNCS_LOCK)
+            with sync_executor.paused(SWEEP_WAIT_SECONDS) as idle:
+                if idle and syncs.acquire(timeout=SWEEP_WAIT_SECONDS):
+                    try:
+                        manifests = [
+                            path for path in self.db.get_backup_paths(BackupStatus.SUCCEEDED)
+                            if path.endswith(".manifest.json")
+                        ]
+                        chunks_removed, chunk_bytes = sweep_chunks(ChunkStore(CHUNKS_DIR), manifests)
+                        reclaimed_bytes += chunk_bytes
+                    finally:
+                        syncs.release()
+
+        return {
+            "dry_run": dry_run,
+            "apps": apps,
+            "deleted": deleted,
+            "chunks_removed": chunks_removed,
+            "reclaimed_bytes": reclaimed_bytes,
+        }
+
+    def scrub_backups(self) -> Dict[str, int] | None:
+        return scrubber.run(self.db, CHUNKS_DIR)
+
+    def start_scrub(self) -> HTTPStatus:
+        if scrubber.running:
+            raise ApiException("A scrub is already running", code=HTTPStatus.CONFLICT)
+
+        threading.Thread(target=self.scrub_backups, name="upback-scrub-run", daemon=True).start()
+        return HTTPStatus.ACCEPTED
+
+    def get_scrub_status(self) -> dict:
+        return {
+            "running": scrubber.running,
+            "bytes_read": scrubber.verified_bytes,
+            "read_limit_mb_per_s": settings.scrub_read_limit_mb_per_s,
+            "max_age_days": settings.scrub_max_age_days,
+            "backups": {
+                status: {"count": count, "oldest_verified_at": oldest}
+                for status, count, oldest in self.db.get_scrub_totals()
+            },
+        }
+
+    def get_backup_scrub(self, backup_id: str) -> dict:
+        row = self.db.get_scrub(backup_id)
+        if row is None:
+            raise ApiException("Backup has not been scrubbed yet", code=404)
+
+        return {
+            "backup_id": row[0],
+            "status": row[1],
+            "verified_at": row[2],
+            "next_member": row[3],
+            "checked_members": row[4],
+            "checked_bytes": row[5],
+            "corrupt_members": json.loads(row[6]),
+            "error": row[7],
+        }
+
+    def get_backup_catalog(self, backup_id: str, cursor: str | None = None, limit: int = 100) -> dict:
+        if self.db.get_backup(backup_id) is None:
+            raise ApiException("Backup not found", code=404)
+
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        rows = self.db.get_catalog(backup_id, cursor or "", limit + 1)
+        entries = [CatalogEntry(*row) for row in rows[:limit]]
+
+        return {
+            "files": [asdict(entry) for entry in entries],
+            "next_cursor": entries[-1].path if len(rows) > limit else None,
+        }
+
+    def search_backup_files(self, app_id: UUID, pattern: str, limit: int = 100) -> List[dict]:
+        tracked_app = self.get_tracked_app_by_uuid(app_id)
+        folder_name = Path(tracked_app.file_path).name
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        # Catalog paths start with the tracked folder name, accept patterns with or without it
+        paths = [pattern]
+        if not pattern.startswith(f"{folder_name}/"):
+            paths.append(f"{folder_name}/{pattern}")
+
+        glob = any(char in pattern for char in "*?[")
+        rows = self.db.search_catalog(str(tracked_app.uuid), paths, glob, limit)
+
+        return [
+            {**asdict(CatalogEntry(*row[:6])), "timestamp": row[6]}
+            for row in rows
+        ]
+
+    def plan_restore(self, backup_id: str, patterns: List[str] | None = None) -> List[RestoreItem]:
+        chain = self.get_backup_chain(backup_id)
+        target = chain[-1]
+
+        if target.status != BackupStatus.SUCCEEDED:
+            raise ApiException(f"Backup is {target.status} and can't be restored", code=409)
+
+        backup_mode = BackupMode.CHUNKED if target.file_path.endswith(".manifest.json") else BackupMode.ZIP
+
+        try:
+            return plan_restore(chain, backup_mode, patterns)
+        except FileNotFoundError as e:
+            raise ApiException(f"Backup archive is missing: {e.filename}", code=409)
+
+    def restore_backup(self, backup_id: str, patterns: List[str] | None = None, target: str | None = None,
+                       wait: bool = False) -> tuple[str, Path]:
+        items = self.plan_restore(backup_id, patterns)
+        restore_id = str(uuid.uuid4())
+        target_dir = Path(normalize_path(target)) if target else BACKUPS_DIR / "restores" / restore_id
+
+        status = RestoreStatus(
+            backup_id=backup_id,
+            current=0,
+            total=len(items),
+            bytes_written=0,
+            total_bytes=sum(item.size for item in items),
+            file="",
+            target=str(target_dir),
+        )
+        running_restores[restore_id] = status
+        last_publish = 0.0
+
+        def on_progress(item: RestoreItem, current: int, bytes_written: int):
+            nonlocal last_publish
+            status.current = current
+            status.bytes_written = bytes_written
+            status.file = item.path
+
+            now = time.monotonic()
+            if now - last_publish >= MIN_PUSH_INTERVAL or current == status.total:
+                last_publish = now
+                event_bus.publish("restores", "restore_progress", {"restore_id": restore_id, "status": asdict(status)})
+
+        def __restore():
+            try:
+                run_restore(items, target_dir, ChunkStore(CHUNKS_DIR), on_progress)
+            except Exception as e:
+                status.error = str(e)
+                print("Restore Error:", restore_id, e)
+            finally:
+                status.finished = True
+                running_restores.pop(restore_id, None)
+                event_bus.publish("restores", "restore_finished", {"restore_id": restore_id, "status": asdict(status)})
+
+        if wait:
+            __restore()
+            if status.error is not None:
+                raise ApiException(f"Restore failed: {status.error}", code=500)
+        else:
+            threading.Thread(target=__restore, name=f"upback-restore-{restore_id}", daemon=True).start()
+
+        return restore_id, target_dir
+
+    def get_backup_chain(self, backup_id: str) -> List[Backup]:
+        chain: List[Backup] = []
+        row = self.db.get_backup(backup_id)
+
+        if row is None:
+            raise ApiException("Backup not found", code=404)
+
+        while row is not None:
+            backup = _to_backup(row)
+            chain.append(backup)
+            if backup.parent_id is None:
+                break
+            row = self.db.get_backup(backup.parent_id)
+            if row is None:
+                raise ApiException(f"Parent backup {backup.parent_id} is missing", code=409)
+
+        chain.reverse()
+        return chain
+
+
+def _to_tracked_app(row: tuple) -> TrackedApp:
+    return TrackedApp(
+        uuid=row[0],
+        file_path=row[1],
+        auto_update=bool(row[2]),
+        cron=str(row[3]),
+        backup_mode=str(row[4]),
+        incremental=bool(row[5]),
+        compression=str(row[6]),
+        compression_level=int(row[7]),
+        keep_last=int(row[8]),
+        keep_daily=int(row[9]),
+        keep_weekly=int(row[10]),
+        keep_monthly=int(row[11]),
+        continuous=bool(row[12]),
+        read_limit_mb_per_s=int(row[13]),
+        cpu_workers=int(row[14]),
+        storage=str(row[15]),
+    )
+
+
+def _to_backup(row: tuple, file_name_only: bool = False) -> Backup:
+    return Backup(
+        backup_id=row[0],
+        app_id=row[1],
+        file_path=row[2].split("/")[-1] if file_name_only else row[2],
+        timestamp=row[3],
+        logical_size=row[4],
+        physical_size=row[5],
+        parent_id=row[6],
+        file_count=row[7],
+        status=row[8],
+    )
+
+
+def _file_size(file_path: str) -> int:
+    stored = stat_location(file_path)
+    return stored.size if stored is not None else 0
+
+
+def _syncs_running() -> bool:
+    return sync_executor.running_anywhere()
+
+
+def _parse_backup_mode(value) -> str:
+    try:
+        return BackupMode(value).value
+    except ValueError:
+        raise ApiException("Invalid backup mode", code=400)
+
+
+def _parse_compression(value) -> str:
+    try:
+        return CompressionCodec(value).value
+    except ValueError:
+        raise ApiException("Invalid compression codec", code=400)
+
+
+def _parse_compression_level(value) -> int:
+    try:
+        level = int(value)
+    except (TypeError, ValueError):
+        raise ApiException("Invalid compression level", code=400)
+
+    if not 1 <= level <= 9:
+        raise ApiException("Compression level must be between 1 and 9", code=400)
+
+    return level
+
+
+def _parse_retention(value) -> int:
+    try:
+        keep = int(value)
+    except (TypeError, ValueError):
+        raise ApiException("Invalid retention value", code=400)
+
+    if keep < 0:
+        raise ApiException("Retention values can't be negative", code=400)
+
+    return keep
+
+
+def _parse_limit(value, name: str) -> int:
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ApiException(f"Invalid {name}", code=400)
+
+    if limit < 0:
+        raise ApiException(f"{name} can't be negative", code=400)
 
+    return limit
 
 
+def _parse_storage(value) -> str:
+    storage = str(value)
+    if storage not in storage_registry.names():
+        raise ApiException(f"Unknown storage backend {storage}", code=400)
+    return storage
 
 
+def _check_storage(tracked_app: TrackedApp):
+    if tracked_app.backup_mode == BackupMode.CHUNKED and tracked_app.storage != DEFAULT_STORAGE:
+        raise ApiException("Chunked backups can only be stored in the local backups directory", code=400)
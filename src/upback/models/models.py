@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Dict
 from uuid import UUID
 
+from upback.enums.enums import BackupMode, BackupStatus, CompressionCodec
+
 
 @dataclass
 class TrackedApp:
@@ -9,6 +12,18 @@ class TrackedApp:
     file_path: str
     auto_update: bool
     cron: str
+    backup_mode: str = BackupMode.ZIP.value
+    incremental: bool = False
+    compression: str = CompressionCodec.DEFLATE.value
+    compression_level: int = 6
+    keep_last: int = 0
+    keep_daily: int = 0
+    keep_weekly: int = 0
+    keep_monthly: int = 0
+    continuous: bool = False
+    read_limit_mb_per_s: int = 0
+    cpu_workers: int = 0
+    storage: str = "local"
 
 
 @dataclass
@@ -17,6 +32,11 @@ class Backup:
     app_id: str
     file_path: str
     timestamp: str
+    logical_size: int = 0
+    physical_size: int = 0
+    parent_id: str | None = None
+    file_count: int = 0
+    status: str = BackupStatus.RUNNING.value
 
 
 @dataclass
@@ -25,6 +45,17 @@ class BackupFile:
     app_id: str
     file_size: int
     file_path: str
+    logical_size: int = 0
+    physical_size: int = 0
+
+
+@dataclass
+class BackupStats:
+    backup_count: int
+    found_count: int
+    archive_size: int
+    logical_size: int
+    file_count: int
 
 
 @dataclass
@@ -33,3 +64,66 @@ class SyncStatus:
     current: int
     total: int
     file: str
+    discovered: int = 0
+    scan_complete: bool = False
+    bytes_processed: int = 0
+    total_bytes: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    throughput: float = 0.0
+    eta_seconds: float | None = None
+    state: str = BackupStatus.RUNNING.value
+    error: str | None = None
+
+
+@dataclass
+class ManifestEntry:
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    hash: str
+
+
+@dataclass
+class RestoreStatus:
+    backup_id: str
+    current: int
+    total: int
+    bytes_written: int
+    total_bytes: int
+    file: str
+    target: str
+    finished: bool = False
+    error: str | None = None
+
+
+@dataclass
+class CatalogEntry:
+    backup_id: str
+    path: str
+    size: int
+    mtime_ns: int
+    crc: int | None
+    hash: str
+
+
+@dataclass
+class SyncPlan:
+    file_path: str
+    file_count: int
+    total_bytes: int
+    # What the sync would actually read, less than the whole tree for incremental apps
+    changed_files: int
+    changed_bytes: int
+    by_extension: Dict[str, dict]
+    by_class: Dict[str, dict]
+    predicted_archive_bytes: int
+    predicted_seconds: float
+    compression_ratio: float
+    throughput_bytes_per_second: float
+    # Finished syncs the ratio and throughput were measured on, 0 means defaults were used
+    history_runs: int
+    scan_seconds: float
+    created_at: str
+    app_id: str | None = None
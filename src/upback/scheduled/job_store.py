@@ -0,0 +1,69 @@
+import pickle
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+
+class SqliteJobStore(BaseJobStore):
+    """Keeps scheduled jobs in the UpBack database, so they and their next run times survive a restart.
+
+    APScheduler's own SQL store needs SQLAlchemy, this one goes through the same connections as everything else.
+    """
+
+    def __init__(self, db, pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.db = db
+        self.pickle_protocol = pickle_protocol
+
+    def lookup_job(self, job_id):
+        row = self.db.get_scheduled_job(job_id)
+        jobs = self._reconstitute_jobs([row]) if row else []
+        return jobs[0] if jobs else None
+
+    def get_due_jobs(self, now):
+        return self._reconstitute_jobs(self.db.get_scheduled_jobs(datetime_to_utc_timestamp(now)))
+
+    def get_next_run_time(self):
+        return utc_timestamp_to_datetime(self.db.get_next_scheduled_run())
+
+    def get_all_jobs(self):
+        return self._reconstitute_jobs(self.db.get_scheduled_jobs())
+
+    def add_job(self, job):
+        if not self.db.insert_scheduled_job(job.id, datetime_to_utc_timestamp(job.next_run_time), self._dump(job)):
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        if not self.db.update_scheduled_job(job.id, datetime_to_utc_timestamp(job.next_run_time), self._dump(job)):
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        if not self.db.delete_scheduled_jobs([job_id]):
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        self.db.delete_scheduled_jobs()
+
+    def _dump(self, job: Job) -> bytes:
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _reconstitute_jobs(self, rows) -> list:
+        jobs, failed = [], []
+        for job_id, job_state in rows:
+            try:
+                state = pickle.loads(job_state)
+                state["jobstore"] = self
+                job = Job.__new__(Job)
+                job.__setstate__(state)
+                job._scheduler = self._scheduler
+                job._jobstore_alias = self._alias
+                jobs.append(job)
+            except Exception as e:
+                # A job pointing at code that no longer exists would fail on every wakeup
+                print("Scheduler Error: dropping job", job_id, e)
+                failed.append(job_id)
+
+        if failed:
+            self.db.delete_scheduled_jobs(failed)
+        return jobs
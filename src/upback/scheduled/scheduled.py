@@ -1,40 +1,318 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict
 from uuid import UUID
 
+from apscheduler.events import EVENT_JOB_MISSED, JobExecutionEvent
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 
+from upback.config.settings import settings
+from upback.constants.constants import DATA_DIR
+from upback.enums.enums import SyncPriority
+from upback.exceptions.exceptions import ApiException
 from upback.facades.facade import UpBackFacade
 from upback.models.models import TrackedApp
+from upback.scheduled.job_store import SqliteJobStore
+from upback.services.file_lock import FileLock
+from upback.services.metrics_service import start_sharing, stop_sharing
+from upback.services.watch_service import change_watcher, is_supported
+
+SCHEDULER_LOCK = DATA_DIR / "scheduler.lock"
+MIGRATION_LOCK = DATA_DIR / "migration.lock"
+# How often a worker without the scheduler checks whether the one that had it is gone
+CLAIM_RETRY_SECONDS = 30
+# Workers that don't own the scheduler can change tracked apps, the owner picks that up within this time
+JOB_REFRESH_SECONDS = 15
+# Backup jobs live in the database, the interval jobs are rebuilt on every start
+BACKUP_JOBSTORE = "backups"
+BACKUP_JOB_PREFIX = "backup-"
 
 scheduler = BackgroundScheduler()
 upBackFacade = UpBackFacade()
 
+# Held open for the lifetime of the process that owns the scheduler, the kernel drops the lock when it dies
+_scheduler_lock = None
+_jobs_lock = threading.Lock()
+# What the jobs and watches were last brought in line with, per tracked app
+_applied: Dict[str, tuple] = {}
+
+
+def owns_scheduler() -> bool:
+    return _scheduler_lock is not None
+
 
 def load_backup_jobs():
-    print("Loading backup jobs")
+    """Brings the stored backup jobs in line with the tracked apps.
+
+    Jobs whose app is unchanged are left alone, so they keep their next run time, including one that was
+    missed while UpBack was down.
+    """
+    # Only the process running the scheduler has jobs to load
+    if not owns_scheduler():
+        return
+
     services: list[TrackedApp] = upBackFacade.get_tracked_apps()
+    wanted = {str(service.uuid): service for service in services}
+
+    with _jobs_lock:
+        jobs = {job.id: job for job in scheduler.get_jobs(jobstore=BACKUP_JOBSTORE)}
+        changed = 0
+        for job_id, job in jobs.items():
+            if _app_id(job_id) not in wanted:
+                changed += _apply_backup_job(_app_id(job_id), None, job)
+
+        for app_id, service in wanted.items():
+            changed += _apply_backup_job(app_id, service, jobs.get(_job_id(app_id)))
+
+        _applied.clear()
+        _applied.update((app_id, _fingerprint(service)) for app_id, service in wanted.items())
+
+    print(f"Loaded backup jobs: {len(jobs)} stored, {changed} changed")
+    change_watcher.refresh(services)
+
+
+def update_backup_job(app_id: UUID | str):
+    """Applies a change to one tracked app, after it was created, updated or deleted."""
+    if not owns_scheduler():
+        return
+
+    app_id = str(app_id)
+    try:
+        service = upBackFacade.get_tracked_app_by_uuid(app_id)
+    except ApiException:
+        service = None
+
+    _update_backup_job(app_id, service)
+
+
+def refresh_backup_jobs():
+    # Other workers change tracked apps without telling this one, the differences are applied app by app
+    wanted = {str(service.uuid): service for service in upBackFacade.get_tracked_apps()}
+
+    for app_id in wanted.keys() | _applied.keys():
+        service = wanted.get(app_id)
+        if _fingerprint(service) != _applied.get(app_id):
+            _update_backup_job(app_id, service)
+
+
+def _update_backup_job(app_id: str, service: TrackedApp | None):
+    with _jobs_lock:
+        _apply_backup_job(app_id, service, scheduler.get_job(_job_id(app_id), BACKUP_JOBSTORE))
+        if service is None:
+            _applied.pop(app_id, None)
+        else:
+            _applied[app_id] = _fingerprint(service)
+
+    change_watcher.update(app_id, service)
+
+
+def _apply_backup_job(app_id: str, service: TrackedApp | None, job) -> bool:
+    """Adds, reschedules or removes the job of one app, returns whether anything changed."""
+    if service is None or not service.auto_update:
+        if job is None:
+            return False
+        scheduler.remove_job(job.id, BACKUP_JOBSTORE)
+        print("Removed backup job:", job.id)
+        return True
 
-    for service in services:
-        print("Backing up service: ", service.file_path)
-        if not service.auto_update:
-            continue
+    trigger = CronTrigger.from_crontab(service.cron)
+    grace = _misfire_grace_time()
 
+    if job is None:
         scheduler.add_job(
             backup_service,
-            CronTrigger.from_crontab(service.cron),
-            args=[service.uuid],
-            id=f"backup-{service.uuid}",
+            trigger,
+            args=[app_id],
+            id=_job_id(app_id),
+            jobstore=BACKUP_JOBSTORE,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=grace
+        )
+        print("Scheduled backups of", service.file_path, service.cron)
+        return True
+
+    changed = False
+    if repr(job.trigger) != repr(trigger):
+        scheduler.reschedule_job(job.id, BACKUP_JOBSTORE, trigger=trigger)
+        print("Rescheduled backups of", service.file_path, service.cron)
+        changed = True
+    if job.misfire_grace_time != grace:
+        scheduler.modify_job(job.id, BACKUP_JOBSTORE, misfire_grace_time=grace)
+        changed = True
+    return changed
+
+
+def _fingerprint(service: TrackedApp | None) -> tuple | None:
+    if service is None:
+        return None
+    return service.cron, service.auto_update, service.file_path, service.continuous
+
+
+def _job_id(app_id: str) -> str:
+    return f"{BACKUP_JOB_PREFIX}{app_id}"
+
+
+def _app_id(job_id: str) -> str:
+    return job_id.removeprefix(BACKUP_JOB_PREFIX)
+
+
+def _misfire_grace_time() -> int | None:
+    minutes = settings.missed_run_grace_minutes
+    return minutes * 60 if minutes > 0 else None
+
+
+def _report_missed_runs():
+    now = datetime.now(timezone.utc)
+    missed = [job for job in scheduler.get_jobs(jobstore=BACKUP_JOBSTORE)
+              if job.next_run_time is not None and job.next_run_time < now]
+    if missed:
+        print(f"{len(missed)} scheduled syncs were missed while UpBack was down, "
+              f"each runs once if its last missed run is less than {settings.missed_run_grace_minutes} minutes old")
+
+
+def _on_job_missed(event: JobExecutionEvent):
+    if event.jobstore == BACKUP_JOBSTORE:
+        print("Skipped scheduled sync of", _app_id(event.job_id), "that was due at", event.scheduled_run_time)
+
+
+def _claim_scheduler() -> bool:
+    global _scheduler_lock
+
+    lock = FileLock(SCHEDULER_LOCK)
+    if not lock.acquire(timeout=0):
+        return False
+
+    _scheduler_lock = lock
+    return True
+
+
+def _start_owned_services():
+    # Before any reconcile, which keeps the multipart uploads of RUNNING backups. After a takeover this also
+    # covers the syncs the previous owner died in
+    interrupted = upBackFacade.fail_interrupted_backups()
+    if interrupted:
+        print("Marked", interrupted, "interrupted backups as failed")
+
+    if settings.watch_enabled:
+        start_watcher()
+
+    # Paused until the stored jobs match the tracked apps, so jobs of deleted apps never fire
+    start_scheduler(paused=True)
+    load_backup_jobs()
+    _report_missed_runs()
+    scheduler.resume()
+
+
+def _wait_for_scheduler():
+    while not _claim_scheduler():
+        time.sleep(CLAIM_RETRY_SECONDS)
+
+    print("Took over the scheduler")
+    _start_owned_services()
+
+
+def start_background_services():
+    """Migrates the database and starts the scheduler and change watcher.
+
+    Every server process calls this, but only the first to lock the data directory runs the scheduler. The
+    others keep trying, so the scheduler moves on when its process dies.
+    """
+    with FileLock(MIGRATION_LOCK):
+        upBackFacade.init_db()
+    start_sharing()
+
+    if _claim_scheduler():
+        _start_owned_services()
+        return
+
+    print("Scheduler runs in another process")
+    threading.Thread(target=_wait_for_scheduler, name="upback-scheduler-claim", daemon=True).start()
+
+
+def stop_background_services():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    stop_sharing()
+
+
+def start_watcher():
+    if not is_supported():
+        print("Change watching needs inotify, syncs keep walking the whole tree")
+        return
+
+    print("Starting change watcher")
+    change_watcher.start(upBackFacade.db, upBackFacade.trigger_continuous_sync)
+
+def start_scheduler(paused: bool = False):
+    print("Starting scheduler")
+
+    scheduler.add_jobstore(SqliteJobStore(upBackFacade.db), BACKUP_JOBSTORE)
+    scheduler.add_listener(_on_job_missed, EVENT_JOB_MISSED)
+
+    if settings.reconcile_interval_minutes > 0:
+        scheduler.add_job(
+            reconcile_backups,
+            "interval",
+            minutes=settings.reconcile_interval_minutes,
+            id="reconcile-backups",
             replace_existing=True,
             max_instances=1,
             coalesce=True
         )
 
-    print([job.id for job in scheduler.get_jobs()])
+    if settings.prune_interval_minutes > 0:
+        scheduler.add_job(
+            prune_backups,
+            "interval",
+            minutes=settings.prune_interval_minutes,
+            id="prune-backups",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
 
-def start_scheduler():
-    print("Starting scheduler")
-    scheduler.start()
+    if settings.scrub_interval_minutes > 0:
+        scheduler.add_job(
+            scrub_backups,
+            "interval",
+            minutes=settings.scrub_interval_minutes,
+            id="scrub-backups",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+
+    if settings.server_workers > 1:
+        scheduler.add_job(
+            refresh_backup_jobs,
+            "interval",
+            seconds=JOB_REFRESH_SECONDS,
+            id="refresh-backup-jobs",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+
+    scheduler.start(paused=paused)
+
+
+def reconcile_backups():
+    print("Reconciled backups:", upBackFacade.reconcile_backups())
+
+
+def prune_backups():
+    result = upBackFacade.prune_backups()
+    print("Pruned backups:", result["deleted"], "reclaimed bytes:", result["reclaimed_bytes"])
+
+
+def scrub_backups():
+    result = upBackFacade.scrub_backups()
+    if result is not None and any(result.values()):
+        print("Scrubbed backups:", result)
 
 
-def backup_service(service_uuid: UUID):
-    upBackFacade.sync_app_by_uuid(service_uuid)
+def backup_service(service_uuid: UUID | str):
+    upBackFacade.sync_app_by_uuid(service_uuid, priority=SyncPriority.SCHEDULED)
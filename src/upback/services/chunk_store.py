@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+import zlib
+from contextlib import nullcontext
+from pathlib import Path
+from typing import BinaryIO, Iterator, List
+
+import numpy as np
+
+from upback.services.throttle_service import SyncThrottle
+
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+READ_SIZE = 1024 * 1024
+
+MANIFEST_VERSION = 1
+
+# FastCDC style normalized chunking: a stricter mask below the average size and a
+# looser one above it keeps chunk sizes clustered around CHUNK_AVG_SIZE.
+_HASH_MASK = (1 << 64) - 1
+
+
+def _spread_mask(bits: int) -> int:
+    # Gear hashes mix best in the high bits, so spread the mask over the top 48
+    step = 48 // bits
+    return sum(1 << (63 - i * step) for i in range(bits))
+
+
+_MASK_S = _spread_mask((CHUNK_AVG_SIZE.bit_length() - 1) + 2)
+_MASK_L = _spread_mask((CHUNK_AVG_SIZE.bit_length() - 1) - 2)
+
+_rng = random.Random(0x55504241434B)
+_GEAR = [_rng.getrandbits(64) for _ in range(256)]
+_GEAR_ARRAY = np.array(_GEAR, dtype=np.uint64)
+
+# Every byte is shifted one bit further per step, after 64 bytes it has left the hash
+_WINDOW = 64
+# Hashed in slices that stay in the CPU cache, one pass over the whole buffer per doubling step is memory bound
+_HASH_BLOCK = 32 * 1024
+
+
+def _window_hashes(data: bytes | memoryview) -> tuple[np.ndarray, np.ndarray]:
+    """Positions where the hash of the 64 bytes ending there matches the small and the large mask.
+
+    Summed in doubling steps, the hash over the last 2m bytes is the hash over the last m plus the one m bytes
+    earlier shifted by m. uint64 arithmetic wraps just like the masked Python integers.
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    mask_s, mask_l = np.uint64(_MASK_S), np.uint64(_MASK_L)
+    small, large = [], []
+
+    for start in range(0, len(values), _HASH_BLOCK):
+        # Each slice starts a window early, so its first hashes see the same bytes as in one pass
+        lead = min(start, _WINDOW - 1)
+        hashes = _GEAR_ARRAY[values[start - lead:start + _HASH_BLOCK]]
+        width = 1
+        while width < _WINDOW:
+            hashes[width:] += hashes[:-width] << np.uint64(width)
+            width *= 2
+
+        hashes = hashes[lead:]
+        small.append(np.flatnonzero((hashes & mask_s) == 0) + start)
+        large.append(np.flatnonzero((hashes & mask_l) == 0) + start)
+
+    if not small:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(small), np.concatenate(large)
+
+
+def _find_boundary(data: bytes | memoryview, start: int, end: int, small: np.ndarray, large: np.ndarray) -> int:
+    size = end - start
+    if size <= CHUNK_MIN_SIZE:
+        return end
+
+    normal = min(start + CHUNK_AVG_SIZE, end)
+    limit = min(start + CHUNK_MAX_SIZE, end)
+    gear = _GEAR
+    h = 0
+
+    # The hash starts over at the minimum size, until it has seen a full window it depends on where that was
+    i = start + CHUNK_MIN_SIZE
+    warm = min(i + _WINDOW - 1, limit)
+    while i < warm:
+        h = ((h << 1) + gear[data[i]]) & _HASH_MASK
+        if not h & (_MASK_S if i < normal else _MASK_L):
+            return i + 1
+        i += 1
+
+    # From here on it is the window hash, so the first precomputed match is the cut
+    for matches, stop in ((small, normal), (large, limit)):
+        if i < stop:
+            index = np.searchsorted(matches, i)
+            if index < len(matches) and matches[index] < stop:
+                return int(matches[index]) + 1
+            i = stop
+
+    return limit
+
+
+def iter_extents(stream: BinaryIO, extent_size: int) -> Iterator[bytes]:
+    # Fixed, aligned chunks for files that change in place, such as database pages
+    while extent := stream.read(extent_size):
+        yield extent
+
+
+def iter_chunks(stream: BinaryIO) -> Iterator[bytes]:
+    buffer = b""
+    eof = False
+
+    while True:
+        while not eof and len(buffer) < CHUNK_MAX_SIZE:
+            block = stream.read(READ_SIZE)
+            if not block:
+                eof = True
+                break
+            buffer += block
+
+        if not buffer:
+            return
+
+        offset = 0
+        view = memoryview(buffer)
+        small, large = _window_hashes(view)
+        # Only cut while a full max-size window is available, otherwise the boundary
+        # would depend on how the file happened to be read.
+        while len(buffer) - offset >= CHUNK_MAX_SIZE or (eof and offset < len(buffer)):
+            cut = _find_boundary(view, offset, len(buffer), small, large)
+            yield bytes(view[offset:cut])
+            offset = cut
+
+        view.release()
+        buffer = buffer[offset:]
+
+        if eof and not buffer:
+            return
+
+
+class ChunkStore:
+    def __init__(self, root: Path, limiter: SyncThrottle | None = None):
+        self.root = root
+        self.limiter = limiter
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.read_seconds = 0.0
+        self.compress_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:]
+
+    def has(self, digest: str) -> bool:
+        return self.chunk_path(digest).exists()
+
+    def put(self, data: bytes) -> tuple[str, int]:
+        started = time.perf_counter()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+
+        if path.exists():
+            self.compress_seconds += time.perf_counter() - started
+            return digest, 0
+
+        with self.limiter.cpu_slot() if self.limiter is not None else nullcontext():
+            compressed = zlib.compress(data, 6)
+        compressed_at = time.perf_counter()
+        self.compress_seconds += compressed_at - started
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Syncs storing the same chunk at once each write their own temp file. Existing chunks are reused without
+        # being read, so the data has to be on disk before the chunk gets its name
+        fd, tmp_name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_name, path)
+        except OSError:
+            os.unlink(tmp_name)
+            # Another sync stored it first, Windows refuses to replace a chunk a reader has open
+            if not path.exists():
+                raise
+        self.write_seconds += time.perf_counter() - compressed_at
+
+        return digest, len(compressed)
+
+    def get(self, digest: str) -> bytes:
+        with open(self.chunk_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def store_file(self, file_path: Path, extent_size: int | None = None) -> tuple[List[str], int, int, str]:
+        digests: List[str] = []
+        logical_size = 0
+        physical_size = 0
+        file_hash = hashlib.sha256()
+
+        started = time.perf_counter()
+        put_seconds = self.compress_seconds + self.write_seconds
+
+        with open(file_path, "rb") as f:
+            for chunk in iter_extents(f, extent_size) if extent_size else iter_chunks(f):
+                if self.limiter is not None:
+                    self.limiter.consume(len(chunk))
+                digest, written = self.put(chunk)
+                digests.append(digest)
+                file_hash.update(chunk)
+                logical_size += len(chunk)
+                physical_size += written
+
+        # Reading includes finding the chunk boundaries, everything but put() itself
+        put_seconds = self.compress_seconds + self.write_seconds - put_seconds
+        self.read_seconds += time.perf_counter() - started - put_seconds
+
+        return digests, logical_size, physical_size, file_hash.hexdigest()
+
+    def sweep(self, referenced: set[str]) -> tuple[int, int]:
+        removed = 0
+        reclaimed = 0
+
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir():
+                continue
+
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith(".tmp") or prefix.name + entry.name in referenced:
+                    continue
+
+                size = entry.stat().st_size
+                os.unlink(entry.path)
+                removed += 1
+                reclaimed += size
+
+        return removed, reclaimed
+
+    def restore_file(self, digests: List[str], target: Path):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "wb") as f:
+            for digest in digests:
+                f.write(self.get(digest))
+
+
+def write_manifest(manifest_path: Path, manifest: dict):
+    tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def read_manifest(manifest_path: Path) -> dict:
+    with open(manifest_path) as f:
+        return json.load(f)
@@ -0,0 +1,58 @@
+import math
+import os
+import zipfile
+from collections import Counter
+from pathlib import Path
+
+from upback.enums.enums import CompressionCodec
+
+ZIP_COMPRESSION = {
+    CompressionCodec.DEFLATE: zipfile.ZIP_DEFLATED,
+    CompressionCodec.BZIP2: zipfile.ZIP_BZIP2,
+    CompressionCodec.LZMA: zipfile.ZIP_LZMA,
+    CompressionCodec.STORED: zipfile.ZIP_STORED,
+}
+
+# Formats that are already compressed, running them through a codec again only burns CPU
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    ".7z", ".aac", ".avi", ".avif", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz", ".heic", ".jar",
+    ".jpeg", ".jpg", ".lz4", ".m4a", ".m4v", ".mkv", ".mov", ".mp3", ".mp4", ".ogg", ".opus", ".png",
+    ".pptx", ".rar", ".tgz", ".webm", ".webp", ".whl", ".xlsx", ".xz", ".zip", ".zst",
+})
+
+SMALL_FILE_SIZE = 128
+SAMPLE_SIZE = 16 * 1024
+# Bits per byte, random or already compressed data sits just below 8
+ENTROPY_THRESHOLD = 7.5
+
+
+def sample_entropy(data: bytes) -> float:
+    if not data:
+        return 0.0
+
+    length = len(data)
+    return -sum(count / length * math.log2(count / length) for count in Counter(data).values())
+
+
+class CompressionPolicy:
+    def __init__(self, codec: str = CompressionCodec.DEFLATE, level: int = 6):
+        self.compress_type = ZIP_COMPRESSION[CompressionCodec(codec)]
+        self.level = level
+
+    def choose(self, file: Path, stat: os.stat_result) -> tuple[int, int | None]:
+        if self.compress_type == zipfile.ZIP_STORED:
+            return zipfile.ZIP_STORED, None
+
+        if stat.st_size <= SMALL_FILE_SIZE or file.suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return zipfile.ZIP_STORED, None
+
+        try:
+            with open(file, "rb") as f:
+                sample = f.read(SAMPLE_SIZE)
+        except OSError:
+            return self.compress_type, self.level
+
+        if sample_entropy(sample) >= ENTROPY_THRESHOLD:
+            return zipfile.ZIP_STORED, None
+
+        return self.compress_type, self.level
@@ -0,0 +1,336 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator
+
+from upback.config.settings import settings
+from upback.services.compression_policy import CompressionPolicy
+from upback.services.throttle_service import SyncThrottle, apply_priority
+from upback.services.zip_adapter import finish_member, get_compressor, start_member
+
+BLOCK_COMPRESSION = (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED)
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+def _get_pool(name: str) -> ThreadPoolExecutor:
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max(1, settings.compression_workers),
+                thread_name_prefix=f"upback-{name}"
+            )
+        return _executors[name]
+
+
+def get_executor() -> ThreadPoolExecutor:
+    return _get_pool("compress")
+
+
+def get_sync_executor() -> ThreadPoolExecutor:
+    # Sync compression has threads of its own, they take on the sync nice and ionice values which restores
+    # running on the shared pool shouldn't inherit
+    return _get_pool("sync-compress")
+
+
+@dataclass
+class _BlockResult:
+    compressed: bytes | BinaryIO
+    crc: int = 0
+    size: int = 0
+    # SHA-256 of the whole member when one worker saw all of it, otherwise the raw block for the writer to hash
+    hash: str | None = None
+    raw: bytes | None = None
+    read_seconds: float = 0.0
+    compress_seconds: float = 0.0
+    hash_seconds: float = 0.0
+
+
+def _gf2_times(matrix: list[int], vector: int) -> int:
+    result = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return result
+
+
+@lru_cache(maxsize=64)
+def _crc32_shift(length: int) -> list[int]:
+    """The operator that advances a CRC-32 over `length` zero bytes, as a GF(2) matrix (zlib's crc32_combine)."""
+    # One zero bit, then squared up to one zero byte
+    operator = [0xEDB88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = [_gf2_times(operator, column) for column in operator]
+
+    shift = [1 << n for n in range(32)]
+    while length:
+        if length & 1:
+            shift = [_gf2_times(operator, column) for column in shift]
+        length >>= 1
+        if length:
+            operator = [_gf2_times(operator, column) for column in operator]
+    return shift
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """CRC-32 of two buffers joined, from their CRCs and the length of the second one."""
+    return _gf2_times(_crc32_shift(length2), crc1) ^ crc2 if length2 else crc1
+
+
+def _compress_block(file: Path, offset: int, length: int, last: bool, compress_type: int, level: int | None,
+                    limiter: SyncThrottle | None):
+    apply_priority()
+    started = time.perf_counter()
+    with open(file, "rb") as f:
+        f.seek(offset)
+        # Never more than the stat promised, a file that grows meanwhile is archived whole by the next sync
+        raw = f.read(length)
+    if limiter is not None:
+        limiter.consume(len(raw))
+    read = time.perf_counter()
+
+    # Checksums are per block here, the writer only combines them. A member's SHA-256 can't be combined, it
+    # is computed here when the member is a single block.
+    whole = offset == 0 and last
+    result = _BlockResult(
+        compressed=raw,
+        crc=zlib.crc32(raw),
+        size=len(raw),
+        hash=hashlib.sha256(raw).hexdigest() if whole else None,
+        raw=None if whole else raw,
+        read_seconds=read - started,
+    )
+    hashed = time.perf_counter()
+    result.hash_seconds = hashed - read
+
+    if compress_type == zipfile.ZIP_STORED:
+        return result
+
+    # Independently compressed raw deflate blocks can be concatenated into one stream as long as
+    # every block but the last ends on a byte boundary (Z_SYNC_FLUSH), which is what pigz does.
+    with limiter.cpu_slot() if limiter is not None else nullcontext():
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        result.compressed = compressor.compress(raw) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    result.compress_seconds = time.perf_counter() - hashed
+    return result
+
+
+def _compress_file(file: Path, length: int, block_size: int, compress_type: int, level: int | None,
+                   limiter: SyncThrottle | None):
+    # bzip2 and lzma streams can't be stitched together from blocks, so the whole member is
+    # compressed by a single worker and spills to disk once it outgrows the worker's memory budget.
+    apply_priority()
+    compressor = get_compressor(compress_type, level)
+    spool = tempfile.SpooledTemporaryFile(max_size=block_size)
+    file_hash = hashlib.sha256()
+    crc = 0
+    size = 0
+    read_seconds = 0.0
+    started = time.perf_counter()
+
+    with open(file, "rb") as f:
+        while True:
+            before = time.perf_counter()
+            block = f.read(min(block_size, length - size))
+            read_seconds += time.perf_counter() - before
+            if not block:
+                break
+            if limiter is not None:
+                limiter.consume(len(block))
+
+            crc = zlib.crc32(block, crc)
+            file_hash.update(block)
+            size += len(block)
+            with limiter.cpu_slot() if limiter is not None else nullcontext():
+                spool.write(compressor.compress(block))
+
+    spool.write(compressor.flush())
+    spool.seek(0)
+    return _BlockResult(
+        compressed=spool,
+        crc=crc,
+        size=size,
+        hash=file_hash.hexdigest(),
+        read_seconds=read_seconds,
+        compress_seconds=time.perf_counter() - started - read_seconds,
+    )
+
+
+class _PendingMember:
+    def __init__(self, file: Path, arcname: str, stat: os.stat_result, compress_type: int, level: int | None):
+        self.file = file
+        self.arcname = arcname
+        self.stat = stat
+        self.compress_type = compress_type
+        self.level = level
+        self.futures: deque[Future] = deque()
+        self.submitted = False
+        self.zinfo: zipfile.ZipInfo | None = None
+        self.zip64 = False
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.hash = hashlib.sha256()
+        self.file_hash: str | None = None
+
+
+class ParallelZipWriter:
+    """Compresses members on a thread pool and writes them into the archive in submission order."""
+
+    def __init__(self, zipf: zipfile.ZipFile, policy: CompressionPolicy | None = None,
+                 limiter: SyncThrottle | None = None):
+        self.zipf = zipf
+        self.policy = policy or CompressionPolicy()
+        self.limiter = limiter
+        self.executor = get_sync_executor()
+        self.block_size = max(64 * 1024, settings.worker_memory_mb * 1024 * 1024 // 2)
+        self.max_inflight = max(2, settings.compression_workers * 2)
+        self.inflight = 0
+        self.read_seconds = 0.0
+        self.compress_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def write_members(
+            self, members: Iterable[tuple[Path, str, os.stat_result]]
+    ) -> Iterator[tuple[Path, zipfile.ZipInfo, os.stat_result, str]]:
+        queue: deque[_PendingMember] = deque()
+
+        for file, arcname, stat in members:
+            compress_type, level = self.policy.choose(file, stat)
+            member = _PendingMember(file, arcname, stat, compress_type, level)
+            queue.append(member)
+
+            if compress_type in BLOCK_COMPRESSION:
+                blocks = max(1, -(-stat.st_size // self.block_size))
+            else:
+                blocks = 1
+
+            for index in range(blocks):
+                while self.inflight >= self._inflight_limit():
+                    yield from self._drain(queue)
+
+                if compress_type in BLOCK_COMPRESSION:
+                    offset = index * self.block_size
+                    future = self.executor.submit(
+                        _compress_block,
+                        file,
+                        offset,
+                        min(self.block_size, stat.st_size - offset),
+                        index == blocks - 1,
+                        compress_type,
+                        level,
+                        self.limiter,
+                    )
+                else:
+                    future = self.executor.submit(
+                        _compress_file, file, stat.st_size, self.block_size, compress_type, level, self.limiter
+                    )
+
+                member.futures.append(future)
+                self.inflight += 1
+
+            member.submitted = True
+            yield from self._drain(queue, wait=False)
+
+        while queue:
+            yield from self._drain(queue)
+
+    def _inflight_limit(self) -> int:
+        # A per app worker cap bounds how many of this archive's blocks are compressed at once
+        if self.limiter is not None and self.limiter.max_workers > 0:
+            return self.limiter.max_workers
+        return self.max_inflight
+
+    def _drain(self, queue: deque[_PendingMember], wait: bool = True):
+        while queue:
+            member = queue[0]
+
+            while member.futures:
+                future = member.futures[0]
+                if not wait and not future.done():
+                    return
+                result = future.result()
+                member.futures.popleft()
+                self.inflight -= 1
+                self._write_block(member, result)
+                if wait:
+                    # One finished block is enough to free up a submission slot
+                    wait = False
+
+            if not member.submitted:
+                return
+
+            self._finish_member(member)
+            queue.popleft()
+            yield member.file, member.zinfo, member.stat, member.file_hash or member.hash.hexdigest()
+
+    def _start_member(self, member: _PendingMember):
+        date_time = max(time.localtime(member.stat.st_mtime)[:6], (1980, 1, 1, 0, 0, 0))
+        zinfo = zipfile.ZipInfo(member.arcname, date_time=date_time)
+        zinfo.external_attr = (member.stat.st_mode & 0xFFFF) << 16
+        zinfo.compress_type = member.compress_type
+        zinfo.file_size = member.stat.st_size
+        zinfo.compress_size = 0
+        zinfo.CRC = 0
+        # Same heuristic as ZipFile.open, the header is rewritten in place so its size must not change
+        member.zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        start_member(self.zipf, zinfo, member.zip64)
+        member.zinfo = zinfo
+
+    def _write_block(self, member: _PendingMember, result: _BlockResult):
+        self.read_seconds += result.read_seconds
+        self.compress_seconds += result.compress_seconds
+        self.hash_seconds += result.hash_seconds
+
+        member.crc = crc32_combine(member.crc, result.crc, result.size) if member.file_size else result.crc
+        member.file_size += result.size
+        if result.hash is not None:
+            member.file_hash = result.hash
+        elif result.raw is not None:
+            hashing = time.perf_counter()
+            member.hash.update(result.raw)
+            self.hash_seconds += time.perf_counter() - hashing
+
+        started = time.perf_counter()
+        if member.zinfo is None:
+            self._start_member(member)
+
+        if isinstance(result.compressed, bytes):
+            member.compress_size += len(result.compressed)
+            self.zipf.fp.write(result.compressed)
+        else:
+            with result.compressed as spool:
+                while block := spool.read(self.block_size):
+                    member.compress_size += len(block)
+                    self.zipf.fp.write(block)
+
+        self.write_seconds += time.perf_counter() - started
+
+    def _finish_member(self, member: _PendingMember):
+        if member.zinfo is None:
+            self._start_member(member)
+
+        zinfo = member.zinfo
+        zinfo.CRC = member.crc
+        zinfo.file_size = member.file_size
+        zinfo.compress_size = member.compress_size
+
+        if not member.zip64 and max(zinfo.file_size, zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+            raise RuntimeError(f"{member.file} grew past the ZIP64 limit while it was being archived")
+
+        finish_member(self.zipf, zinfo, member.zip64)
@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Collection, List
+
+from upback.services.metrics_service import register_gauge
+
+HEARTBEAT_INTERVAL = 15
+HISTORY_SIZE = 2048
+RESET = "reset"
+
+
+@dataclass
+class Event:
+    id: int
+    topic: str
+    event: str
+    data: dict
+
+
+class EventBus:
+    """In-process broadcaster, every subscriber reads the same bounded event log by cursor."""
+
+    def __init__(self, history: int = HISTORY_SIZE):
+        self._events: deque[Event] = deque(maxlen=history)
+        self._condition = threading.Condition()
+        self._last_id = 0
+        # Event loops of async subscribers, woken from whichever thread publishes
+        self._async_waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.subscribers = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(self, topic: str, event: str, data: dict) -> Event:
+        with self._condition:
+            self._last_id += 1
+            published = Event(id=self._last_id, topic=topic, event=event, data=data)
+            self._events.append(published)
+            self._condition.notify_all()
+            for loop, wakeup in self._async_waiters:
+                try:
+                    loop.call_soon_threadsafe(wakeup.set)
+                except RuntimeError:
+                    # The loop already closed, its waiter is dropped when the coroutine unwinds
+                    pass
+            return published
+
+    def has_history(self, after_id: int) -> bool:
+        with self._condition:
+            if after_id > self._last_id:
+                # The id comes from before a restart
+                return False
+            oldest = self._events[0].id if self._events else self._last_id + 1
+            return after_id >= oldest - 1
+
+    def _collect(self, after_id: int, topics: Collection[str]) -> tuple[List[Event], int]:
+        if self._last_id <= after_id:
+            return [], after_id
+        if after_id < self._events[0].id - 1:
+            # The subscriber fell behind the history, it has to rebuild its state instead of resuming
+            return [Event(id=self._last_id, topic="", event=RESET, data={})], self._last_id
+        # Ids are contiguous, so the first unseen event can be found without scanning the log
+        start = max(0, after_id - self._events[0].id + 1)
+        events = [e for e in itertools.islice(self._events, start, None) if e.topic in topics]
+        return events, self._last_id
+
+    def wait(self, after_id: int, topics: Collection[str], timeout: float) -> tuple[List[Event], int]:
+        """Events after the cursor, or a single RESET event once the cursor fell out of the history."""
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                events, after_id = self._collect(after_id, topics)
+                if events:
+                    return events, after_id
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], after_id
+                self._condition.wait(remaining)
+
+    async def wait_async(self, after_id: int, topics: Collection[str], timeout: float) -> tuple[List[Event], int]:
+        """Same as wait, without holding a thread while the subscriber is idle."""
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self._condition:
+                events, after_id = self._collect(after_id, topics)
+                if events:
+                    return events, after_id
+                self._async_waiters.add(waiter)
+
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], after_id
+                await asyncio.wait_for(waiter[1].wait(), remaining)
+            except TimeoutError:
+                return [], after_id
+            finally:
+                with self._condition:
+                    self._async_waiters.discard(waiter)
+
+    def subscribe(self):
+        with self._condition:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._condition:
+            self.subscribers -= 1
+
+
+event_bus = EventBus()
+
+register_gauge("upback_sse_clients", "Connected server-sent event clients.", lambda: event_bus.subscribers)
@@ -0,0 +1,278 @@
+import base64
+import binascii
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from upback.exceptions.exceptions import ApiException
+from upback.services.metrics_service import register_gauge
+
+# Directory mtimes only change when entries come and go, the TTL bounds how stale sizes and mtimes get
+LISTING_TTL = 10
+LISTING_CACHE_SIZE = 32
+# Views per listing, every keystroke in the filter box is one
+VIEW_CACHE_SIZE = 16
+SUBTREE_TTL = 300
+SUBTREE_CACHE_SIZE = 4096
+SUBTREE_WORKERS = 2
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+SORT_KEYS = ("name", "size", "mtime")
+
+
+@dataclass
+class _Entry:
+    name: str
+    is_dir: bool
+    # Only stated when shown or sorted on, the first page of 200k entries shouldn't wait for all of them
+    size: int | None = None
+    mtime: float | None = None
+
+
+@dataclass
+class _Listing:
+    path: str
+    mtime_ns: int
+    loaded: float
+    entries: List[_Entry]
+    stated: bool = False
+    views: OrderedDict = field(default_factory=OrderedDict)
+    # Requests for the same folder share the listing, its views and lazily stated entries are filled in under this
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+@dataclass
+class SubtreeSize:
+    bytes: int = 0
+    files: int = 0
+    complete: bool = False
+    computed: float = 0.0
+    # Set when the user browsed elsewhere before the walk finished
+    abandoned: bool = False
+
+
+class FileBrowser:
+    """Paged directory listings for the folder picker, with subtree sizes computed in the background."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings: OrderedDict[str, _Listing] = OrderedDict()
+        self._subtrees: OrderedDict[str, SubtreeSize] = OrderedDict()
+        self._browsing: str | None = None
+        self._queue: queue.Queue[tuple[str, SubtreeSize]] = queue.Queue()
+        self._workers: List[threading.Thread] = []
+
+    def list(self, path: str, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE, sort: str = "name",
+             descending: bool = False, query: str | None = None, sizes: bool = False) -> dict:
+        listing = self._listing(path)
+        with listing.lock:
+            view = self._view(listing, sort, descending, query)
+            start = _resolve_cursor(cursor, listing, view)
+            page = view[start:start + limit]
+            _stat(listing.path, page)
+        end = start + len(page)
+
+        subtrees = {}
+        if sizes:
+            subtrees = self._subtree_sizes(listing.path, [entry.name for entry in page if entry.is_dir])
+
+        entries = []
+        for entry in page:
+            item = {
+                "name": entry.name,
+                "path": os.path.join(listing.path, entry.name),
+                "is_dir": entry.is_dir,
+                "size": None if entry.is_dir else entry.size,
+                "mtime": entry.mtime,
+            }
+            if sizes and entry.is_dir:
+                subtree = subtrees[entry.name]
+                item["subtree"] = {"bytes": subtree.bytes, "files": subtree.files, "complete": subtree.complete}
+            entries.append(item)
+
+        return {
+            "path": listing.path,
+            "entries": entries,
+            "total": len(view),
+            "next_cursor": _encode_cursor(listing, end, page[-1].name) if end < len(view) else None,
+            "sizes_pending": sum(not subtree.complete for subtree in subtrees.values()),
+        }
+
+    def _listing(self, path: str) -> _Listing:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            raise ApiException("Invalid path", code=400)
+
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None and listing.mtime_ns == mtime_ns and time.monotonic() - listing.loaded < LISTING_TTL:
+                self._listings.move_to_end(path)
+                return listing
+
+        listing = _Listing(path, mtime_ns, time.monotonic(), _scan(path))
+
+        with self._lock:
+            self._listings[path] = listing
+            while len(self._listings) > LISTING_CACHE_SIZE:
+                self._listings.popitem(last=False)
+        return listing
+
+    @staticmethod
+    def _view(listing: _Listing, sort: str, descending: bool, query: str | None) -> List[_Entry]:
+        # Called with listing.lock held
+        key = (sort, descending, query.casefold() if query else None)
+        view = listing.views.get(key)
+        if view is not None:
+            return view
+
+        entries = listing.entries
+        if key[2]:
+            entries = [entry for entry in entries if key[2] in entry.name.casefold()]
+
+        if sort != "name" and not listing.stated:
+            _stat(listing.path, listing.entries)
+            listing.stated = True
+
+        if sort == "size":
+            entries = sorted(entries, key=lambda entry: (entry.size, entry.name), reverse=descending)
+        elif sort == "mtime":
+            entries = sorted(entries, key=lambda entry: (entry.mtime, entry.name), reverse=descending)
+        else:
+            entries = sorted(entries, key=lambda entry: (entry.name.casefold(), entry.name), reverse=descending)
+
+        # Folders first whatever the order, they're what the picker is for
+        view = [entry for entry in entries if entry.is_dir] + [entry for entry in entries if not entry.is_dir]
+
+        listing.views[key] = view
+        while len(listing.views) > VIEW_CACHE_SIZE:
+            listing.views.popitem(last=False)
+        return view
+
+    def _subtree_sizes(self, parent: str, names: List[str]) -> Dict[str, SubtreeSize]:
+        now = time.monotonic()
+        results = {}
+
+        with self._lock:
+            if self._browsing != parent:
+                self._browsing = parent
+                for subtree in self._subtrees.values():
+                    if not subtree.complete:
+                        subtree.abandoned = True
+
+            for name in names:
+                path = os.path.join(parent, name)
+                subtree = self._subtrees.get(path)
+                if subtree is None or subtree.abandoned or (subtree.complete and now - subtree.computed > SUBTREE_TTL):
+                    subtree = self._subtrees[path] = SubtreeSize()
+                    self._queue.put((path, subtree))
+                self._subtrees.move_to_end(path)
+                results[name] = subtree
+
+            while len(self._subtrees) > SUBTREE_CACHE_SIZE:
+                self._subtrees.popitem(last=False)
+
+            while len(self._workers) < SUBTREE_WORKERS:
+                worker = threading.Thread(target=self._run, name="upback-subtree", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+        return results
+
+    def _run(self):
+        while True:
+            path, subtree = self._queue.get()
+            if not subtree.abandoned:
+                _walk_subtree(path, subtree)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+
+def _scan(path: str) -> List[_Entry]:
+    entries = []
+    try:
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries.append(_Entry(entry.name, is_dir))
+    except PermissionError:
+        raise ApiException("Permission denied", code=403)
+    except OSError:
+        raise ApiException("Invalid path", code=400)
+    return entries
+
+
+def _stat(path: str, entries: List[_Entry]):
+    for entry in entries:
+        if entry.mtime is not None:
+            continue
+        try:
+            stat = os.stat(os.path.join(path, entry.name))
+            entry.size, entry.mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            # Broken symlinks and entries deleted since the scan
+            entry.size, entry.mtime = 0, 0.0
+
+
+def _walk_subtree(root: str, subtree: SubtreeSize):
+    # Counts are updated as the walk goes, so the UI can show partial sizes of huge folders
+    stack = [root]
+    while stack and not subtree.abandoned:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            subtree.bytes += entry.stat(follow_symlinks=False).st_size
+                            subtree.files += 1
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+    if not subtree.abandoned:
+        subtree.computed = time.monotonic()
+        subtree.complete = True
+
+
+def _encode_cursor(listing: _Listing, offset: int, last_name: str) -> str:
+    data = json.dumps({"offset": offset, "after": last_name, "mtime": listing.mtime_ns}).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def _resolve_cursor(cursor: str | None, listing: _Listing, view: List[_Entry]) -> int:
+    if not cursor:
+        return 0
+
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        offset, after, mtime_ns = int(data["offset"]), str(data["after"]), int(data["mtime"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ApiException("Invalid cursor", code=400)
+
+    offset = min(max(offset, 0), len(view))
+    if mtime_ns == listing.mtime_ns and offset and view[offset - 1].name == after:
+        return offset
+
+    # The directory changed between pages, continue after the last entry the client saw if it's still there
+    for index, entry in enumerate(view):
+        if entry.name == after:
+            return index + 1
+    return offset
+
+
+file_browser = FileBrowser()
+
+register_gauge("upback_subtree_walks_queued", "Folder size calculations waiting for a worker.", lambda: file_browser.pending)
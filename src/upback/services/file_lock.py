@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+POLL_SECONDS = 0.1
+# Windows only locks byte ranges exclusively, a shared lock takes one of these bytes and an exclusive lock all of them
+SHARED_SLOTS = 64
+
+
+class FileLock:
+    """Advisory lock on a file that other processes see, the OS drops it when the process holding it dies.
+
+    Locks belong to the open file rather than the process, so two FileLocks on the same path also exclude each
+    other within one process. A timeout of None waits for as long as it takes, 0 tries once.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self._slots: list[int] = []
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self, shared: bool = False, timeout: float | None = None) -> bool:
+        if self._file is not None:
+            raise RuntimeError(f"{self.path} is already locked")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, "a+b")
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not self._try_lock(f, shared, wait=deadline is None):
+            if deadline is not None and time.monotonic() >= deadline:
+                f.close()
+                return False
+            time.sleep(POLL_SECONDS)
+
+        self._file = f
+        return True
+
+    def release(self):
+        f, self._file = self._file, None
+        if f is None:
+            return
+
+        try:
+            if sys.platform == "win32":
+                self._unlock_slots(f)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _try_lock(self, f, shared: bool, wait: bool) -> bool:
+        if sys.platform != "win32":
+            flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if wait else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(f, flags)
+            except BlockingIOError:
+                return False
+            return True
+
+        # Shared holders spread over the slots, an exclusive holder needs every one of them
+        first = os.getpid() % SHARED_SLOTS
+        slots = [(first + offset) % SHARED_SLOTS for offset in range(SHARED_SLOTS)]
+        for slot in slots:
+            f.seek(slot)
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                if not shared:
+                    self._unlock_slots(f)
+                    return False
+                continue
+
+            self._slots.append(slot)
+            if shared:
+                return True
+
+        return not shared
+
+    def _unlock_slots(self, f):
+        for slot in self._slots:
+            f.seek(slot)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        self._slots.clear()
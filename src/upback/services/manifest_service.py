@@ -0,0 +1,32 @@
+import os
+from typing import Dict
+
+from upback.models.models import ManifestEntry
+
+DELETED_MEMBER = ".upback/deleted.json"
+
+
+def entry_matches(entry: ManifestEntry | None, stat: os.stat_result) -> bool:
+    if entry is None:
+        return False
+
+    return (
+        entry.size == stat.st_size
+        and entry.mtime_ns == stat.st_mtime_ns
+        and entry.inode == stat.st_ino
+    )
+
+
+def to_manifest_entry(arcname: str, stat: os.stat_result, file_hash: str) -> ManifestEntry:
+    return ManifestEntry(
+        path=arcname,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        inode=stat.st_ino,
+        hash=file_hash,
+    )
+
+
+def find_deleted(previous: Dict[str, ManifestEntry], current: Dict[str, ManifestEntry]) -> list[str]:
+    return sorted(path for path in previous if path not in current)
+
@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+from upback.config.settings import settings
+from upback.constants.constants import DATA_DIR
+from upback.services.file_lock import FileLock
+
+METRICS_DIR = DATA_DIR / "metrics"
+SHARE_SECONDS = 5
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+
+def _format_labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def render(self, shared: List[tuple] | None = None) -> List[str]:
+        """Shared holds (worker, alive, state) of the other server workers, None with a single worker."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples(shared)]
+
+    def state(self):
+        raise NotImplementedError
+
+    def _samples(self, shared: List[tuple] | None) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def state(self) -> list:
+        with self._lock:
+            return [[[str(v) for v in key], value] for key, value in self._values.items()]
+
+    def _samples(self, shared: List[tuple] | None) -> List[str]:
+        # Workers that exited still count, a counter must not go back when one of them is replaced
+        values: Dict[tuple, float] = {}
+        for key, value in self.state() + [item for _, _, state in shared or () for item in state]:
+            values[tuple(key)] = values.get(tuple(key), 0.0) + value
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time, so nothing has to be updated on the hot path."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.collect = collect
+
+    def state(self) -> float:
+        return self.collect()
+
+    def _samples(self, shared: List[tuple] | None) -> List[str]:
+        if shared is None:
+            return [f"{self.name} {self.collect()}"]
+
+        values = [(os.getpid(), self.collect())] + [(worker, state) for worker, alive, state in shared if alive]
+        return [f"{self.name}{_format_labels(('worker',), (worker,))} {value}" for worker, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: one count per bucket plus +Inf, the sum and the total count
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def state(self) -> list:
+        with self._lock:
+            return [
+                [[str(v) for v in key], list(counts), total, count]
+                for key, (counts, total, count) in self._values.items()
+            ]
+
+    def _samples(self, shared: List[tuple] | None) -> List[str]:
+        values: Dict[tuple, list] = {}
+        for key, counts, total, count in self.state() + [item for _, _, state in shared or () for item in state]:
+            series = values.setdefault(tuple(key), [[0] * len(counts), 0.0, 0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        shared = _load_shared() if settings.server_workers > 1 else None
+
+        lines = []
+        for metric in self._metrics:
+            if shared is None:
+                lines.extend(metric.render())
+            else:
+                lines.extend(metric.render([
+                    (worker, alive, states[metric.name]) for worker, alive, states in shared if metric.name in states
+                ]))
+        return "\n".join(lines) + "\n"
+
+    def state(self) -> dict:
+        return {metric.name: metric.state() for metric in self._metrics}
+
+
+registry = MetricsRegistry()
+_worker_lock = FileLock(METRICS_DIR / f"{os.getpid()}.lock")
+_stop_sharing = threading.Event()
+_save_lock = threading.Lock()
+
+sync_duration = registry.register(Histogram(
+    "upback_sync_duration_seconds", "Wall clock duration of syncs.", ("app_id", "status")
+))
+sync_phase_duration = registry.register(Histogram(
+    "upback_sync_phase_duration_seconds",
+    "Time spent per sync phase, worker phases are summed across compression workers.",
+    ("app_id", "phase"),
+))
+syncs_total = registry.register(Counter(
+    "upback_syncs_total", "Finished syncs by final status, failures included.", ("app_id", "status")
+))
+sync_files = registry.register(Counter("upback_sync_files_total", "Files processed by syncs.", ("app_id",)))
+sync_bytes_read = registry.register(Counter(
+    "upback_sync_bytes_read_total", "Source bytes read by syncs.", ("app_id",)
+))
+sync_bytes_written = registry.register(Counter(
+    "upback_sync_bytes_written_total", "Compressed bytes written by syncs.", ("app_id",)
+))
+db_query_duration = registry.register(Histogram(
+    "upback_db_query_duration_seconds", "Latency of database calls.", ("query",), QUERY_BUCKETS
+))
+
+
+def register_gauge(name: str, documentation: str, collect: Callable[[], float]):
+    registry.register(Gauge(name, documentation, collect))
+
+
+def start_sharing():
+    """With several server workers, /metrics answers for all of them from the state each one saves here."""
+    if settings.server_workers <= 1 or _worker_lock.held:
+        return
+
+    # Held for as long as the worker lives, the gauges of workers that are gone are left out
+    _worker_lock.acquire()
+    _stop_sharing.clear()
+    threading.Thread(target=_share_loop, name="upback-metrics", daemon=True).start()
+
+
+def stop_sharing():
+    if not _worker_lock.held:
+        return
+
+    _stop_sharing.set()
+    _save_state()
+    _worker_lock.release()
+
+
+def _share_loop():
+    while not _stop_sharing.wait(SHARE_SECONDS):
+        _save_state()
+
+
+def _save_state():
+    path = METRICS_DIR / f"{os.getpid()}.json"
+    temp = path.with_suffix(".tmp")
+    with _save_lock:
+        try:
+            temp.write_text(json.dumps(registry.state()))
+            os.replace(temp, path)
+        except (OSError, ValueError) as e:
+            print("Metrics Error:", e)
+
+
+def _load_shared() -> List[tuple]:
+    shared = []
+    for path in METRICS_DIR.glob("*.json"):
+        worker = int(path.stem)
+        if worker == os.getpid():
+            continue
+
+        try:
+            states = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            print("Metrics Error:", e)
+            continue
+
+        lock = FileLock(path.with_suffix(".lock"))
+        alive = not lock.acquire(timeout=0)
+        if not alive:
+            lock.release()
+        shared.append((worker, alive, states))
+    return shared
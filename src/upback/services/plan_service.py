@@ -0,0 +1,227 @@
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from upback.enums.enums import CompressionCodec
+from upback.models.models import ManifestEntry, SyncPlan
+from upback.services.compression_policy import (
+    ENTROPY_THRESHOLD, INCOMPRESSIBLE_EXTENSIONS, SAMPLE_SIZE, SMALL_FILE_SIZE, sample_entropy
+)
+from upback.services.manifest_service import entry_matches
+from upback.services.sqlite_snapshot_service import sidecar_of
+from upback.services.watch_service import change_watcher
+
+MB = 1024 * 1024
+# Directory listings block on I/O, so more walkers than cores still pays off on network and spinning disks
+PLAN_WORKERS = 8
+PLAN_TTL = 15 * 60
+# The largest compressible looking files get their first bytes checked, they dominate the archive size
+ENTROPY_SAMPLES = 64
+HISTORY_RUNS = 5
+# Syncs that read less than this are dominated by walking the tree and say little about throughput
+MIN_MEASURED_BYTES = 16 * MB
+# Used until an app has finished syncs to measure
+DEFAULT_THROUGHPUT = 50 * MB
+DEFAULT_COMPRESSION_RATIO = 0.5
+TOP_EXTENSIONS = 25
+
+COMPRESSIBLE = "compressible"
+INCOMPRESSIBLE = "incompressible"
+HIGH_ENTROPY = "high_entropy"
+SMALL = "small"
+
+
+def classify(path: str, size: int) -> str:
+    if size <= SMALL_FILE_SIZE:
+        return SMALL
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return INCOMPRESSIBLE
+    return COMPRESSIBLE
+
+
+def plan_tree(source_dir: Path, previous: Dict[str, ManifestEntry], codec: str,
+              measurements: List[tuple], read_limit: float = 0) -> SyncPlan:
+    """Walks the tree like a sync would, without reading file contents beyond a few entropy samples.
+
+    measurements are (bytes_read, bytes_written, duration_seconds) of earlier syncs, newest first.
+    """
+    started = time.perf_counter()
+    file_count = total_bytes = changed_files = changed_bytes = 0
+    by_extension: Dict[str, dict] = {}
+    by_class = {name: {"files": 0, "bytes": 0, "changed_bytes": 0} for name in
+                (COMPRESSIBLE, INCOMPRESSIBLE, HIGH_ENTROPY, SMALL)}
+    candidates = []
+
+    with ThreadPoolExecutor(PLAN_WORKERS, thread_name_prefix="upback-plan") as pool:
+        pending = {pool.submit(_scan_directory, str(source_dir), source_dir.name)}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, directories = future.result()
+                pending.update(pool.submit(_scan_directory, *directory) for directory in directories)
+
+                for path, arcname, stat in files:
+                    if sidecar_of(Path(path)) is not None:
+                        continue
+
+                    size = stat.st_size
+                    file_count += 1
+                    total_bytes += size
+
+                    extension = os.path.splitext(path)[1].lower() or "(none)"
+                    counts = by_extension.setdefault(extension, {"files": 0, "bytes": 0})
+                    counts["files"] += 1
+                    counts["bytes"] += size
+
+                    file_class = classify(path, size)
+                    by_class[file_class]["files"] += 1
+                    by_class[file_class]["bytes"] += size
+
+                    if entry_matches(previous.get(arcname), stat):
+                        continue
+                    changed_files += 1
+                    changed_bytes += size
+                    by_class[file_class]["changed_bytes"] += size
+                    if file_class == COMPRESSIBLE:
+                        candidates.append((size, path))
+
+        if codec != CompressionCodec.STORED:
+            samples = heapq.nlargest(ENTROPY_SAMPLES, candidates)
+            for (size, _path), entropy in zip(samples, pool.map(_entropy, (path for _size, path in samples))):
+                if entropy < ENTROPY_THRESHOLD:
+                    continue
+                # Already compressed content the extension didn't give away, the sync stores it as is
+                for name, delta in ((COMPRESSIBLE, -1), (HIGH_ENTROPY, 1)):
+                    by_class[name]["files"] += delta
+                    by_class[name]["bytes"] += delta * size
+                    by_class[name]["changed_bytes"] += delta * size
+
+    scan_seconds = time.perf_counter() - started
+    measured = [row for row in measurements if row[0] >= MIN_MEASURED_BYTES]
+
+    if codec == CompressionCodec.STORED:
+        ratio = 1.0
+    elif measurements and sum(row[0] for row in measurements):
+        ratio = sum(row[1] for row in measurements) / sum(row[0] for row in measurements)
+    elif changed_bytes:
+        compressible = by_class[COMPRESSIBLE]["changed_bytes"]
+        ratio = (changed_bytes - compressible + compressible * DEFAULT_COMPRESSION_RATIO) / changed_bytes
+    else:
+        ratio = DEFAULT_COMPRESSION_RATIO
+
+    throughput = DEFAULT_THROUGHPUT
+    if measured:
+        throughput = sum(row[0] for row in measured) / sum(row[2] for row in measured)
+    if read_limit > 0:
+        throughput = min(throughput, read_limit)
+
+    top = sorted(by_extension.items(), key=lambda item: item[1]["bytes"], reverse=True)
+
+    return SyncPlan(
+        file_path=str(source_dir),
+        file_count=file_count,
+        total_bytes=total_bytes,
+        changed_files=changed_files,
+        changed_bytes=changed_bytes,
+        by_extension=dict(top[:TOP_EXTENSIONS]),
+        by_class=by_class,
+        predicted_archive_bytes=int(changed_bytes * ratio),
+        # A sync walks the same tree before it reads the changed bytes
+        predicted_seconds=round(scan_seconds + changed_bytes / throughput, 2),
+        compression_ratio=round(ratio, 4),
+        throughput_bytes_per_second=round(throughput, 2),
+        history_runs=len(measured),
+        scan_seconds=round(scan_seconds, 3),
+        created_at=datetime.now().isoformat(),
+    )
+
+
+def _scan_directory(directory: str, prefix: str) -> tuple[List[tuple], List[tuple]]:
+    files, directories = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                arcname = f"{prefix}/{entry.name}"
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append((entry.path, arcname))
+                    elif entry.is_file():
+                        files.append((entry.path, arcname, entry.stat()))
+                except OSError as e:
+                    print("Plan Error:", e)
+    except OSError as e:
+        print("Plan Error:", e)
+    return files, directories
+
+
+def _entropy(path: str) -> float:
+    try:
+        with open(path, "rb") as f:
+            return sample_entropy(f.read(SAMPLE_SIZE))
+    except OSError:
+        return 0.0
+
+
+class SyncPlanner:
+    """Caches the plan of every tracked app until it goes stale.
+
+    A plan is dropped when the app is changed or synced, when the change watcher saw anything change under it,
+    or after PLAN_TTL for folders nobody watches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans: Dict[str, tuple[float, SyncPlan]] = {}
+        self._planning: Dict[str, threading.Lock] = {}
+        # Bumped by invalidate, a plan computed across an invalidation is returned but not cached
+        self._generations: Dict[str, int] = {}
+
+    def invalidate(self, app_id: str):
+        app_id = str(app_id)
+        with self._lock:
+            self._plans.pop(app_id, None)
+            self._generations[app_id] = self._generations.get(app_id, 0) + 1
+
+    def get(self, app_id: str, compute: Callable[[], SyncPlan], refresh: bool = False) -> SyncPlan:
+        with self._lock:
+            planning = self._planning.setdefault(app_id, threading.Lock())
+
+        # Concurrent requests for the same app wait for one walk instead of starting their own
+        with planning:
+            if not refresh:
+                plan = self._cached(app_id)
+                if plan is not None:
+                    return plan
+
+            with self._lock:
+                generation = self._generations.get(app_id, 0)
+            created = time.monotonic()
+            plan = compute()
+            plan.app_id = app_id
+
+            with self._lock:
+                if self._generations.get(app_id, 0) == generation:
+                    self._plans[app_id] = (created, plan)
+            return plan
+
+    def _cached(self, app_id: str) -> SyncPlan | None:
+        with self._lock:
+            cached = self._plans.get(app_id)
+        if cached is None:
+            return None
+
+        created, plan = cached
+        last_event = change_watcher.last_event(app_id)
+        if time.monotonic() - created > PLAN_TTL or (last_event is not None and last_event >= created):
+            self.invalidate(app_id)
+            return None
+        return plan
+
+
+sync_planner = SyncPlanner()
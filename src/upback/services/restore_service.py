@@ -0,0 +1,246 @@
+import fnmatch
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from upback.config.settings import settings
+from upback.enums.enums import BackupMode
+from upback.models.models import Backup, RestoreStatus
+from upback.services.chunk_store import ChunkStore, read_manifest
+from upback.services.compression_service import get_executor
+from upback.services.manifest_service import DELETED_MEMBER
+from upback.services.sqlite_snapshot_service import SQLITE_MEMBER, PAGES_PREFIX, apply_pages
+from upback.services.storage_service import open_location, stat_location
+
+INDEX_CACHE_SIZE = 64
+COPY_BLOCK_SIZE = 1024 * 1024
+
+running_restores: Dict[str, RestoreStatus] = {}
+
+
+@dataclass
+class PagePatch:
+    archive: str
+    zinfo: zipfile.ZipInfo
+    page_size: int
+    page_count: int
+    pages: List[int]
+
+
+@dataclass
+class RestoreItem:
+    path: str
+    size: int
+    # Location of the archive in its storage backend
+    archive: str | None = None
+    zinfo: zipfile.ZipInfo | None = None
+    chunks: List[str] = field(default_factory=list)
+    mtime_ns: int | None = None
+    # Changed SQLite pages from newer incrementals, applied oldest first on top of the archived copy
+    patches: List[PagePatch] = field(default_factory=list)
+
+
+class _IndexedZipFile(zipfile.ZipFile):
+    """ZipFile that takes its member list from the index cache instead of re-parsing the central directory."""
+
+    def __init__(self, location: str, index: List[zipfile.ZipInfo]):
+        self._cached_index = index
+        self._source = open_location(location)
+        super().__init__(self._source)
+
+    def _RealGetContents(self):
+        self.filelist = list(self._cached_index)
+        self.NameToInfo = {info.filename: info for info in self.filelist}
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+class ArchiveIndexCache:
+    def __init__(self, size: int = INDEX_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._indexes: OrderedDict[tuple, List[zipfile.ZipInfo]] = OrderedDict()
+
+    def get(self, archive: str) -> List[zipfile.ZipInfo]:
+        stored = stat_location(archive)
+        if stored is None:
+            raise FileNotFoundError(archive)
+        key = (archive, stored.version, stored.size)
+
+        with self._lock:
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+                return self._indexes[key]
+
+        with open_location(archive) as source, zipfile.ZipFile(source) as zipf:
+            index = zipf.infolist()
+
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.size:
+                self._indexes.popitem(last=False)
+
+        return index
+
+    def open(self, archive: str) -> zipfile.ZipFile:
+        return _IndexedZipFile(archive, self.get(archive))
+
+
+archive_index_cache = ArchiveIndexCache()
+
+
+def matches(path: str, patterns: List[str] | None) -> bool:
+    if not patterns:
+        return True
+
+    # Patterns may include the tracked folder name or be relative to it
+    relative = path.split("/", 1)[1] if "/" in path else path
+    return any(fnmatch.fnmatchcase(path, p) or fnmatch.fnmatchcase(relative, p) for p in patterns)
+
+
+def plan_restore(chain: List[Backup], backup_mode: str, patterns: List[str] | None) -> List[RestoreItem]:
+    target = chain[-1]
+
+    if backup_mode == BackupMode.CHUNKED:
+        manifest = read_manifest(Path(target.file_path))
+        return [
+            RestoreItem(path=f["path"], size=f["size"], chunks=f["chunks"], mtime_ns=f["mtime_ns"])
+            for f in manifest["files"]
+            if matches(f["path"], patterns)
+        ]
+
+    # Walk the incremental chain from newest to oldest, the newest copy of a path wins and deletion lists
+    # hide older copies of paths removed before the restored backup was taken.
+    items: Dict[str, RestoreItem] = {}
+    patches: Dict[str, List[PagePatch]] = {}
+    deleted: set[str] = set()
+
+    for backup in reversed(chain):
+        archive = backup.file_path
+        index = archive_index_cache.get(archive)
+        names = {info.filename: info for info in index}
+
+        if SQLITE_MEMBER in names:
+            with archive_index_cache.open(archive) as zipf:
+                deltas = json.loads(zipf.read(SQLITE_MEMBER))
+
+            for path, delta in deltas.items():
+                if path in items or path in deleted or not matches(path, patterns):
+                    continue
+                patches.setdefault(path, []).append(PagePatch(
+                    archive=archive,
+                    zinfo=names[delta["member"]],
+                    page_size=delta["page_size"],
+                    page_count=delta["page_count"],
+                    pages=delta["pages"],
+                ))
+
+        for info in index:
+            if info.is_dir() or info.filename in (DELETED_MEMBER, SQLITE_MEMBER):
+                continue
+            if info.filename.startswith(PAGES_PREFIX):
+                continue
+            if info.filename in items or info.filename in deleted or not matches(info.filename, patterns):
+                continue
+
+            item = RestoreItem(path=info.filename, size=info.file_size, archive=archive, zinfo=info)
+            if info.filename in patches:
+                item.patches = list(reversed(patches.pop(info.filename)))
+                item.size = item.patches[-1].page_count * item.patches[-1].page_size
+            items[info.filename] = item
+
+        if DELETED_MEMBER in names:
+            with archive_index_cache.open(archive) as zipf:
+                deleted.update(json.loads(zipf.read(DELETED_MEMBER)))
+
+    if patches:
+        raise FileNotFoundError(f"Base copy of {next(iter(patches))} is missing from the backup chain")
+
+    return list(items.values())
+
+
+def _safe_target(target_dir: Path, path: str) -> Path:
+    destination = (target_dir / path).resolve()
+    if not destination.is_relative_to(target_dir):
+        raise ValueError(f"Refusing to restore {path} outside of {target_dir}")
+    return destination
+
+
+def _restore_zip_item(archives: Dict[str, zipfile.ZipFile], item: RestoreItem, destination: Path):
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    with archives[item.archive].open(item.zinfo) as src, open(destination, "wb+") as dst:
+        shutil.copyfileobj(src, dst, COPY_BLOCK_SIZE)
+
+        for patch in item.patches:
+            with archives[patch.archive].open(patch.zinfo) as pages:
+                apply_pages(dst, pages, patch.page_size, patch.page_count, patch.pages)
+
+    date_time = item.patches[-1].zinfo.date_time if item.patches else item.zinfo.date_time
+    mtime = time.mktime(date_time + (0, 0, -1))
+    os.utime(destination, (mtime, mtime))
+
+
+def _restore_chunked_item(chunk_store: ChunkStore, item: RestoreItem, destination: Path):
+    chunk_store.restore_file(item.chunks, destination)
+    if item.mtime_ns is not None:
+        os.utime(destination, ns=(item.mtime_ns, item.mtime_ns))
+
+
+def run_restore(items: List[RestoreItem], target_dir: Path, chunk_store: ChunkStore,
+                on_progress: Callable[[RestoreItem, int, int], None]):
+    target_dir = target_dir.resolve()
+    target_dir.mkdir(parents=True, exist_ok=True)
+    archives: Dict[str, zipfile.ZipFile] = {}
+
+    try:
+        # One handle per archive is shared by the workers: reads are serialized by ZipFile's
+        # internal lock while decompression and writing run in parallel.
+        for item in items:
+            for archive in [item.archive, *(patch.archive for patch in item.patches)]:
+                if archive is not None and archive not in archives:
+                    archives[archive] = archive_index_cache.open(archive)
+
+        def restore(item: RestoreItem) -> RestoreItem:
+            destination = _safe_target(target_dir, item.path)
+            if item.archive is not None:
+                _restore_zip_item(archives, item, destination)
+            else:
+                _restore_chunked_item(chunk_store, item, destination)
+            return item
+
+        executor = get_executor()
+        max_inflight = max(2, settings.compression_workers * 4)
+        pending = set()
+        current = 0
+        bytes_written = 0
+
+        def collect(return_when):
+            nonlocal pending, current, bytes_written
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                item = future.result()
+                current += 1
+                bytes_written += item.size
+                on_progress(item, current, bytes_written)
+
+        for item in items:
+            if len(pending) >= max_inflight:
+                collect(FIRST_COMPLETED)
+            pending.add(executor.submit(restore, item))
+
+        collect(ALL_COMPLETED)
+    finally:
+        for zipf in archives.values():
+            zipf.close()
@@ -0,0 +1,119 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from upback.constants.constants import DATA_DIR
+from upback.enums.enums import BackupStatus
+from upback.models.models import Backup, TrackedApp
+from upback.services.chunk_store import ChunkStore, read_manifest
+from upback.services.storage_service import delete_location
+
+# Unlinking large archives frees a lot of extents at once, leave the disk some room while syncs run
+BUSY_DELETE_INTERVAL = 0.05
+
+
+class SweepMarker:
+    """Flag with the interface of threading.Event, kept as a file so every server worker sees it."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def set(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch()
+
+    def is_set(self) -> bool:
+        return self.path.exists()
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+
+# Set when chunked manifests were removed so the next prune run sweeps the chunk store
+pending_sweep = SweepMarker(DATA_DIR / "sweep.pending")
+
+_BUCKETS: Dict[str, Callable[[datetime], tuple]] = {
+    "keep_daily": lambda moment: (moment.year, moment.month, moment.day),
+    "keep_weekly": lambda moment: moment.isocalendar()[:2],
+    "keep_monthly": lambda moment: (moment.year, moment.month),
+}
+
+
+def has_policy(tracked_app: TrackedApp) -> bool:
+    return any(getattr(tracked_app, name) > 0 for name in ("keep_last", *_BUCKETS))
+
+
+def select_retained(tracked_app: TrackedApp, backups: List[Backup]) -> set[str]:
+    """Applies keep-last-N and grandfather-father-son rules to the succeeded backups of one app."""
+    by_id = {backup.backup_id: backup for backup in backups}
+    succeeded = sorted(
+        (backup for backup in backups if backup.status == BackupStatus.SUCCEEDED),
+        key=lambda backup: float(backup.timestamp),
+        reverse=True,
+    )
+
+    # Running backups are never touched and the newest one is the base of the next incremental
+    retained = {backup.backup_id for backup in backups if backup.status == BackupStatus.RUNNING}
+    retained.update(backup.backup_id for backup in succeeded[:max(1, tracked_app.keep_last)])
+
+    for name, bucket_of in _BUCKETS.items():
+        keep = getattr(tracked_app, name)
+        seen = set()
+
+        for backup in succeeded:
+            if len(seen) >= keep:
+                break
+
+            bucket = bucket_of(datetime.fromtimestamp(float(backup.timestamp)))
+            if bucket not in seen:
+                seen.add(bucket)
+                retained.add(backup.backup_id)
+
+    # Incremental zips only hold the changed files, everything a retained backup builds on has to stay
+    for backup_id in list(retained):
+        parent_id = by_id[backup_id].parent_id
+        while parent_id is not None and parent_id in by_id and not by_id[parent_id].file_path.endswith(".json"):
+            retained.add(parent_id)
+            parent_id = by_id[parent_id].parent_id
+
+    return retained
+
+
+def remove_backup_files(backups: List[Backup], is_busy: Callable[[], bool]) -> int:
+    reclaimed = 0
+
+    for backup in backups:
+        size = delete_location(backup.file_path)
+        if not size:
+            continue
+
+        reclaimed += size
+        if backup.file_path.endswith(".manifest.json"):
+            pending_sweep.set()
+
+        if is_busy():
+            time.sleep(BUSY_DELETE_INTERVAL)
+
+    return reclaimed
+
+
+def sweep_chunks(chunk_store: ChunkStore, manifest_paths: List[str]) -> tuple[int, int]:
+    # Cleared first, manifests another worker removes while this sweep runs leave it set for the next one
+    pending_sweep.clear()
+    referenced: set[str] = set()
+
+    try:
+        for manifest_path in manifest_paths:
+            try:
+                manifest = read_manifest(Path(manifest_path))
+            except FileNotFoundError:
+                continue
+
+            for file in manifest["files"]:
+                referenced.update(file["chunks"])
+
+        return chunk_store.sweep(referenced)
+    except BaseException:
+        pending_sweep.set()
+        raise
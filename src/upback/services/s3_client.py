@@ -0,0 +1,256 @@
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import urllib.error
+import urllib.request
+import uuid
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import quote, urlsplit
+
+REQUEST_TIMEOUT = 60
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+class S3Error(Exception):
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+class S3Client:
+    """The handful of S3 calls multipart uploads and ranged reads need, signed with SigV4.
+
+    Uses path-style addressing so it works against MinIO, Garage, Ceph and other S3-compatible stores.
+    """
+
+    def __init__(self, endpoint: str, bucket: str, region: str, access_key: str, secret_key: str):
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+    def create_multipart_upload(self, key: str) -> str:
+        with self._request("POST", key, {"uploads": ""}) as response:
+            return self._xml(response).findtext("{*}UploadId")
+
+    def upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        with self._request("PUT", key, {"partNumber": str(number), "uploadId": upload_id}, data) as response:
+            return response.headers["ETag"].strip('"')
+
+    def list_parts(self, key: str, upload_id: str) -> Dict[int, tuple[str, int]]:
+        parts = {}
+        query = {"uploadId": upload_id}
+
+        while True:
+            with self._request("GET", key, query) as response:
+                root = self._xml(response)
+            for part in root.iterfind("{*}Part"):
+                parts[int(part.findtext("{*}PartNumber"))] = (
+                    part.findtext("{*}ETag").strip('"'), int(part.findtext("{*}Size"))
+                )
+            if root.findtext("{*}IsTruncated") != "true":
+                return parts
+            query = {**query, "part-number-marker": root.findtext("{*}NextPartNumberMarker") or ""}
+
+    def list_multipart_uploads(self, prefix: str) -> List[tuple[str, str]]:
+        uploads = []
+        query = {"uploads": "", "prefix": prefix}
+
+        while True:
+            with self._request("GET", "", query) as response:
+                root = self._xml(response)
+            uploads += [
+                (upload.findtext("{*}Key"), upload.findtext("{*}UploadId"))
+                for upload in root.iterfind("{*}Upload")
+            ]
+            if root.findtext("{*}IsTruncated") != "true":
+                return uploads
+            query = {
+                **query,
+                "key-marker": root.findtext("{*}NextKeyMarker") or "",
+                "upload-id-marker": root.findtext("{*}NextUploadIdMarker") or "",
+            }
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: List[tuple[int, str]]):
+        body = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>\"{etag}\"</ETag></Part>" for number, etag in parts
+        )
+        data = f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode()
+        # Completing can fail after the 200 status has been sent, the error is in the body then
+        with self._request("POST", key, {"uploadId": upload_id}, data) as response:
+            root = self._xml(response)
+        if root.tag.endswith("Error"):
+            raise S3Error(f"Completing {key} failed: {root.findtext('{*}Message')}")
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        with self._request("DELETE", key, {"uploadId": upload_id}):
+            pass
+
+    def get_object(self, key: str, start: int, end: int) -> bytes:
+        with self._request("GET", key, headers={"Range": f"bytes={start}-{end}"}) as response:
+            return response.read()
+
+    def head_object(self, key: str) -> tuple[int, str] | None:
+        try:
+            with self._request("HEAD", key) as response:
+                return int(response.headers["Content-Length"]), response.headers.get("ETag", "").strip('"')
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def delete_object(self, key: str):
+        with self._request("DELETE", key):
+            pass
+
+    def _request(self, method: str, key: str, query: Dict[str, str] | None = None, data: bytes = b"",
+                 headers: Dict[str, str] | None = None):
+        path = quote(f"/{self.bucket}/{key}" if key else f"/{self.bucket}/", safe="/~")
+        query_string = "&".join(
+            f"{quote(name, safe='~')}={quote(value, safe='~')}" for name, value in sorted((query or {}).items())
+        )
+        payload_hash = hashlib.sha256(data).hexdigest() if data else EMPTY_SHA256
+        now = datetime.now(timezone.utc)
+
+        headers = {
+            **(headers or {}),
+            "host": self.host,
+            "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "x-amz-content-sha256": payload_hash,
+        }
+        headers["Authorization"] = self._authorization(method, path, query_string, headers, payload_hash, now)
+
+        url = f"{self.endpoint}{path}" + (f"?{query_string}" if query_string else "")
+        request = urllib.request.Request(url, data=data or None, method=method, headers=headers)
+
+        try:
+            return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            # The error is a response too, its socket stays open until it's closed
+            with e:
+                body = e.read().decode(errors="replace") if method != "HEAD" else ""
+            raise S3Error(f"{method} {key or self.bucket} returned {e.code}: {body[:200]}", e.code) from None
+
+    def _authorization(self, method: str, path: str, query_string: str, headers: Dict[str, str],
+                       payload_hash: str, now: datetime) -> str:
+        date = now.strftime("%Y%m%d")
+        scope = f"{date}/{self.region}/s3/aws4_request"
+
+        signed = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+        canonical_headers = "".join(f"{name}:{lowered[name]}\n" for name in signed)
+        signed_headers = ";".join(signed)
+
+        canonical_request = "\n".join(
+            [method, path, query_string, canonical_headers, signed_headers, payload_hash]
+        )
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            headers["x-amz-date"],
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        return f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, SignedHeaders={signed_headers}, " \
+               f"Signature={signature}"
+
+    @staticmethod
+    def _xml(response) -> ElementTree.Element:
+        body = response.read()
+        return ElementTree.fromstring(body) if body else ElementTree.Element("Empty")
+
+
+class FakeS3Client:
+    """Directory backed stand-in with the same multipart semantics, for tests and local development."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.objects = root / "objects"
+        self.uploads = root / "uploads"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.uploads.mkdir(parents=True, exist_ok=True)
+
+    def create_multipart_upload(self, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        (self.uploads / upload_id).mkdir()
+        (self.uploads / upload_id / "upload.json").write_text(json.dumps({"key": key}))
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        upload_dir = self._upload_dir(key, upload_id)
+        tmp_path = upload_dir / f"{number}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, upload_dir / f"{number}.part")
+        return hashlib.md5(data).hexdigest()
+
+    def list_parts(self, key: str, upload_id: str) -> Dict[int, tuple[str, int]]:
+        parts = {}
+        for part in self._upload_dir(key, upload_id).glob("*.part"):
+            data = part.read_bytes()
+            parts[int(part.stem)] = (hashlib.md5(data).hexdigest(), len(data))
+        return parts
+
+    def list_multipart_uploads(self, prefix: str) -> List[tuple[str, str]]:
+        uploads = []
+        for upload_dir in self.uploads.iterdir():
+            key = json.loads((upload_dir / "upload.json").read_text())["key"]
+            if key.startswith(prefix):
+                uploads.append((key, upload_dir.name))
+        return uploads
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: List[tuple[int, str]]):
+        upload_dir = self._upload_dir(key, upload_id)
+        target = self.objects / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(target.with_name(f"{target.name}.tmp"), "wb") as f:
+            for number, etag in parts:
+                data = (upload_dir / f"{number}.part").read_bytes()
+                if hashlib.md5(data).hexdigest() != etag:
+                    raise S3Error(f"Part {number} of {key} doesn't match its ETag", 400)
+                f.write(data)
+
+        os.replace(target.with_name(f"{target.name}.tmp"), target)
+        shutil.rmtree(upload_dir)
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        shutil.rmtree(self._upload_dir(key, upload_id), ignore_errors=True)
+
+    def get_object(self, key: str, start: int, end: int) -> bytes:
+        with open(self._object(key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def head_object(self, key: str) -> tuple[int, str] | None:
+        try:
+            stat = (self.objects / key).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, str(stat.st_mtime_ns)
+
+    def delete_object(self, key: str):
+        (self.objects / key).unlink(missing_ok=True)
+
+    def _object(self, key: str) -> Path:
+        path = self.objects / key
+        if not path.is_file():
+            raise S3Error(f"{key} does not exist", 404)
+        return path
+
+    def _upload_dir(self, key: str, upload_id: str) -> Path:
+        upload_dir = self.uploads / upload_id
+        if not upload_dir.is_dir():
+            raise S3Error(f"Upload {upload_id} for {key} does not exist", 404)
+        return upload_dir
@@ -0,0 +1,169 @@
+import itertools
+import os
+import stat as stat_module
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from upback.models.models import ManifestEntry
+from upback.services.sqlite_snapshot_service import SIDECAR_SUFFIXES
+
+
+class FileScanner:
+    """Lazily walks a tracked directory, yielding files as soon as they are discovered.
+
+    Symlinks to files are archived as the file they point to, symlinked folders aren't followed.
+    """
+
+    def __init__(self, source_dir: Path, estimated_total: int = 0, estimated_bytes: int = 0):
+        self.source_dir = source_dir
+        self.estimated_total = estimated_total
+        self.estimated_bytes = estimated_bytes
+        self.discovered = 0
+        self.discovered_bytes = 0
+        self.complete = False
+        self.scan_seconds = 0.0
+        # Symlinked files that were yielded, their targets can change without an event under the link
+        self.links: set[str] = set()
+
+    @property
+    def total(self) -> int:
+        if self.complete:
+            return self.discovered
+        return max(self.estimated_total, self.discovered)
+
+    @property
+    def total_bytes(self) -> int:
+        if self.complete:
+            return self.discovered_bytes
+        return max(self.estimated_bytes, self.discovered_bytes)
+
+    def __iter__(self) -> Iterator[tuple[Path, str, os.stat_result | None]]:
+        # Arcnames are relative to the parent so archives keep the tracked folder as their root
+        yield from self._walk(str(self.source_dir), self.source_dir.name)
+        self.complete = True
+
+    def _walk(self, root: str, root_prefix: str) -> Iterator[tuple[Path, str, os.stat_result]]:
+        stack = [(root, root_prefix)]
+        # Time spent walking the tree, not the time the consumer spends between files
+        started = time.perf_counter()
+
+        while stack:
+            directory, prefix = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        arcname = f"{prefix}/{entry.name}"
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, arcname))
+                                continue
+                            if not entry.is_file():
+                                continue
+                            stat = entry.stat()
+                            if entry.is_symlink():
+                                self.links.add(entry.path)
+                        except OSError as e:
+                            print("Scan Error:", e)
+                            continue
+
+                        self.discovered += 1
+                        self.discovered_bytes += stat.st_size
+                        self.scan_seconds += time.perf_counter() - started
+                        yield Path(entry.path), arcname, stat
+                        started = time.perf_counter()
+            except OSError as e:
+                print("Scan Error:", e)
+
+        self.scan_seconds += time.perf_counter() - started
+
+
+class JournalScanner(FileScanner):
+    """Only visits the paths from the change journal, every other file is taken from the previous manifest.
+
+    Files that are known to be unchanged are yielded without a stat, writers reuse their manifest entry.
+    """
+
+    def __init__(self, source_dir: Path, previous: Dict[str, ManifestEntry], dirty_paths: Iterable[str],
+                 links: Iterable[str] = ()):
+        super().__init__(
+            source_dir,
+            estimated_total=len(previous),
+            estimated_bytes=sum(entry.size for entry in previous.values()),
+        )
+        self.previous = previous
+        self.dirty: set[str] = set()
+
+        # Symlinked files are checked on every sync, changes to their targets aren't journaled under the link
+        for path in itertools.chain(dirty_paths, links):
+            arcname = self._to_arcname(path)
+            if arcname is None:
+                continue
+            self.dirty.add(arcname)
+            # WAL commits only touch the sidecar, the database itself has to be snapshotted again
+            for suffix in SIDECAR_SUFFIXES:
+                if arcname.endswith(suffix):
+                    self.dirty.add(arcname[:-len(suffix)])
+
+    def _to_arcname(self, path: str) -> str | None:
+        try:
+            relative = Path(path).relative_to(self.source_dir)
+        except ValueError:
+            return None
+        return "/".join((self.source_dir.name, *relative.parts))
+
+    def _is_dirty(self, arcname: str) -> bool:
+        while True:
+            if arcname in self.dirty:
+                return True
+            separator = arcname.rfind("/")
+            if separator < 0:
+                return False
+            arcname = arcname[:separator]
+
+    def __iter__(self) -> Iterator[tuple[Path, str, os.stat_result | None]]:
+        root = self.source_dir.parent
+        walked: set[str] = set()
+
+        # Sorted so a dirty directory is walked before any dirty path inside it
+        for arcname in sorted(self.dirty):
+            if any(arcname.startswith(f"{parent}/") for parent in walked):
+                continue
+
+            path = root / arcname
+            try:
+                stat = os.lstat(path)
+            except FileNotFoundError:
+                # Deleted, it simply won't show up in the new manifest
+                continue
+            except OSError as e:
+                print("Scan Error:", e)
+                continue
+
+            if stat_module.S_ISDIR(stat.st_mode):
+                walked.add(arcname)
+                yield from self._walk(str(path), arcname)
+                continue
+
+            if stat_module.S_ISLNK(stat.st_mode):
+                # Same policy as the full walk, dangling links and links to folders are skipped
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat_module.S_ISREG(stat.st_mode):
+                    self.links.add(str(path))
+
+            if stat_module.S_ISREG(stat.st_mode):
+                self.discovered += 1
+                self.discovered_bytes += stat.st_size
+                yield path, arcname, stat
+
+        for arcname, entry in self.previous.items():
+            if self._is_dirty(arcname):
+                continue
+            self.discovered += 1
+            self.discovered_bytes += entry.size
+            yield root / arcname, arcname, None
+
+        self.complete = True
@@ -0,0 +1,96 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+from apscheduler.triggers.cron import CronTrigger
+
+from upback.constants.constants import SYSTEM_TIME_ZONE
+from upback.models.models import TrackedApp
+
+RUNS_PER_APP = 10
+
+
+@lru_cache(maxsize=1024)
+def get_cron_trigger(cron_expr: str) -> CronTrigger:
+    return CronTrigger.from_crontab(cron_expr)
+
+
+class ScheduleTimeline:
+    """Keeps the next few fire times of every tracked app so lookups don't re-evaluate cron expressions."""
+
+    def __init__(self, runs_per_app: int = RUNS_PER_APP):
+        self.runs_per_app = runs_per_app
+        self._lock = threading.Lock()
+        self._runs: Dict[str, tuple[str, List[datetime]]] = {}
+
+    def invalidate(self, app_id: str):
+        with self._lock:
+            self._runs.pop(str(app_id), None)
+
+    def runs(self, app_id: str, cron: str, now: datetime | None = None) -> List[datetime]:
+        now = now or datetime.now(SYSTEM_TIME_ZONE)
+
+        with self._lock:
+            cached = self._runs.get(app_id)
+            if cached is not None and cached[0] == cron:
+                runs = [run for run in cached[1] if run > now]
+            else:
+                runs = []
+
+            if not runs:
+                runs = self._compute(cron, now)
+            elif len(runs) < self.runs_per_app // 2:
+                runs += self._compute(cron, runs[-1])[:self.runs_per_app - len(runs)]
+
+            self._runs[app_id] = (cron, runs)
+            return runs
+
+    def next_run(self, app_id: str, cron: str) -> datetime:
+        return self.runs(str(app_id), cron)[0]
+
+    def upcoming(self, apps: Iterable[TrackedApp], limit: int, horizon: timedelta | None = None) -> List[dict]:
+        now = datetime.now(SYSTEM_TIME_ZONE)
+        until = now + horizon if horizon is not None else None
+
+        timelines = []
+        for app in apps:
+            runs = self.runs(str(app.uuid), app.cron, now)
+            timelines.append([(run, str(app.uuid), app) for run in runs])
+            # Past the last cached run of a frequent app the merged timeline would silently skip its runs
+            if len(runs) >= self.runs_per_app and (until is None or runs[-1] < until):
+                until = runs[-1]
+
+        upcoming = []
+        for run, app_id, app in heapq.merge(*timelines, key=lambda item: (item[0], item[1])):
+            if until is not None and run > until or len(upcoming) >= limit:
+                break
+            upcoming.append({
+                "app_id": app_id,
+                "file_path": app.file_path,
+                "next_run": run.isoformat(),
+                "seconds_remaining": max(int((run - now).total_seconds()), 0),
+            })
+
+        return upcoming
+
+    def _compute(self, cron: str, after: datetime) -> List[datetime]:
+        trigger = get_cron_trigger(cron)
+        runs = []
+        previous = None
+        current = after
+
+        while len(runs) < self.runs_per_app:
+            run = trigger.get_next_fire_time(previous, current)
+            if run is None:
+                break
+            if run > after:
+                runs.append(run)
+            previous = run
+            current = run + timedelta(microseconds=1)
+
+        return runs
+
+
+schedule_timeline = ScheduleTimeline()
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import queue
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from upback.config.settings import settings
+from upback.constants.constants import LOCKS_DIR
+from upback.enums.enums import BackupStatus, ScrubStatus
+from upback.services.chunk_store import ChunkStore, read_manifest
+from upback.services.event_service import event_bus
+from upback.services.file_lock import FileLock
+from upback.services.metrics_service import register_gauge
+from upback.services.storage_service import open_location
+from upback.services.sync_queue_service import sync_executor
+from upback.services.throttle_service import MB, TokenBucket
+
+# Members are read in large sequential slices, in archive order
+SCRUB_READ_SIZE = 4 * MB
+SCRUB_BATCH = 16
+CHECKPOINT_SECONDS = 10
+# Scrubbing steps aside while syncs run, this is how often it checks whether they're done
+SYNC_POLL_SECONDS = 2
+# Chunks shared between manifests are verified once per run, up to this many
+VERIFIED_CHUNKS_LIMIT = 1_000_000
+MANIFEST_SUFFIX = ".manifest.json"
+# Keeps two server workers from scrubbing at once
+SCRUB_LOCK = LOCKS_DIR / "scrub.lock"
+
+
+@dataclass
+class _ScrubJob:
+    backup_id: str
+    app_id: str
+    location: str
+    next_member: int
+    checked_members: int
+    checked_bytes: int
+    corrupt_members: List[dict]
+
+
+class Scrubber:
+    """Reads stored backups back and checks them against their CRCs and content hashes.
+
+    Progress inside an archive is checkpointed to the database, so after a restart the scrub continues in the
+    archive it was working on instead of starting the pass over.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self.bucket = TokenBucket()
+        self.verified_bytes = 0
+        self._verified_chunks: set[str] = set()
+        self._syncs_checked = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def run(self, db, chunk_root: Path) -> Dict[str, int] | None:
+        """Verifies every backup that is due, returns None when a scrub is already running here or elsewhere."""
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+
+        lock = FileLock(SCRUB_LOCK)
+        if not lock.acquire(timeout=0):
+            self._running = False
+            return None
+
+        self.bucket.rate = settings.scrub_read_limit_mb_per_s * MB
+        self._verified_chunks = set()
+        chunk_store = ChunkStore(chunk_root)
+        totals = {status.value: 0 for status in ScrubStatus if status != ScrubStatus.VERIFYING}
+        verified_before = (datetime.now() - timedelta(days=settings.scrub_max_age_days)).isoformat()
+        # Backups that failed with an error stay due, this keeps one run from retrying them forever
+        attempted: List[str] = []
+
+        try:
+            while rows := db.get_due_scrubs(BackupStatus.SUCCEEDED, verified_before, attempted, SCRUB_BATCH):
+                jobs: queue.Queue[_ScrubJob] = queue.Queue()
+                for row in rows:
+                    attempted.append(row[0])
+                    jobs.put(_ScrubJob(*row[:6], corrupt_members=json.loads(row[6])))
+
+                workers = [
+                    threading.Thread(target=self._work, args=(db, chunk_store, jobs, totals), name="upback-scrub",
+                                     daemon=True)
+                    for _ in range(min(max(1, settings.scrub_workers), len(rows)))
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+        finally:
+            lock.release()
+            self._running = False
+
+        return totals
+
+    def _work(self, db, chunk_store: ChunkStore, jobs: queue.Queue, totals: Dict[str, int]):
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+
+            status = self._scrub(db, chunk_store, job)
+            with self._lock:
+                totals[status.value] += 1
+
+    def _scrub(self, db, chunk_store: ChunkStore, job: _ScrubJob) -> ScrubStatus:
+        if job.next_member == 0:
+            job.checked_members = job.checked_bytes = 0
+            job.corrupt_members = []
+
+        last_checkpoint = time.monotonic()
+
+        def checkpoint(next_member: int):
+            nonlocal last_checkpoint
+            job.next_member = next_member
+            if time.monotonic() - last_checkpoint >= CHECKPOINT_SECONDS:
+                _save(db, job, ScrubStatus.VERIFYING, None)
+                last_checkpoint = time.monotonic()
+
+        error = None
+        try:
+            if job.location.endswith(MANIFEST_SUFFIX):
+                self._verify_chunked(chunk_store, job, checkpoint)
+            else:
+                self._verify_zip(db, job, checkpoint)
+            status = ScrubStatus.CORRUPT if job.corrupt_members else ScrubStatus.OK
+        except FileNotFoundError as e:
+            status, error = ScrubStatus.MISSING, str(e)
+        except (zipfile.BadZipFile, zlib.error, EOFError, ValueError, KeyError) as e:
+            # The central directory or manifest itself is damaged, none of the members can be trusted
+            job.corrupt_members.append({"member": None, "error": str(e)})
+            status = ScrubStatus.CORRUPT
+        except Exception as e:
+            print("Scrub Error:", job.location, e)
+            status, error = ScrubStatus.ERROR, str(e)
+
+        if status == ScrubStatus.ERROR:
+            # Not verified, the next run continues from the last checkpoint
+            _save(db, job, status, error)
+            return status
+
+        job.next_member = 0
+        _save(db, job, status, error, verified_at=datetime.now().isoformat())
+
+        if status == ScrubStatus.CORRUPT:
+            print("Scrub found corruption in", job.location, job.corrupt_members[:5])
+            event_bus.publish("backups", "corrupt", {
+                "backup_id": job.backup_id,
+                "app_id": job.app_id,
+                "corrupt_members": len(job.corrupt_members),
+            })
+        return status
+
+    def _verify_zip(self, db, job: _ScrubJob, checkpoint: Callable[[int], None]):
+        with open_location(job.location) as source, zipfile.ZipFile(source) as zipf:
+            members = sorted((info for info in zipf.infolist() if not info.is_dir()), key=lambda i: i.header_offset)
+
+            for index in range(job.next_member, len(members)):
+                info = members[index]
+                expected = db.get_catalog_hash(job.backup_id, info.filename)
+                try:
+                    digest = self._read_member(zipf, info, expected is not None)
+                    if expected is not None and digest != expected:
+                        job.corrupt_members.append({"member": info.filename, "error": "SHA-256 mismatch"})
+                except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                    # Includes CRC mismatches, zipfile checks those once a member is read to the end
+                    job.corrupt_members.append({"member": info.filename, "error": str(e)})
+
+                job.checked_members += 1
+                job.checked_bytes += info.compress_size
+                checkpoint(index + 1)
+
+    def _read_member(self, zipf: zipfile.ZipFile, info: zipfile.ZipInfo, hashing: bool) -> str | None:
+        digest = hashlib.sha256() if hashing else None
+        # The budget is for disk reads, which are the compressed bytes
+        ratio = info.compress_size / info.file_size if info.file_size else 1.0
+
+        with zipf.open(info) as member:
+            while block := member.read(SCRUB_READ_SIZE):
+                self._consume(int(len(block) * ratio))
+                if digest is not None:
+                    digest.update(block)
+
+        return digest.hexdigest() if digest is not None else None
+
+    def _verify_chunked(self, chunk_store: ChunkStore, job: _ScrubJob, checkpoint: Callable[[int], None]):
+        files = read_manifest(Path(job.location))["files"]
+
+        for index in range(job.next_member, len(files)):
+            entry = files[index]
+            # Chunks are named by the SHA-256 of their content, checking them covers the file
+            for digest in entry["chunks"]:
+                if digest in self._verified_chunks:
+                    continue
+                error = self._verify_chunk(chunk_store, digest)
+                if error is not None:
+                    job.corrupt_members.append({"member": entry["path"], "error": f"chunk {digest}: {error}"})
+                    break
+                if len(self._verified_chunks) < VERIFIED_CHUNKS_LIMIT:
+                    self._verified_chunks.add(digest)
+
+            job.checked_members += 1
+            job.checked_bytes += entry["size"]
+            checkpoint(index + 1)
+
+    def _verify_chunk(self, chunk_store: ChunkStore, digest: str) -> str | None:
+        try:
+            data = chunk_store.chunk_path(digest).read_bytes()
+        except FileNotFoundError:
+            return "missing"
+
+        self._consume(len(data))
+        try:
+            content = zlib.decompress(data)
+        except zlib.error as e:
+            return str(e)
+        return None if hashlib.sha256(content).hexdigest() == digest else "SHA-256 mismatch"
+
+    def _consume(self, amount: int):
+        while self._syncs_running():
+            time.sleep(SYNC_POLL_SECONDS)
+
+        self.bucket.consume(amount)
+        with self._lock:
+            self.verified_bytes += amount
+
+    def _syncs_running(self) -> bool:
+        if sync_executor.snapshot()["running"]:
+            return True
+
+        # Checking on the other server workers takes a lock file, so it happens once per poll interval
+        if time.monotonic() - self._syncs_checked < SYNC_POLL_SECONDS:
+            return False
+        if sync_executor.running_anywhere():
+            return True
+        self._syncs_checked = time.monotonic()
+        return False
+
+
+def _save(db, job: _ScrubJob, status: ScrubStatus, error: str | None, verified_at: str | None = None):
+    db.save_scrub(job.backup_id, status, verified_at, job.next_member, job.checked_members, job.checked_bytes,
+                  job.corrupt_members, error)
+
+
+scrubber = Scrubber()
+
+register_gauge("upback_scrub_bytes_read", "Bytes the integrity scrubber read back since startup.",
+               lambda: scrubber.verified_bytes)
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, List
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+SQLITE_EXTENSIONS = {".db", ".sqlite", ".sqlite3", ".db3"}
+SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+
+# Pages copied per backup step, the source is only locked while a step runs
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_SLEEP = 0.005
+PAGE_HASH_SIZE = 16
+
+SQLITE_MEMBER = ".upback/sqlite.json"
+PAGES_PREFIX = ".upback/sqlite/"
+
+
+@dataclass
+class SqliteSnapshot:
+    path: Path
+    page_size: int
+    page_count: int
+    hashes: bytes
+    sha256: str
+
+
+def is_sqlite(file: Path, stat: os.stat_result) -> bool:
+    # The extension check keeps the header read off the path of every ordinary file
+    if file.suffix.lower() not in SQLITE_EXTENSIONS or stat.st_size < 100:
+        return False
+
+    try:
+        with open(file, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def sidecar_of(file: Path) -> Path | None:
+    """Returns the database a -wal, -shm or -journal file belongs to, the snapshot already includes them."""
+    for suffix in SIDECAR_SUFFIXES:
+        if file.name.endswith(suffix):
+            database = file.with_name(file.name[:-len(suffix)])
+            try:
+                if is_sqlite(database, database.stat()):
+                    return database
+            except OSError:
+                return None
+    return None
+
+
+def has_pending_wal(file: Path) -> bool:
+    # Commits can sit in the WAL without touching the database file's size or mtime
+    try:
+        return file.with_name(f"{file.name}-wal").stat().st_size > 0
+    except OSError:
+        return False
+
+
+def take_snapshot(file: Path, directory: Path, stat: os.stat_result) -> SqliteSnapshot:
+    target = directory / f"{hashlib.sha256(str(file).encode()).hexdigest()[:16]}{file.suffix}"
+
+    try:
+        source = sqlite3.connect(f"{file.as_uri()}?mode=ro", uri=True)
+        try:
+            with sqlite3.connect(target) as destination:
+                source.backup(destination, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP)
+            destination.close()
+        finally:
+            source.close()
+    except sqlite3.Error as e:
+        # Databases that can't be opened (locked exclusively, read-only without -shm, ...) fall back to a copy
+        print("SQLite snapshot failed, copying instead:", file, e)
+        shutil.copyfile(file, target)
+
+    # The snapshot stands in for the original file, so it keeps its timestamps
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return _hash_pages(target)
+
+
+def _hash_pages(path: Path) -> SqliteSnapshot:
+    with open(path, "rb") as f:
+        header = f.read(100)
+        f.seek(0)
+
+        # The page size is stored big-endian at offset 16, where 1 means 65536
+        page_size = int.from_bytes(header[16:18], "big")
+        page_size = 65536 if page_size == 1 else page_size
+
+        file_hash = hashlib.sha256()
+        hashes = bytearray()
+        page_count = 0
+
+        while page := f.read(page_size):
+            file_hash.update(page)
+            hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+            page_count += 1
+
+    return SqliteSnapshot(
+        path=path,
+        page_size=page_size,
+        page_count=page_count,
+        hashes=bytes(hashes),
+        sha256=file_hash.hexdigest(),
+    )
+
+
+def write_changed_pages(snapshot: SqliteSnapshot, previous_hashes: bytes, target: Path) -> List[int]:
+    changed = []
+
+    with open(snapshot.path, "rb") as src, open(target, "wb") as dst:
+        for index in range(snapshot.page_count):
+            start = index * PAGE_HASH_SIZE
+            if snapshot.hashes[start:start + PAGE_HASH_SIZE] == previous_hashes[start:start + PAGE_HASH_SIZE]:
+                continue
+
+            src.seek(index * snapshot.page_size)
+            dst.write(src.read(snapshot.page_size))
+            changed.append(index)
+
+    return changed
+
+
+def apply_pages(target: BinaryIO, pages: BinaryIO, page_size: int, page_count: int, indices: List[int]):
+    for index in indices:
+        target.seek(index * page_size)
+        target.write(pages.read(page_size))
+
+    target.truncate(page_count * page_size)
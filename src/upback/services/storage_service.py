@@ -0,0 +1,416 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List
+
+from upback.constants.constants import BACKUPS_DIR, DATA_DIR
+from upback.services.s3_client import FakeS3Client, S3Client, S3Error
+from upback.utils.utils import normalize_path
+
+DEFAULT_STORAGE = "local"
+STORAGE_CONFIG = Path(os.environ.get("UPBACK_STORAGE_CONFIG") or DATA_DIR / "storage.json")
+
+MB = 1024 * 1024
+# S3 rejects parts under 5 MiB except for the last one
+MIN_PART_SIZE = 5 * MB
+DEFAULT_PART_SIZE = 16 * MB
+DEFAULT_CONCURRENCY = 4
+PART_RETRIES = 5
+RETRY_BACKOFF = 0.5
+READ_AHEAD = 1 * MB
+
+
+@dataclass
+class StoredObject:
+    size: int
+    # Changes whenever the object is rewritten, used to key caches
+    version: str
+
+
+class StorageBackend:
+    """Where archives live. Backups store the location returned by location(), which maps back to the backend."""
+    kind = ""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    def is_local(self) -> bool:
+        return False
+
+    def location(self, key: str) -> str:
+        raise NotImplementedError
+
+    def open_writer(self, key: str, upload_id: str | None = None):
+        """Context manager yielding a stream for the archive, only published once the block exits cleanly.
+
+        Streams of backends with resumable uploads have an upload_id, which continues that upload when passed
+        back in for the same key.
+        """
+        raise NotImplementedError
+
+    def abort_upload(self, location: str, upload_id: str):
+        pass
+
+    def open_reader(self, location: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def stat(self, location: str) -> StoredObject | None:
+        raise NotImplementedError
+
+    def delete(self, location: str) -> int:
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        return {"name": self.name, "type": self.kind}
+
+
+class LocalBackend(StorageBackend):
+    """A directory on this machine, which may well be a NAS mount."""
+    kind = "local"
+
+    def __init__(self, name: str, root: Path):
+        super().__init__(name)
+        self.root = root
+
+    @property
+    def is_local(self) -> bool:
+        return True
+
+    def location(self, key: str) -> str:
+        return normalize_path(str(self.root / key))
+
+    @contextmanager
+    def open_writer(self, key: str, upload_id: str | None = None) -> Iterator[BinaryIO]:
+        path = Path(self.location(key))
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            with open(path, "wb") as f:
+                yield f
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+
+    def open_reader(self, location: str) -> BinaryIO:
+        return open(location, "rb")
+
+    def stat(self, location: str) -> StoredObject | None:
+        try:
+            stat = os.stat(location)
+        except FileNotFoundError:
+            return None
+        return StoredObject(size=stat.st_size, version=str(stat.st_mtime_ns))
+
+    def delete(self, location: str) -> int:
+        try:
+            size = os.stat(location).st_size
+            os.unlink(location)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def describe(self) -> dict:
+        return {**super().describe(), "path": str(self.root)}
+
+
+class MultipartWriter:
+    """Write-only stream that cuts the archive into parts and uploads them while the writer keeps going.
+
+    At most `concurrency` parts are in flight next to the one being filled, so memory stays bounded no matter
+    how large the archive gets. Given the upload of an earlier attempt, parts it already stored with the same
+    content are skipped, which is every part up to where the archive first differs.
+    """
+
+    def __init__(self, client, key: str, part_size: int, concurrency: int, upload_id: str | None = None):
+        self.client = client
+        self.key = key
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.uploaded: Dict[int, tuple[str, int]] = {}
+        if upload_id is not None:
+            try:
+                self.uploaded = client.list_parts(key, upload_id)
+            except S3Error as e:
+                if e.status != 404:
+                    raise
+                print("Upload of", key, "no longer exists, starting over")
+                upload_id = None
+        self.upload_id = upload_id or client.create_multipart_upload(key)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="upback-upload")
+        self.inflight: Dict[Future, int] = {}
+        self.etags: Dict[int, str] = {}
+        self.buffer = bytearray()
+        self.position = 0
+        self.part_number = 0
+        self.skipped = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+
+        while len(self.buffer) >= self.part_size:
+            self._submit(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def seekable(self) -> bool:
+        return False
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("Archives are streamed, they can't be rewritten in place")
+
+    def flush(self):
+        pass
+
+    def _submit(self, data: bytes):
+        self.part_number += 1
+        number = self.part_number
+
+        existing = self.uploaded.get(number)
+        if existing is not None and existing == (hashlib.md5(data, usedforsecurity=False).hexdigest(), len(data)):
+            self.etags[number] = existing[0]
+            self.skipped += 1
+            return
+
+        while len(self.inflight) >= self.concurrency:
+            self._collect(FIRST_COMPLETED)
+
+        self.inflight[self.executor.submit(self._upload_part, number, data)] = number
+
+    def _upload_part(self, number: int, data: bytes) -> str:
+        for attempt in range(PART_RETRIES):
+            try:
+                return self.client.upload_part(self.key, self.upload_id, number, data)
+            except (OSError, S3Error) as e:
+                if attempt == PART_RETRIES - 1:
+                    raise
+                print("Upload Error, retrying part", number, "of", self.key, e)
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    def _collect(self, return_when):
+        done, _ = wait(self.inflight, return_when=return_when)
+        for future in done:
+            number = self.inflight.pop(future)
+            self.etags[number] = future.result()
+
+    def commit(self):
+        # An empty archive still needs one (empty) part
+        if self.buffer or self.part_number == 0:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+        try:
+            while self.inflight:
+                self._collect(FIRST_COMPLETED)
+        finally:
+            self.executor.shutdown(wait=True)
+
+        self.client.complete_multipart_upload(self.key, self.upload_id, sorted(self.etags.items()))
+
+    def stop(self):
+        """Stops uploading and leaves the parts stored so far for a later attempt to resume."""
+        for future in self.inflight:
+            future.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable reader over ranged GETs, so zipfile can read the central directory and single members."""
+
+    def __init__(self, client, key: str, size: int):
+        self.client = client
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        end = min(self.size, self.position + len(buffer)) - 1
+        if end < self.position:
+            return 0
+
+        data = self.client.get_object(self.key, self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class S3Backend(StorageBackend):
+    kind = "s3"
+
+    def __init__(self, name: str, client, prefix: str = "", part_size: int = DEFAULT_PART_SIZE,
+                 concurrency: int = DEFAULT_CONCURRENCY):
+        super().__init__(name)
+        self.client = client
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.concurrency = max(1, concurrency)
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.name}/{self.prefix}{key}"
+
+    def _key(self, location: str) -> str:
+        return location.removeprefix(f"s3://{self.name}/")
+
+    @contextmanager
+    def open_writer(self, key: str, upload_id: str | None = None) -> Iterator[BinaryIO]:
+        object_key = f"{self.prefix}{key}"
+        writer = MultipartWriter(self.client, object_key, self.part_size, self.concurrency, upload_id)
+
+        # A failed upload is left in place for the next attempt, reconcile aborts the ones nobody resumes
+        try:
+            yield writer
+            writer.commit()
+        except BaseException:
+            writer.stop()
+            raise
+
+        if writer.skipped:
+            print("Resumed upload of", object_key, "skipped", writer.skipped, "parts")
+
+    def abort_upload(self, location: str, upload_id: str):
+        self.client.abort_multipart_upload(self._key(location), upload_id)
+
+    def open_reader(self, location: str) -> BinaryIO:
+        key = self._key(location)
+        stored = self.client.head_object(key)
+        if stored is None:
+            raise FileNotFoundError(location)
+        return io.BufferedReader(RangeReader(self.client, key, stored[0]), buffer_size=READ_AHEAD)
+
+    def stat(self, location: str) -> StoredObject | None:
+        stored = self.client.head_object(self._key(location))
+        return StoredObject(size=stored[0], version=stored[1]) if stored else None
+
+    def delete(self, location: str) -> int:
+        key = self._key(location)
+        stored = self.client.head_object(key)
+        if stored is None:
+            return 0
+        self.client.delete_object(key)
+        return stored[0]
+
+    def abort_uploads(self, keep: set[str]) -> int:
+        """Aborts multipart uploads left behind by crashed syncs, keeping the ones in `keep` (locations)."""
+        aborted = 0
+        for key, upload_id in self.client.list_multipart_uploads(self.prefix):
+            if self.location(key.removeprefix(self.prefix)) in keep:
+                continue
+            self.client.abort_multipart_upload(key, upload_id)
+            aborted += 1
+        return aborted
+
+    def describe(self) -> dict:
+        return {
+            **super().describe(),
+            "prefix": self.prefix,
+            "part_size_mb": self.part_size // MB,
+            "concurrency": self.concurrency,
+        }
+
+
+def _build_backend(name: str, config: dict) -> StorageBackend:
+    kind = config.get("type")
+    part_size = int(config.get("part_size_mb", DEFAULT_PART_SIZE // MB)) * MB
+    concurrency = int(config.get("concurrency", DEFAULT_CONCURRENCY))
+
+    if kind == "local":
+        return LocalBackend(name, Path(config["path"]))
+    if kind == "s3":
+        client = S3Client(
+            endpoint=config["endpoint"],
+            bucket=config["bucket"],
+            region=config.get("region", "us-east-1"),
+            access_key=config.get("access_key") or os.environ["AWS_ACCESS_KEY_ID"],
+            secret_key=config.get("secret_key") or os.environ["AWS_SECRET_ACCESS_KEY"],
+        )
+        return S3Backend(name, client, config.get("prefix", ""), part_size, concurrency)
+    if kind == "fake-s3":
+        return S3Backend(name, FakeS3Client(Path(config["path"])), config.get("prefix", ""), part_size, concurrency)
+
+    raise ValueError(f"Unknown storage type {kind!r} for {name}")
+
+
+class StorageRegistry:
+    """Backends from the storage config file, plus the `local` backups directory that always exists."""
+
+    def __init__(self, config_path: Path = STORAGE_CONFIG):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._backends: Dict[str, StorageBackend] | None = None
+
+    def _load(self) -> Dict[str, StorageBackend]:
+        with self._lock:
+            if self._backends is None:
+                backends: Dict[str, StorageBackend] = {DEFAULT_STORAGE: LocalBackend(DEFAULT_STORAGE, BACKUPS_DIR)}
+                if self.config_path.exists():
+                    for name, config in json.loads(self.config_path.read_text()).items():
+                        backends[name] = _build_backend(name, config)
+                self._backends = backends
+            return self._backends
+
+    def register(self, backend: StorageBackend):
+        self._load()[backend.name] = backend
+
+    def get(self, name: str) -> StorageBackend:
+        return self._load()[name]
+
+    def names(self) -> List[str]:
+        return list(self._load())
+
+    def all(self) -> List[StorageBackend]:
+        return list(self._load().values())
+
+    def for_location(self, location: str) -> StorageBackend:
+        # Anything that isn't a URL is a path on this machine, which includes every backup from before backends
+        if "://" not in location:
+            return self._load()[DEFAULT_STORAGE]
+        return self._load()[location.split("://", 1)[1].split("/", 1)[0]]
+
+
+storage_registry = StorageRegistry()
+
+
+def stat_location(location: str) -> StoredObject | None:
+    try:
+        return storage_registry.for_location(location).stat(location)
+    except KeyError:
+        print("Storage Error: no backend for", location)
+        return None
+
+
+def open_location(location: str) -> BinaryIO:
+    return storage_registry.for_location(location).open_reader(location)
+
+
+def delete_location(location: str) -> int:
+    return storage_registry.for_location(location).delete(location)
@@ -0,0 +1,249 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+from upback.config.settings import settings
+from upback.constants.constants import LOCKS_DIR
+from upback.enums.enums import SyncPriority
+from upback.services.event_service import event_bus
+from upback.services.file_lock import FileLock
+from upback.services.metrics_service import register_gauge
+from upback.services.throttle_service import apply_priority, throttle
+
+# Every running sync in every server worker holds this shared, the chunk sweep takes it exclusively
+SYNCS_LOCK = LOCKS_DIR / "syncs.lock"
+# How often a sync waiting for a slot another worker holds tries again
+SLOT_POLL_SECONDS = 1.0
+# How often a worker with several server workers next to it shares out the throttle and picks up changes to it
+COORDINATE_SECONDS = 2.0
+
+
+def app_lock(app_id: str) -> FileLock:
+    return FileLock(LOCKS_DIR / f"app-{app_id}.lock")
+
+
+def _slot_lock(index: int) -> FileLock:
+    return FileLock(LOCKS_DIR / f"slot-{index}.lock")
+
+
+@dataclass(order=True)
+class SyncJob:
+    priority: int
+    sequence: int
+    app_id: str = field(compare=False)
+    sync_id: str = field(compare=False)
+    run: Callable[[str], None] = field(compare=False, repr=False)
+
+
+class SyncExecutor:
+    """Runs syncs on a fixed number of workers, at most one queued or running job per app.
+
+    Each server worker has its own executor. File locks keep an app from syncing in two of them at once and
+    cap the syncs of all of them together at max_concurrent_syncs.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._heap: List[SyncJob] = []
+        self._queued: Dict[str, SyncJob] = {}
+        self._running: Dict[str, SyncJob] = {}
+        self._sequence = itertools.count()
+        self._workers: List[threading.Thread] = []
+        self._paused = 0
+        self._slots: set[int] = set()
+        self._coordinator: threading.Thread | None = None
+        self._local = threading.local()
+
+    def submit(self, app_id: str, run: Callable[[str], None], priority: int = SyncPriority.MANUAL) -> tuple[str, bool]:
+        with self._condition:
+            existing = self._queued.get(app_id) or self._running.get(app_id)
+            if existing is not None:
+                return existing.sync_id, False
+
+            job = SyncJob(
+                priority=int(priority),
+                sequence=next(self._sequence),
+                app_id=app_id,
+                sync_id=str(uuid.uuid4()),
+                run=run,
+            )
+            heapq.heappush(self._heap, job)
+            self._queued[app_id] = job
+            self._ensure_workers()
+            self._condition.notify_all()
+
+        self._publish_queue()
+        return job.sync_id, True
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            queued = sorted(self._heap)
+            return {
+                "limit": len(self._workers) or settings.max_concurrent_syncs,
+                "queue_depth": len(queued),
+                "running": [{"app_id": job.app_id, "sync_id": job.sync_id} for job in self._running.values()],
+                "queued": [
+                    {"app_id": job.app_id, "sync_id": job.sync_id, "position": position}
+                    for position, job in enumerate(queued, start=1)
+                ],
+            }
+
+    def is_active(self, app_id: str) -> bool:
+        with self._condition:
+            return app_id in self._queued or app_id in self._running
+
+    def is_running(self, app_id: str) -> bool:
+        with self._condition:
+            return app_id in self._running
+
+    def when_released(self, callback: Callable[[], None]):
+        """Runs callback once the calling sync has left the executor, right away outside a sync worker.
+
+        Anything that makes clients request the next sync of an app has to go out this way, a request that
+        arrives while the finished job still counts as running is folded into it and never runs.
+        """
+        deferred = getattr(self._local, "deferred", None)
+        if deferred is None:
+            callback()
+        else:
+            deferred.append(callback)
+
+    def running_anywhere(self) -> bool:
+        """Whether a sync runs in this or any other server worker."""
+        with self._condition:
+            if self._running:
+                return True
+
+        probe = FileLock(SYNCS_LOCK)
+        if not probe.acquire(timeout=0):
+            return True
+        probe.release()
+        return False
+
+    def count_running_anywhere(self) -> int:
+        with self._condition:
+            held = set(self._slots)
+
+        running = len(held)
+        for index in range(max(1, settings.max_concurrent_syncs)):
+            if index in held:
+                continue
+            probe = _slot_lock(index)
+            if probe.acquire(timeout=0):
+                probe.release()
+            else:
+                running += 1
+        return running
+
+    @contextmanager
+    def paused(self, timeout: float | None = None):
+        """Holds back queued syncs and yields whether the running ones finished within the timeout."""
+        with self._condition:
+            self._paused += 1
+            idle = self._condition.wait_for(lambda: not self._running, timeout)
+
+        try:
+            yield idle
+        finally:
+            with self._condition:
+                self._paused -= 1
+                self._condition.notify_all()
+
+    def _ensure_workers(self):
+        for index in range(len(self._workers), max(1, settings.max_concurrent_syncs)):
+            worker = threading.Thread(target=self._work, name=f"upback-sync-{index}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+        if settings.server_workers > 1 and self._coordinator is None:
+            self._coordinator = threading.Thread(target=self._coordinate, name="upback-sync-coordinator", daemon=True)
+            self._coordinator.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._paused:
+                    self._condition.wait()
+                job = heapq.heappop(self._heap)
+                self._queued.pop(job.app_id, None)
+                self._running[job.app_id] = job
+
+            self._publish_queue()
+
+            self._local.deferred = []
+            try:
+                self._run(job)
+            except Exception as e:
+                print("Sync Error:", job.app_id, e)
+            finally:
+                with self._condition:
+                    self._running.pop(job.app_id, None)
+                    self._condition.notify_all()
+
+                deferred, self._local.deferred = self._local.deferred, None
+                for callback in deferred:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print("Sync Error:", job.app_id, e)
+                self._publish_queue()
+
+    def _run(self, job: SyncJob):
+        with ExitStack() as stack:
+            lock = app_lock(job.app_id)
+            if not lock.acquire(timeout=0):
+                print("Sync Error:", job.app_id, "is already syncing in another worker")
+                return
+            stack.callback(lock.release)
+
+            slot = self._acquire_slot()
+            stack.callback(self._release_slot, slot)
+
+            syncs = FileLock(SYNCS_LOCK)
+            syncs.acquire(shared=True)
+            stack.callback(syncs.release)
+
+            apply_priority()
+            job.run(job.sync_id)
+
+    def _acquire_slot(self) -> tuple[int, FileLock]:
+        while True:
+            for index in range(max(1, settings.max_concurrent_syncs)):
+                lock = _slot_lock(index)
+                if lock.acquire(timeout=0):
+                    with self._condition:
+                        self._slots.add(index)
+                    return index, lock
+            time.sleep(SLOT_POLL_SECONDS)
+
+    def _release_slot(self, slot: tuple[int, FileLock]):
+        index, lock = slot
+        with self._condition:
+            self._slots.discard(index)
+        lock.release()
+
+    def _coordinate(self):
+        while True:
+            try:
+                throttle.reload()
+                with self._condition:
+                    local = len(self._slots)
+                # The global limits are for all workers together, each takes its share of the running syncs
+                throttle.set_share(local / max(local, self.count_running_anywhere()) if local else 1.0)
+            except OSError as e:
+                print("Sync Error:", e)
+            time.sleep(COORDINATE_SECONDS)
+
+    def _publish_queue(self):
+        event_bus.publish("syncs", "queue", {"queue": self.snapshot()})
+
+
+sync_executor = SyncExecutor()
+
+register_gauge("upback_sync_queue_depth", "Syncs waiting for a worker.", lambda: len(sync_executor._heap))
+register_gauge("upback_syncs_running", "Syncs currently running.", lambda: len(sync_executor._running))
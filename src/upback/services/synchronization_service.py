@@ -1,5 +1,103 @@
+import time
+from dataclasses import asdict
+from pathlib import Path
 from typing import Dict
 
+from upback.enums.enums import BackupStatus
 from upback.models.models import SyncStatus
+from upback.services.event_service import event_bus
+from upback.services.metrics_service import (
+    sync_duration, sync_phase_duration, syncs_total, sync_files, sync_bytes_read, sync_bytes_written
+)
+from upback.services.scan_service import FileScanner
+from upback.services.sync_queue_service import sync_executor
+
+PUBLISH_INTERVAL = 0.25
+RATE_SMOOTHING = 0.3
 
 running_syncs: Dict[str, SyncStatus] = {}
+
+
+class SyncProgress:
+    """Keeps one SyncStatus per sync up to date in place and publishes it at a bounded rate."""
+
+    def __init__(self, sync_id: str, app_id: str, scanner: FileScanner):
+        self.sync_id = sync_id
+        self.scanner = scanner
+        self.status = SyncStatus(app_id=app_id, current=0, total=scanner.total, file="")
+        # Seconds per phase, filled in by the writers once they are done so the file loop stays untouched
+        self.timings: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._file: Path | None = None
+        self._last_publish = 0.0
+        self._last_sample = (time.monotonic(), 0)
+
+        running_syncs[sync_id] = self.status
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.perf_counter() - self._started
+
+    def advance(self, file: Path, size: int, bytes_read: int = 0, bytes_written: int = 0):
+        status = self.status
+        status.current += 1
+        status.bytes_processed += size
+        status.bytes_read += bytes_read
+        status.bytes_written += bytes_written
+        self._file = file
+
+        now = time.monotonic()
+        if now - self._last_publish >= PUBLISH_INTERVAL:
+            self._publish(now)
+
+    def finish(self, state: BackupStatus, error: str | None = None):
+        self._publish(time.monotonic(), event=None)
+        self.status.state = state.value
+        self.status.error = error
+        self.status.eta_seconds = None if state != BackupStatus.SUCCEEDED else 0.0
+
+        running_syncs.pop(self.sync_id, None)
+        self._record_metrics(state)
+        event = {"sync_id": self.sync_id, "app_id": self.status.app_id, "status": asdict(self.status)}
+        sync_executor.when_released(lambda: event_bus.publish("syncs", "sync_finished", event))
+
+    def _record_metrics(self, state: BackupStatus):
+        status = self.status
+        app_id = status.app_id
+
+        sync_duration.observe(self.elapsed_seconds, app_id, state.value)
+        syncs_total.inc(app_id, state.value)
+        sync_files.inc(app_id, amount=status.current)
+        sync_bytes_read.inc(app_id, amount=status.bytes_read)
+        sync_bytes_written.inc(app_id, amount=status.bytes_written)
+
+        self.timings["scan"] = self.scanner.scan_seconds
+        for phase, seconds in self.timings.items():
+            sync_phase_duration.observe(seconds, app_id, phase)
+
+    def _publish(self, now: float, event: str | None = "sync_progress"):
+        status = self.status
+        scanner = self.scanner
+
+        # Only stringify the path and recompute the rates when a snapshot actually goes out
+        status.file = str(self._file) if self._file is not None else ""
+        status.total = scanner.total
+        status.total_bytes = scanner.total_bytes
+        status.discovered = scanner.discovered
+        status.scan_complete = scanner.complete
+
+        sample_time, sample_bytes = self._last_sample
+        elapsed = now - sample_time
+        if elapsed > 0:
+            rate = (status.bytes_processed - sample_bytes) / elapsed
+            status.throughput = rate if not status.throughput else (
+                status.throughput * (1 - RATE_SMOOTHING) + rate * RATE_SMOOTHING
+            )
+            self._last_sample = (now, status.bytes_processed)
+
+        remaining = max(0, status.total_bytes - status.bytes_processed)
+        status.eta_seconds = remaining / status.throughput if status.throughput > 0 else None
+
+        self._last_publish = now
+        if event is not None:
+            event_bus.publish("syncs", event, {"sync_id": self.sync_id, "status": asdict(status)})
@@ -0,0 +1,341 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from upback.config.settings import settings
+from upback.constants.constants import DATA_DIR
+from upback.services.metrics_service import register_gauge
+
+MB = 1024 * 1024
+# A bucket holds at most this many seconds of its rate, so an idle sync can't burst past the limit
+BURST_SECONDS = 1.0
+# Sleeps are sliced so a raised limit takes effect within this time
+MAX_SLEEP = 0.25
+
+PRESSURE_PATH = "/proc/pressure/io"
+PRESSURE_INTERVAL = 2.0
+# Percentage of wall time some task was stalled on I/O over the last 10 seconds
+PRESSURE_HIGH = 20.0
+PRESSURE_LOW = 5.0
+BACKOFF_FACTOR = 0.5
+RECOVER_FACTOR = 1.5
+MIN_ADAPTIVE_RATE = 1 * MB
+
+# Changes made through the API in one server worker reach the others through this file
+THROTTLE_FILE = DATA_DIR / "throttle.json"
+SHARED_SETTINGS = ("read_limit_mb_per_s", "cpu_workers", "sync_nice", "sync_ionice_class", "adaptive_throttle")
+
+# Only classes that lower a sync's I/O priority, realtime (1) would let a sync starve the rest of the host
+IONICE_CLASSES = {0: "none", 2: "best-effort", 3: "idle"}
+
+
+class TokenBucket:
+    """Read bandwidth limiter, a rate of 0 means unlimited. The rate can change while syncs are waiting on it."""
+
+    def __init__(self, rate: float = 0):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._tokens = rate * BURST_SECONDS
+        self._updated = time.monotonic()
+        self.consumed = 0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, value: float):
+        with self._lock:
+            self._refill()
+            self._rate = value
+            self._tokens = min(self._tokens, value * BURST_SECONDS)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._rate > 0:
+            self._tokens = min(self._rate * BURST_SECONDS, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def consume(self, amount: int):
+        # Reads larger than the bucket are allowed, they leave a debt the next reads have to wait out
+        with self._lock:
+            self.consumed += amount
+            if self._rate <= 0:
+                return
+            self._refill()
+            self._tokens -= amount
+
+        while True:
+            with self._lock:
+                if self._rate <= 0:
+                    self._tokens = 0
+                    return
+                self._refill()
+                if self._tokens >= 0:
+                    return
+                wait = min(MAX_SLEEP, -self._tokens / self._rate)
+            time.sleep(wait)
+
+
+class WorkerLimit:
+    """Semaphore whose size can change at runtime, a limit of 0 means unlimited."""
+
+    def __init__(self, limit: int = 0):
+        self._condition = threading.Condition()
+        self.limit = limit
+        self.active = 0
+
+    def set_limit(self, limit: int):
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.limit <= 0 or self.active < self.limit)
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._condition.notify()
+
+
+class SyncThrottle:
+    """The limits one sync reads and compresses under, looked up live so API changes apply mid-sync."""
+
+    def __init__(self, throttle: "Throttle", app_id: str):
+        self.throttle = throttle
+        self.app_id = app_id
+
+    def consume(self, amount: int):
+        bucket = self.throttle.app_buckets.get(self.app_id)
+        if bucket is not None:
+            bucket.consume(amount)
+        self.throttle.global_bucket.consume(amount)
+
+    def cpu_slot(self):
+        return self.throttle.cpu_limit.slot()
+
+    @property
+    def max_workers(self) -> int:
+        return self.throttle.app_workers.get(self.app_id, 0)
+
+
+class Throttle:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.global_bucket = TokenBucket()
+        self.cpu_limit = WorkerLimit()
+        self.app_buckets: Dict[str, TokenBucket] = {}
+        self.app_workers: Dict[str, int] = {}
+        self.pressure: float | None = None
+        # Bytes per second the adaptive mode currently allows, 0 while it isn't backing off
+        self.adaptive_rate = 0.0
+        # Fraction of the syncs of all server workers that run in this one
+        self.share = 1.0
+        self._loaded: int | None = None
+        self._monitor: threading.Thread | None = None
+        self.apply_settings()
+
+    def apply_settings(self):
+        with self._lock:
+            self._update_limits()
+
+        if settings.adaptive_throttle:
+            self._start_monitor()
+
+    def set_share(self, share: float):
+        with self._lock:
+            if share == self.share:
+                return
+            self.share = share
+            self._update_limits()
+
+    def save(self):
+        """Writes the settings changed at runtime for the other server workers."""
+        if settings.server_workers <= 1:
+            return
+
+        THROTTLE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        temp = THROTTLE_FILE.with_suffix(".tmp")
+        temp.write_text(json.dumps({name: getattr(settings, name) for name in SHARED_SETTINGS}))
+        os.replace(temp, THROTTLE_FILE)
+        self._loaded = THROTTLE_FILE.stat().st_mtime_ns
+
+    def reload(self):
+        """Picks up settings another server worker changed since the last call."""
+        if settings.server_workers <= 1:
+            return
+
+        try:
+            modified = THROTTLE_FILE.stat().st_mtime_ns
+            if modified == self._loaded:
+                return
+            values = json.loads(THROTTLE_FILE.read_text())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print("Throttle Error:", e)
+            return
+
+        self._loaded = modified
+        for name in SHARED_SETTINGS:
+            if name in values:
+                setattr(settings, name, values[name])
+        self.apply_settings()
+
+    def configure_app(self, app_id: str, read_limit_mb_per_s: int, cpu_workers: int) -> SyncThrottle:
+        with self._lock:
+            if read_limit_mb_per_s > 0:
+                bucket = self.app_buckets.setdefault(app_id, TokenBucket())
+                bucket.rate = read_limit_mb_per_s * MB
+            else:
+                self.app_buckets.pop(app_id, None)
+
+            if cpu_workers > 0:
+                self.app_workers[app_id] = cpu_workers
+            else:
+                self.app_workers.pop(app_id, None)
+
+        return SyncThrottle(self, app_id)
+
+    def remove_app(self, app_id: str):
+        with self._lock:
+            self.app_buckets.pop(app_id, None)
+            self.app_workers.pop(app_id, None)
+
+    def snapshot(self) -> dict:
+        self.reload()
+        with self._lock:
+            return {
+                "read_limit_mb_per_s": settings.read_limit_mb_per_s,
+                "cpu_workers": settings.cpu_workers,
+                "nice": settings.sync_nice,
+                "ionice_class": settings.sync_ionice_class,
+                "adaptive": settings.adaptive_throttle,
+                "io_pressure": self.pressure,
+                "adaptive_rate_mb_per_s": round(self.adaptive_rate / MB, 2) if self.adaptive_rate else None,
+                "effective_read_limit_mb_per_s": round(self.global_bucket.rate / MB, 2) or None,
+                "cpu_workers_active": self.cpu_limit.active,
+                "worker_share": round(self.share, 2),
+                "apps": {
+                    app_id: {
+                        "read_limit_mb_per_s": round(self.app_buckets[app_id].rate / MB, 2)
+                        if app_id in self.app_buckets else None,
+                        "cpu_workers": self.app_workers.get(app_id),
+                    }
+                    for app_id in self.app_buckets.keys() | self.app_workers.keys()
+                },
+            }
+
+    def _update_limits(self):
+        cpu_workers = max(0, settings.cpu_workers)
+        self.cpu_limit.set_limit(max(1, round(cpu_workers * self.share)) if cpu_workers else 0)
+        self._update_global_rate()
+
+    def _update_global_rate(self):
+        rates = [rate for rate in (settings.read_limit_mb_per_s * MB * self.share, self.adaptive_rate) if rate > 0]
+        self.global_bucket.rate = min(rates) if rates else 0
+
+    def _start_monitor(self):
+        with self._lock:
+            if self._monitor is not None:
+                return
+            if not os.path.exists(PRESSURE_PATH):
+                print("Adaptive throttling needs", PRESSURE_PATH, "which this kernel doesn't provide")
+                return
+            self._monitor = threading.Thread(target=self._watch_pressure, name="upback-pressure", daemon=True)
+            self._monitor.start()
+
+    def _watch_pressure(self):
+        consumed = self.global_bucket.consumed
+
+        while True:
+            time.sleep(PRESSURE_INTERVAL)
+            observed = (self.global_bucket.consumed - consumed) / PRESSURE_INTERVAL
+            consumed = self.global_bucket.consumed
+
+            try:
+                self.pressure = read_io_pressure()
+            except (OSError, ValueError) as e:
+                print("Pressure Error:", e)
+                continue
+
+            with self._lock:
+                if not settings.adaptive_throttle:
+                    self.adaptive_rate = 0.0
+                elif self.pressure >= PRESSURE_HIGH and observed > 0:
+                    base = min(self.adaptive_rate or observed, observed)
+                    self.adaptive_rate = max(MIN_ADAPTIVE_RATE, base * BACKOFF_FACTOR)
+                elif self.pressure <= PRESSURE_LOW and self.adaptive_rate:
+                    self.adaptive_rate *= RECOVER_FACTOR
+                    # Lift the limit once syncs no longer read anywhere near it
+                    if observed < self.adaptive_rate / (RECOVER_FACTOR * 2):
+                        self.adaptive_rate = 0.0
+                self._update_global_rate()
+
+
+def read_io_pressure() -> float:
+    with open(PRESSURE_PATH) as f:
+        for line in f:
+            if line.startswith("some "):
+                fields = dict(field.split("=", 1) for field in line.split()[1:])
+                return float(fields["avg10"])
+    raise ValueError(f"No 'some' line in {PRESSURE_PATH}")
+
+
+_priority = threading.local()
+
+
+def apply_priority():
+    """Applies the configured nice and ionice values to the calling worker thread, once per change.
+
+    Only call this from threads that do nothing but sync work, lowered priorities can't be raised back without
+    privileges.
+    """
+    wanted = (settings.sync_nice, settings.sync_ionice_class)
+    if getattr(_priority, "applied", (0, 0)) == wanted:
+        return
+    _priority.applied = wanted
+
+    # On Linux both priorities are per thread, so the rest of the process (the API) keeps its own
+    thread_id = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, thread_id, settings.sync_nice)
+    except (OSError, AttributeError) as e:
+        print("Priority Error:", e)
+
+    if settings.sync_ionice_class not in IONICE_CLASSES:
+        print("Priority Error: ionice class", settings.sync_ionice_class, "is not allowed, use one of",
+              sorted(IONICE_CLASSES))
+        return
+
+    ionice = shutil.which("ionice")
+    if ionice is None:
+        if settings.sync_ionice_class:
+            print("ionice is not installed, I/O priority left unchanged")
+        return
+
+    result = subprocess.run(
+        [ionice, "-c", str(settings.sync_ionice_class), "-p", str(thread_id)], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print("Priority Error:", result.stderr.strip())
+
+
+throttle = Throttle()
+
+register_gauge(
+    "upback_read_limit_bytes_per_second",
+    "Effective global read limit including adaptive backoff, 0 when unlimited.",
+    lambda: throttle.global_bucket.rate,
+)
+register_gauge("upback_compression_workers_active", "Workers holding a CPU slot.", lambda: throttle.cpu_limit.active)
@@ -0,0 +1,378 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List
+
+from upback.config.settings import settings
+from upback.models.models import TrackedApp
+from upback.services.metrics_service import register_gauge
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+FLUSH_INTERVAL = 1.0
+# Past this many dirty paths a full walk is cheaper than replaying the journal
+JOURNAL_LIMIT = 100_000
+# Continuous syncs wait for a quiet period, but never longer than this many debounce intervals
+MAX_DEBOUNCE_FACTOR = 4
+
+
+class Inotify:
+    """Minimal ctypes binding, inotify has no wrapper in the standard library."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        # Fails harmlessly when the kernel already dropped the watch
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[tuple[int, int, str]]:
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def is_supported() -> bool:
+    return sys.platform.startswith("linux") and hasattr(ctypes.CDLL(None), "inotify_init1")
+
+
+@dataclass
+class JournalLease:
+    app_id: str
+    epoch: int
+    # None when the journal can't be trusted and the sync has to walk the whole tree
+    paths: List[str] | None
+    links: frozenset[str] = frozenset()
+
+
+@dataclass
+class _WatchedApp:
+    app_id: str
+    root: str
+    continuous: bool
+    # Bumped whenever changes may have been missed, a sync only revalidates the journal if it didn't move
+    epoch: int = 0
+    valid: bool = False
+    degraded: bool = False
+    journal_size: int = 0
+    pending_since: float | None = None
+    last_change: float = 0.0
+    # Last change of any kind, also for apps that don't sync continuously
+    last_event: float = 0.0
+    # Symlinked files the last successful sync archived
+    links: frozenset[str] = frozenset()
+
+
+class ChangeWatcher:
+    """Records which paths changed under each tracked folder, so syncs don't have to walk the whole tree.
+
+    The journal only becomes trusted after a full sync that ran while the app was watched, so a restart,
+    a queue overflow or a vanished root always falls back to a full walk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inotify: Inotify | None = None
+        self._thread: threading.Thread | None = None
+        self._db = None
+        self._on_change: Callable[[str], bool] | None = None
+        self._apps: Dict[str, _WatchedApp] = {}
+        self._watches: Dict[int, str] = {}
+        self._directories: Dict[str, int] = {}
+        self._pending: set[tuple[str, str]] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, db, on_change: Callable[[str], bool]):
+        if self._thread is not None:
+            return
+
+        self._db = db
+        self._on_change = on_change
+        self._inotify = Inotify()
+        self._thread = threading.Thread(target=self._run, name="upback-watcher", daemon=True)
+        self._thread.start()
+
+    def refresh(self, tracked_apps: Iterable[TrackedApp]):
+        if self._inotify is None:
+            return
+
+        wanted = {str(app.uuid): app for app in tracked_apps}
+
+        with self._lock:
+            for app_id in list(self._apps):
+                if app_id not in wanted:
+                    del self._apps[app_id]
+
+            for app_id, app in wanted.items():
+                self._apply(app_id, app)
+
+            self._unwatch_orphans()
+
+    def update(self, app_id: str, tracked_app: TrackedApp | None):
+        """Applies a change to a single tracked app, None when it was deleted."""
+        if self._inotify is None:
+            return
+
+        with self._lock:
+            if tracked_app is None:
+                if self._apps.pop(app_id, None) is not None:
+                    self._unwatch_orphans()
+                return
+
+            if self._apply(app_id, tracked_app):
+                self._unwatch_orphans()
+
+    def _apply(self, app_id: str, app: TrackedApp) -> bool:
+        """Returns whether a folder stopped being watched."""
+        moved = False
+        watched = self._apps.get(app_id)
+        if watched is not None and os.path.normpath(app.file_path) != watched.root:
+            del self._apps[app_id]
+            watched, moved = None, True
+
+        if watched is None:
+            watched = self._apps[app_id] = _WatchedApp(app_id, os.path.normpath(app.file_path), app.continuous)
+            self._watch_tree(watched, watched.root)
+        elif watched.degraded:
+            watched.degraded = False
+            self._watch_tree(watched, watched.root)
+        watched.continuous = app.continuous
+        return moved
+
+    def begin_sync(self, app_id: str) -> JournalLease | None:
+        if self._inotify is None:
+            return None
+
+        with self._lock:
+            watched = self._apps.get(app_id)
+            if watched is None:
+                return None
+
+            self._flush()
+            paths = self._db.drain_journal(app_id)
+            watched.journal_size = 0
+            watched.pending_since = None
+            trusted = watched.valid and not watched.degraded
+            return JournalLease(app_id, watched.epoch, paths if trusted else None, watched.links)
+
+    def end_sync(self, lease: JournalLease | None, succeeded: bool, links: Iterable[str] = ()):
+        if lease is None:
+            return
+
+        with self._lock:
+            watched = self._apps.get(lease.app_id)
+            if watched is None:
+                return
+
+            if succeeded:
+                watched.valid = watched.epoch == lease.epoch
+                watched.links = frozenset(links)
+            elif lease.paths:
+                # The manifest wasn't replaced, so the drained paths are still dirty
+                self._db.add_journal_paths([(lease.app_id, path) for path in lease.paths])
+                watched.journal_size += len(lease.paths)
+
+    def last_event(self, app_id: str) -> float | None:
+        """Monotonic time anything last changed under the app, None when changes can't be seen."""
+        with self._lock:
+            watched = self._apps.get(app_id)
+            if watched is None or watched.degraded:
+                return None
+            return watched.last_event
+
+    def _watch_tree(self, watched: _WatchedApp, top: str):
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                wd = self._inotify.add_watch(directory)
+            except OSError as e:
+                if directory == top == watched.root or e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    # Out of watches or no root to watch, changes would go unnoticed
+                    print("Watch Error:", e)
+                    self._invalidate(watched, degraded=True)
+                    return
+                continue
+
+            self._watches[wd] = directory
+            self._directories[directory] = wd
+
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError as e:
+                print("Watch Error:", e)
+
+    def _unwatch_orphans(self):
+        roots = [watched.root for watched in self._apps.values()]
+        for directory, wd in list(self._directories.items()):
+            if not any(_is_within(directory, root) for root in roots):
+                self._inotify.rm_watch(wd)
+                del self._directories[directory]
+                self._watches.pop(wd, None)
+
+    def _invalidate(self, watched: _WatchedApp, degraded: bool = False):
+        watched.epoch += 1
+        watched.last_event = time.monotonic()
+        watched.valid = False
+        watched.degraded = watched.degraded or degraded
+
+    def _owners(self, path: str) -> List[_WatchedApp]:
+        return [watched for watched in self._apps.values() if _is_within(path, watched.root)]
+
+    def _mark(self, path: str, now: float):
+        for watched in self._owners(path):
+            watched.last_event = now
+            if (watched.app_id, path) not in self._pending:
+                self._pending.add((watched.app_id, path))
+                watched.journal_size += 1
+
+            if watched.journal_size > JOURNAL_LIMIT and watched.valid:
+                print("Change journal full, next sync walks", watched.root)
+                self._invalidate(watched)
+
+            if watched.continuous:
+                watched.last_change = now
+                if watched.pending_since is None:
+                    watched.pending_since = now
+
+    def _handle(self, events: List[tuple[int, int, str]], now: float):
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                print("Watch queue overflowed, next syncs walk the whole tree")
+                for watched in self._apps.values():
+                    self._invalidate(watched)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                if self._directories.get(directory) == wd:
+                    del self._directories[directory]
+                continue
+
+            path = os.path.join(directory, name) if name else directory
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                for watched in self._apps.values():
+                    if watched.root == directory:
+                        self._invalidate(watched, degraded=True)
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # Files can land in a new directory before its watch exists, the whole directory counts as dirty
+                for watched in self._owners(path):
+                    self._watch_tree(watched, path)
+
+            self._mark(path, now)
+
+    def _flush(self):
+        if self._pending:
+            self._db.add_journal_paths(list(self._pending))
+            self._pending.clear()
+
+    def _due_continuous_syncs(self, now: float) -> List[_WatchedApp]:
+        debounce = settings.continuous_debounce_seconds
+        return [
+            watched for watched in self._apps.values()
+            if watched.continuous and watched.pending_since is not None and (
+                now - watched.last_change >= debounce or now - watched.pending_since >= debounce * MAX_DEBOUNCE_FACTOR
+            )
+        ]
+
+    def _run(self):
+        last_flush = time.monotonic()
+
+        while True:
+            try:
+                readable, _, _ = select.select([self._inotify.fd], [], [], FLUSH_INTERVAL)
+                now = time.monotonic()
+
+                with self._lock:
+                    if readable:
+                        self._handle(self._inotify.read_events(), now)
+                    if now - last_flush >= FLUSH_INTERVAL:
+                        self._flush()
+                        last_flush = now
+                    due = self._due_continuous_syncs(now)
+
+                for watched in due:
+                    if self._on_change(watched.app_id):
+                        watched.pending_since = None
+                    else:
+                        # A sync is still running, try again once it had time to finish
+                        watched.pending_since = watched.last_change = now
+            except Exception as e:
+                print("Watch Error:", e)
+                time.sleep(FLUSH_INTERVAL)
+
+
+def _is_within(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+change_watcher = ChangeWatcher()
+
+register_gauge("upback_watched_directories", "Directories watched for changes.", lambda: len(change_watcher._watches))
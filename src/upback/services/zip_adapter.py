@@ -0,0 +1,76 @@
+import lzma
+import struct
+import sys
+import zipfile
+
+# zipfile only writes one member at a time through ZipFile.open, the parallel writer writes headers and data
+# itself. Everything it needs from zipfile's private API goes through this module, and
+# tests/test_zip_adapter.py pins it to the versions below.
+SUPPORTED_VERSIONS = ((3, 13),)
+
+DATA_DESCRIPTOR_FLAG = 0x08
+DATA_DESCRIPTOR_SIGNATURE = 0x08074B50
+
+if sys.version_info[:2] not in SUPPORTED_VERSIONS:
+    print(f"Zip writer not verified on Python {sys.version_info[0]}.{sys.version_info[1]},",
+          "run tests/test_zip_adapter.py before relying on its archives")
+
+
+class LZMACompressor:
+    """zipfile.LZMACompressor with a preset, zipfile ignores the compression level for lzma."""
+
+    def __init__(self, preset: int):
+        self._filter = {"id": lzma.FILTER_LZMA1, "preset": preset}
+        self._comp = None
+
+    def _init(self) -> bytes:
+        props = lzma._encode_filter_properties(self._filter)
+        self._comp = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[self._filter])
+        # Same header zipfile writes, readers only take the dictionary and literal settings from the properties
+        return struct.pack("<BBH", 9, 4, len(props)) + props
+
+    def compress(self, data: bytes) -> bytes:
+        header = self._init() if self._comp is None else b""
+        return header + self._comp.compress(data)
+
+    def flush(self) -> bytes:
+        header = self._init() if self._comp is None else b""
+        return header + self._comp.flush()
+
+
+def get_compressor(compress_type: int, level: int | None):
+    if compress_type == zipfile.ZIP_LZMA and level is not None:
+        return LZMACompressor(level)
+    return zipfile._get_compressor(compress_type, level)
+
+
+def start_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, zip64: bool):
+    """Writes the local header of a member whose data the caller writes to zipf.fp next."""
+    if not zipf._seekable:
+        # Streamed archives can't go back to fix the header, sizes and CRC follow the data instead
+        zinfo.flag_bits |= DATA_DESCRIPTOR_FLAG
+
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(zip64))
+
+
+def finish_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, zip64: bool):
+    """Records the final sizes and CRC of a member and adds it to the central directory."""
+    fp = zipf.fp
+    if zinfo.flag_bits & DATA_DESCRIPTOR_FLAG:
+        fmt = "<LLQQ" if zip64 else "<LLLL"
+        fp.write(struct.pack(fmt, DATA_DESCRIPTOR_SIGNATURE, zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        end = fp.tell()
+    else:
+        # The header is rewritten in place, zip64 was chosen up front so its size doesn't change
+        end = fp.tell()
+        fp.seek(zinfo.header_offset)
+        fp.write(zinfo.FileHeader(zip64))
+        fp.seek(end)
+
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = end
@@ -1,13 +1,17 @@
 import json
 import os
-import time
 from datetime import datetime
 from pathlib import Path
+from functools import lru_cache
+from typing import List
+
 from cron_descriptor import get_description
-from apscheduler.triggers.cron import CronTrigger
 
 from upback.constants.constants import SYSTEM_TIME_ZONE
 from upback.exceptions.exceptions import ApiException
+from upback.services.event_service import event_bus, HEARTBEAT_INTERVAL, RESET
+from upback.services.file_browser_service import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SORT_KEYS, file_browser
+from upback.services.schedule_service import get_cron_trigger, schedule_timeline
 
 
 def sse(data=None, event=None, id=None, retry=None):
@@ -28,67 +32,131 @@ def normalize_path(path: str) -> str:
     return Path(path).expanduser().resolve().as_posix()
 
 
+@lru_cache(maxsize=1024)
 def get_cron_description(cron: str) -> str:
     return get_description(cron)
 
 
 def get_next_run(cron_expr: str):
-    trigger = CronTrigger.from_crontab(cron_expr)
-    return trigger.get_next_fire_time(None, datetime.now())
+    return get_cron_trigger(cron_expr).get_next_fire_time(None, datetime.now(SYSTEM_TIME_ZONE))
+
+
+def sse_heartbeat() -> str:
+    return ": heartbeat\n\n"
 
 
-def stream_next_cron(cron: str):
+def parse_event_id(last_event_id: str | None) -> int | None:
     try:
+        return int(last_event_id) if last_event_id else None
+    except ValueError:
+        return None
+
+
+class _NextCronStream:
+    """Countdown state of one next-cron stream, shared by the threaded and the async server."""
+
+    def __init__(self, app_id: str, cron: str):
+        self.app_id = app_id
+        self.cron = cron
+        self.after_id = event_bus.last_id
+        self.next_run = schedule_timeline.next_run(app_id, cron)
+
+    def first(self) -> str:
+        return _next_run_event(self.cron, self.next_run, sync_run=False)
+
+    def timeout(self) -> float:
+        seconds_left = (self.next_run - datetime.now(SYSTEM_TIME_ZONE)).total_seconds()
+        return max(min(seconds_left, HEARTBEAT_INTERVAL), 0.1)
+
+    def handle(self, events) -> List[str] | None:
+        """Messages for the events that arrived, None once the app was deleted or the stream fell behind."""
+        changed = False
+        for event in events:
+            if event.event == RESET:
+                # Updates of the cron may be lost, the client reconnects and reads it again
+                return None
+            if event.data.get("uuid") != self.app_id:
+                continue
+            if event.event == "deleted":
+                return None
+            self.cron = event.data["cron"]
+            changed = True
+
+        messages = []
+        if datetime.now(SYSTEM_TIME_ZONE) >= self.next_run:
+            messages.append(_next_run_event(self.cron, self.next_run, sync_run=True))
+            changed = True
+
+        if changed:
+            self.next_run = schedule_timeline.next_run(self.app_id, self.cron)
+            messages.append(_next_run_event(self.cron, self.next_run, sync_run=False))
+        elif not events:
+            messages.append(sse_heartbeat())
+        return messages
+
+
+def stream_next_cron(app_id: str, cron: str):
+    event_bus.subscribe()
+    try:
+        stream = _NextCronStream(app_id, cron)
+        yield stream.first()
+
         while True:
-            next_run = get_next_run(cron)
-
-            delta = next_run - datetime.now(SYSTEM_TIME_ZONE)
-            seconds_left = max(int(delta.total_seconds()), 0)
-
-            if seconds_left == 0:
-                yield sse(
-                    data={
-                        "next_run": next_run.isoformat(),
-                        "seconds_remaining": seconds_left,
-                        "human_readable": get_cron_description(cron),
-                        "sync_run": True,
-                    },
-                    event="next_run",
-                    id=None,
-                )
-
-            yield sse(
-                data={
-                    "next_run": next_run.isoformat(),
-                    "seconds_remaining": seconds_left,
-                    "human_readable": get_cron_description(cron),
-                    "sync_run": False,
-                },
-                event="next_run",
-                id=None,
-            )
+            events, stream.after_id = event_bus.wait(stream.after_id, {"tracked_apps"}, stream.timeout())
+            messages = stream.handle(events)
+            if messages is None:
+                return
+            yield from messages
+    finally:
+        event_bus.unsubscribe()
 
-            time.sleep(1)  # 5s is plenty
 
-    except GeneratorExit:
-        # Client disconnected
-        return
+async def stream_next_cron_async(app_id: str, cron: str):
+    event_bus.subscribe()
+    try:
+        stream = _NextCronStream(app_id, cron)
+        yield stream.first()
+
+        while True:
+            events, stream.after_id = await event_bus.wait_async(
+                stream.after_id, {"tracked_apps"}, stream.timeout()
+            )
+            messages = stream.handle(events)
+            if messages is None:
+                return
+            for message in messages:
+                yield message
+    finally:
+        event_bus.unsubscribe()
+
+
+def _next_run_event(cron: str, next_run: datetime, sync_run: bool) -> str:
+    delta = next_run - datetime.now(SYSTEM_TIME_ZONE)
+
+    return sse(
+        data={
+            "next_run": next_run.isoformat(),
+            "seconds_remaining": max(int(delta.total_seconds()), 0),
+            "human_readable": get_cron_description(cron),
+            "sync_run": sync_run,
+        },
+        event="next_run",
+        id=None,
+    )
 
 
-def get_folder_data(path: str) -> list[dict]:
-    if not os.path.exists(path) or not os.path.isdir(path):
+def get_folder_data(path: str, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE, sort: str = "name",
+                    order: str = "asc", query: str | None = None, sizes: bool = False) -> dict:
+    if not path or not os.path.isdir(path):
         raise ApiException("Invalid path", code=400)
+    if sort not in SORT_KEYS:
+        raise ApiException(f"sort must be one of {', '.join(SORT_KEYS)}", code=400)
+    if order not in ("asc", "desc"):
+        raise ApiException("order must be asc or desc", code=400)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ApiException(f"limit must be between 1 and {MAX_PAGE_SIZE}", code=400)
 
-    items = []
-    for name in os.listdir(path):
-        full_path = os.path.join(path, name)
-        items.append({
-            "name": name,
-            "path": full_path,
-            "is_dir": os.path.isdir(full_path)
-        })
-
-    return items
+    return file_browser.list(path, cursor, limit, sort, order == "desc", query, sizes)
 
 
 def get_home_directory() -> Path:
@@ -98,5 +166,5 @@ def get_home_directory() -> Path:
 def sort_by_cron(apps):
     return sorted(
         apps,
-        key=lambda app: get_next_run(app.cron)
+        key=lambda app: schedule_timeline.next_run(str(app.uuid), app.cron)
     )
@@ -0,0 +1,103 @@
+import io
+import os
+import random
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from upback.services import chunk_store
+from upback.services.chunk_store import CHUNK_AVG_SIZE, CHUNK_MAX_SIZE, CHUNK_MIN_SIZE, ChunkStore, iter_chunks
+
+
+def _reference_boundary(data: bytes, start: int, end: int) -> int:
+    # The byte-at-a-time gear hash the vectorised cut has to agree with
+    if end - start <= CHUNK_MIN_SIZE:
+        return end
+
+    normal = min(start + CHUNK_AVG_SIZE, end)
+    limit = min(start + CHUNK_MAX_SIZE, end)
+    h = 0
+    for i in range(start + CHUNK_MIN_SIZE, limit):
+        h = ((h << 1) + chunk_store._GEAR[data[i]]) & chunk_store._HASH_MASK
+        if not h & (chunk_store._MASK_S if i < normal else chunk_store._MASK_L):
+            return i + 1
+    return limit
+
+
+def _reference_chunks(data: bytes) -> list:
+    chunks, offset = [], 0
+    while offset < len(data):
+        cut = _reference_boundary(data, offset, len(data))
+        chunks.append(data[offset:cut])
+        offset = cut
+    return chunks
+
+
+class ChunkingTest(unittest.TestCase):
+    def _assert_matches_reference(self, data: bytes):
+        chunks = list(iter_chunks(io.BytesIO(data)))
+        self.assertEqual(b"".join(chunks), data)
+        self.assertEqual([len(chunk) for chunk in chunks], [len(chunk) for chunk in _reference_chunks(data)])
+
+    def test_random_data(self):
+        self._assert_matches_reference(os.urandom(3 * 1024 * 1024 + 12345))
+
+    def test_repetitive_data(self):
+        rng = random.Random(7)
+        words = [bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40))) for _ in range(50)]
+        self._assert_matches_reference(b"".join(rng.choice(words) for _ in range(200_000)))
+
+    def test_runs_of_one_byte_hit_the_max_size(self):
+        self._assert_matches_reference(b"\0" * (CHUNK_MAX_SIZE * 3 + 100))
+
+    def test_small_inputs(self):
+        for size in (0, 1, CHUNK_MIN_SIZE, CHUNK_MIN_SIZE + 1, CHUNK_MIN_SIZE + 63, CHUNK_MIN_SIZE + 64):
+            with self.subTest(size=size):
+                self._assert_matches_reference(os.urandom(size))
+
+    def test_insert_only_moves_nearby_boundaries(self):
+        data = os.urandom(2 * 1024 * 1024)
+        before = set(iter_chunks(io.BytesIO(data)))
+        after = set(iter_chunks(io.BytesIO(data[:1000] + b"inserted" + data[1000:])))
+        self.assertGreater(len(before & after), len(before) - 3)
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_syncs_storing_the_same_chunk_at_once(self):
+        data = os.urandom(CHUNK_AVG_SIZE)
+        barrier = threading.Barrier(8)
+        errors = []
+
+        def put():
+            # Every sync has its own store on the shared directory
+            store = ChunkStore(self.root)
+            barrier.wait()
+            try:
+                store.put(data)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=put) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        store = ChunkStore(self.root)
+        digest, written = store.put(data)
+        self.assertEqual(written, 0)
+        self.assertEqual(store.get(digest), data)
+        self.assertEqual([path.name for path in self.root.rglob("*.tmp")], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from upback.database.connection import ConnectionManager
+
+
+class ConnectionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = ConnectionManager(Path(self.tmp.name) / "test.db")
+
+    def tearDown(self):
+        self.manager.close_all()
+        self.tmp.cleanup()
+
+    def _in_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+
+    def test_finished_threads_do_not_keep_connections(self):
+        for _ in range(50):
+            self._in_thread(lambda: self.manager.connection().execute("SELECT 1"))
+
+        self.manager.connection()
+        self.assertEqual(self.manager.open_connections, 1)
+
+    def test_close_releases_the_calling_threads_connection(self):
+        first = self.manager.connection()
+        self.manager.close()
+
+        self.assertEqual(self.manager.open_connections, 0)
+        self.assertIsNot(self.manager.connection(), first)
+        self.assertEqual(self.manager.open_connections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+
+from upback.services.event_service import EventBus, RESET
+
+
+class EventBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus(history=4)
+
+    def _publish(self, count: int):
+        for i in range(count):
+            self.bus.publish("syncs", "sync_progress", {"sync_id": str(i)})
+
+    def test_resumes_after_the_cursor(self):
+        self._publish(3)
+        events, after_id = self.bus.wait(1, {"syncs"}, 0)
+        self.assertEqual([e.id for e in events], [2, 3])
+        self.assertEqual(after_id, 3)
+
+    def test_cursor_behind_the_history_gets_a_reset(self):
+        self._publish(10)
+        events, after_id = self.bus.wait(2, {"syncs"}, 0)
+        self.assertEqual([(e.event, e.id) for e in events], [(RESET, 10)])
+        self.assertEqual(after_id, 10)
+
+        self._publish(1)
+        events, _ = self.bus.wait(after_id, {"syncs"}, 0)
+        self.assertEqual([e.id for e in events], [11])
+
+    def test_oldest_retained_event_is_not_a_reset(self):
+        self._publish(10)
+        events, _ = self.bus.wait(6, {"syncs"}, 0)
+        self.assertEqual([e.id for e in events], [7, 8, 9, 10])
+
+    def test_async_cursor_behind_the_history_gets_a_reset(self):
+        self._publish(10)
+        events, after_id = asyncio.run(self.bus.wait_async(0, {"syncs"}, 0))
+        self.assertEqual([e.event for e in events], [RESET])
+        self.assertEqual(after_id, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
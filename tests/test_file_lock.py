@@ -0,0 +1,55 @@
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from upback.services.file_lock import FileLock
+
+
+class FileLockTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "locks" / "test.lock"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_exclusive_excludes_everyone(self):
+        with FileLock(self.path):
+            self.assertFalse(FileLock(self.path).acquire(timeout=0))
+            self.assertFalse(FileLock(self.path).acquire(shared=True, timeout=0))
+        self.assertTrue(FileLock(self.path).acquire(timeout=0))
+
+    def test_shared_holders_coexist_and_block_exclusive(self):
+        first, second = FileLock(self.path), FileLock(self.path)
+        self.assertTrue(first.acquire(shared=True, timeout=0))
+        self.assertTrue(second.acquire(shared=True, timeout=0))
+        self.assertFalse(FileLock(self.path).acquire(timeout=0.2))
+
+        first.release()
+        second.release()
+        self.assertTrue(FileLock(self.path).acquire(timeout=0))
+
+    def test_lock_is_dropped_when_the_holder_dies(self):
+        script = (
+            "import sys; from pathlib import Path; from upback.services.file_lock import FileLock; "
+            "lock = FileLock(Path(sys.argv[1])); lock.acquire(); print('locked', flush=True); sys.stdin.read()"
+        )
+        holder = subprocess.Popen(
+            [sys.executable, "-c", script, str(self.path)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        try:
+            self.assertEqual(holder.stdout.readline().strip(), "locked")
+            self.assertFalse(FileLock(self.path).acquire(timeout=0))
+        finally:
+            holder.kill()
+            holder.wait()
+            holder.stdin.close()
+            holder.stdout.close()
+
+        self.assertTrue(FileLock(self.path).acquire(timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
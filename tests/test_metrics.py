@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from upback.config.settings import settings
+from upback.services import metrics_service
+from upback.services.file_lock import FileLock
+from upback.services.metrics_service import Counter, Gauge, Histogram, MetricsRegistry
+
+
+class SharedMetricsTest(unittest.TestCase):
+    """Other server workers are stood in for by the state files and locks they leave in the metrics directory."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        for patch in (
+                mock.patch.object(metrics_service, "METRICS_DIR", self.dir),
+                mock.patch.object(settings, "server_workers", 2),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.registry = MetricsRegistry()
+        self.syncs = self.registry.register(Counter("syncs_total", "Syncs.", ("status",)))
+        self.duration = self.registry.register(Histogram("duration_seconds", "Duration.", (), (1, 10)))
+        self.registry.register(Gauge("clients", "Clients.", lambda: 3))
+        self.syncs.inc("success")
+        self.duration.observe(5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _other_worker(self, pid: int, alive: bool):
+        (self.dir / f"{pid}.json").write_text(json.dumps({
+            "syncs_total": [[["success"], 2.0], [["failed"], 1.0]],
+            "duration_seconds": [[[], [1, 0, 0], 0.5, 1]],
+            "clients": 4,
+        }))
+        if alive:
+            lock = FileLock(self.dir / f"{pid}.lock")
+            lock.acquire()
+            self.addCleanup(lock.release)
+
+    def test_counters_and_histograms_add_up_across_workers(self):
+        self._other_worker(1, alive=True)
+        self._other_worker(2, alive=False)
+        lines = self.registry.render().splitlines()
+
+        self.assertIn('syncs_total{status="success"} 5.0', lines)
+        self.assertIn('syncs_total{status="failed"} 2.0', lines)
+        self.assertIn('duration_seconds_bucket{le="1"} 2', lines)
+        self.assertIn('duration_seconds_bucket{le="10"} 3', lines)
+        self.assertIn("duration_seconds_count 3", lines)
+
+    def test_gauges_are_labelled_by_live_worker(self):
+        self._other_worker(1, alive=True)
+        self._other_worker(2, alive=False)
+        gauges = [line for line in self.registry.render().splitlines() if line.startswith("clients")]
+
+        self.assertEqual(gauges, [f'clients{{worker="{os.getpid()}"}} 3', 'clients{worker="1"} 4'])
+
+    def test_single_worker_is_not_labelled(self):
+        self._other_worker(1, alive=True)
+        with mock.patch.object(settings, "server_workers", 1):
+            lines = self.registry.render().splitlines()
+
+        self.assertIn("clients 3", lines)
+        self.assertIn('syncs_total{status="success"} 1.0', lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
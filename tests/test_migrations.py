@@ -0,0 +1,79 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from upback.database import migrations
+
+
+class MigrationsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmp.name)
+        self.conn = sqlite3.connect(self.data_dir / "upback.db")
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def _legacy(self, name: str, script: str):
+        legacy = sqlite3.connect(self.data_dir / name)
+        legacy.executescript(script)
+        legacy.commit()
+        legacy.close()
+
+    def _version(self) -> int:
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def test_duplicate_legacy_apps_are_merged(self):
+        self._legacy("tracked_apps.db", """
+            CREATE TABLE tracked_apps (uuid TEXT PRIMARY KEY NOT NULL, file_path TEXT NOT NULL,
+                                       auto_update BOOLEAN NOT NULL, cron TEXT NOT NULL);
+            INSERT INTO tracked_apps VALUES ('a', '/srv/app', 1, '0 * * * *');
+            INSERT INTO tracked_apps VALUES ('b', '/srv/app', 0, '0 0 * * *');
+            INSERT INTO tracked_apps VALUES ('c', '/srv/other', 1, '0 * * * *');
+        """)
+        self._legacy("backups.db", """
+            CREATE TABLE backups (uuid TEXT PRIMARY KEY NOT NULL, app_id TEXT NOT NULL,
+                                  file_path TEXT NOT NULL, timestamp TEXT NOT NULL);
+            INSERT INTO backups VALUES ('1', 'a', '/backups/1.zip', '1');
+            INSERT INTO backups VALUES ('2', 'b', '/backups/2.zip', '2');
+            INSERT INTO backups VALUES ('3', 'c', '/backups/3.zip', '3');
+        """)
+
+        migrations.migrate(self.conn, self.data_dir)
+
+        self.assertEqual(self._version(), migrations.MIGRATIONS[-1][0])
+        self.assertEqual(self.conn.execute("SELECT uuid FROM tracked_apps ORDER BY uuid").fetchall(), [("a",), ("c",)])
+        self.assertEqual(
+            self.conn.execute("SELECT uuid, app_id FROM backups ORDER BY uuid").fetchall(),
+            [("1", "a"), ("2", "a"), ("3", "c")],
+        )
+        self.assertEqual(
+            self.conn.execute("SELECT app_id, backup_count FROM backup_stats ORDER BY app_id").fetchall(),
+            [("a", 2), ("c", 1)],
+        )
+        self.assertTrue((self.data_dir / "tracked_apps.db.migrated").exists())
+        self.assertFalse((self.data_dir / "backups.db").exists())
+
+    def test_failed_migration_leaves_no_partial_changes(self):
+        def broken(conn, data_dir):
+            conn.execute("ALTER TABLE tracked_apps ADD COLUMN half_applied INTEGER")
+            raise sqlite3.OperationalError("interrupted")
+
+        steps = migrations.MIGRATIONS[:3] + [(4, broken)]
+        with mock.patch.object(migrations, "MIGRATIONS", steps):
+            with self.assertRaises(sqlite3.OperationalError):
+                migrations.migrate(self.conn, self.data_dir)
+
+        self.assertEqual(self._version(), 3)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tracked_apps)")]
+        self.assertNotIn("half_applied", columns)
+
+        migrations.migrate(self.conn, self.data_dir)
+        self.assertEqual(self._version(), migrations.MIGRATIONS[-1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from upback.services.s3_client import FakeS3Client
+from upback.services.storage_service import MIN_PART_SIZE, S3Backend
+
+
+class ResumableUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client = FakeS3Client(Path(self.tmp.name))
+        # One part in flight at a time, so every part but the last one written is stored when the sync fails
+        self.backend = S3Backend("fake", self.client, part_size=MIN_PART_SIZE, concurrency=1)
+        self.data = bytes(range(256)) * (MIN_PART_SIZE * 4 // 256) + b"tail"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _fail_after(self, size: int) -> str:
+        with self.assertRaises(RuntimeError):
+            with self.backend.open_writer("app/archive.zip") as writer:
+                upload_id = writer.upload_id
+                writer.write(self.data[:size])
+                raise RuntimeError("source went away")
+        return upload_id
+
+    def test_failed_upload_is_kept(self):
+        upload_id = self._fail_after(MIN_PART_SIZE * 3)
+        self.assertEqual(self.client.list_multipart_uploads(""), [("app/archive.zip", upload_id)])
+        self.assertGreaterEqual(len(self.client.list_parts("app/archive.zip", upload_id)), 2)
+
+    def test_resume_skips_stored_parts(self):
+        upload_id = self._fail_after(MIN_PART_SIZE * 3)
+        stored = len(self.client.list_parts("app/archive.zip", upload_id))
+
+        with self.backend.open_writer("app/archive.zip", upload_id) as writer:
+            writer.write(self.data)
+        self.assertEqual(writer.skipped, stored)
+        self.assertEqual(self.client.get_object("app/archive.zip", 0, len(self.data) - 1), self.data)
+
+    def test_changed_parts_are_uploaded_again(self):
+        upload_id = self._fail_after(MIN_PART_SIZE * 3)
+        changed = self.data[:MIN_PART_SIZE] + b"x" + self.data[MIN_PART_SIZE + 1:]
+
+        with self.backend.open_writer("app/archive.zip", upload_id) as writer:
+            writer.write(changed)
+        self.assertEqual(writer.skipped, 1)
+        self.assertEqual(self.client.get_object("app/archive.zip", 0, len(changed) - 1), changed)
+
+    def test_vanished_upload_starts_over(self):
+        upload_id = self._fail_after(MIN_PART_SIZE)
+        self.client.abort_multipart_upload("app/archive.zip", upload_id)
+
+        with self.backend.open_writer("app/archive.zip", upload_id) as writer:
+            writer.write(self.data)
+        self.assertNotEqual(writer.upload_id, upload_id)
+        self.assertEqual(self.client.get_object("app/archive.zip", 0, len(self.data) - 1), self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from upback.config.settings import settings
+from upback.services import sync_queue_service
+from upback.services.file_lock import FileLock
+from upback.services.sync_queue_service import SyncExecutor
+
+
+class SyncExecutorLockTest(unittest.TestCase):
+    """Locks another server worker holds are taken here with a second FileLock, they exclude each other the same."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        locks = Path(self.tmp.name) / "locks"
+        for patch in (
+                mock.patch.object(sync_queue_service, "LOCKS_DIR", locks),
+                mock.patch.object(sync_queue_service, "SYNCS_LOCK", locks / "syncs.lock"),
+                mock.patch.object(sync_queue_service, "SLOT_POLL_SECONDS", 0.05),
+                mock.patch.object(sync_queue_service, "apply_priority", lambda: None),
+                mock.patch.object(settings, "max_concurrent_syncs", 1),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.executor = SyncExecutor()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _submit(self, app_id: str) -> threading.Event:
+        done = threading.Event()
+        self.executor.submit(app_id, lambda _sync_id: done.set())
+        return done
+
+    def _wait_idle(self):
+        with self.executor._condition:
+            self.assertTrue(self.executor._condition.wait_for(
+                lambda: not self.executor._heap and not self.executor._running, 5
+            ))
+
+    def test_app_syncing_elsewhere_is_skipped(self):
+        other = sync_queue_service.app_lock("app")
+        other.acquire()
+        try:
+            done = self._submit("app")
+            self._wait_idle()
+            self.assertFalse(done.is_set())
+        finally:
+            other.release()
+
+        self.assertTrue(self._submit("app").wait(5))
+
+    def test_waits_for_a_slot_held_elsewhere(self):
+        other = FileLock(sync_queue_service.LOCKS_DIR / "slot-0.lock")
+        other.acquire()
+        done = self._submit("app")
+        self.assertFalse(done.wait(0.3))
+        self.assertEqual(self.executor.count_running_anywhere(), 1)
+
+        other.release()
+        self.assertTrue(done.wait(5))
+
+    def test_sync_requested_when_the_last_one_finished_runs(self):
+        resubmitted = []
+        second = threading.Event()
+
+        def first(sync_id):
+            def on_finished():
+                resubmitted.append((sync_id, *self.executor.submit("app", lambda _sync_id: second.set())))
+            self.executor.when_released(on_finished)
+
+        self.executor.submit("app", first)
+        self.assertTrue(second.wait(5))
+        [(first_id, next_id, queued)] = resubmitted
+        self.assertTrue(queued)
+        self.assertNotEqual(first_id, next_id)
+
+    def test_sees_syncs_of_other_workers(self):
+        self.assertFalse(self.executor.running_anywhere())
+
+        other = FileLock(sync_queue_service.SYNCS_LOCK)
+        other.acquire(shared=True)
+        try:
+            self.assertTrue(self.executor.running_anywhere())
+        finally:
+            other.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Pins the zipfile internals the parallel zip writer relies on.
+
+Run with `PYTHONPATH=src python -m unittest discover tests`. A new CPython release goes into
+SUPPORTED_VERSIONS only once this passes on it.
+"""
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+import zlib
+from pathlib import Path
+
+from upback.services import zip_adapter
+from upback.services.compression_policy import CompressionPolicy
+from upback.services.compression_service import ParallelZipWriter, crc32_combine
+
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+class ZipAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.files = {}
+        for name, data in (
+                ("text.txt", b"upback " * 50_000),
+                ("random.bin", os.urandom(300_000)),
+                ("empty.txt", b""),
+        ):
+            path = self.root / name
+            path.write_bytes(data)
+            self.files[name] = data
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _members(self):
+        for name in self.files:
+            path = self.root / name
+            yield path, name, path.stat()
+
+    def _write(self, target, codec: str):
+        with zipfile.ZipFile(target, "w") as zipf:
+            writer = ParallelZipWriter(zipf, CompressionPolicy(codec, 6))
+            writer.block_size = 64 * 1024
+            return list(writer.write_members(self._members()))
+
+    def _check(self, data: bytes):
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            self.assertIsNone(zipf.testzip())
+            for name, content in self.files.items():
+                self.assertEqual(zipf.read(name), content)
+
+    def test_running_on_a_supported_version(self):
+        self.assertIn(sys.version_info[:2], zip_adapter.SUPPORTED_VERSIONS)
+
+    def test_seekable_archive_for_every_codec(self):
+        for codec in ("deflate", "bzip2", "lzma", "stored"):
+            with self.subTest(codec=codec):
+                target = io.BytesIO()
+                self._write(target, codec)
+                self._check(target.getvalue())
+
+    def test_member_checksums_from_blocks(self):
+        # 64 KiB blocks, so the text and random files are spread over several workers
+        results = self._write(io.BytesIO(), "deflate")
+        for _file, zinfo, _stat, file_hash in results:
+            data = self.files[zinfo.filename]
+            self.assertEqual(zinfo.CRC, zlib.crc32(data))
+            self.assertEqual(file_hash, hashlib.sha256(data).hexdigest())
+
+    def test_crc32_combine(self):
+        pairs = ((b"upback", b" backups"), (b"", b"data"), (b"data", b""), (os.urandom(5000), os.urandom(70_001)))
+        for first, second in pairs:
+            combined = crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second))
+            self.assertEqual(combined, zlib.crc32(first + second))
+
+    def test_lzma_honours_the_level(self):
+        data = b"".join(b"%d upback\n" % (i * i % 7919) for i in range(200_000))
+        sizes = {}
+        for level in (1, 9):
+            compressor = zip_adapter.get_compressor(zipfile.ZIP_LZMA, level)
+            sizes[level] = len(compressor.compress(data) + compressor.flush())
+        self.assertLess(sizes[9], sizes[1])
+
+    def test_streamed_archive_uses_data_descriptors(self):
+        target = _Unseekable()
+        self._write(target, "deflate")
+
+        data = target.buffer.getvalue()
+        self._check(data)
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            self.assertTrue(all(info.flag_bits & zip_adapter.DATA_DESCRIPTOR_FLAG for info in zipf.infolist()))
+
+    def test_file_grown_after_stat_is_archived_as_stated(self):
+        path = self.root / "text.txt"
+        stat = path.stat()
+        with open(path, "ab") as f:
+            f.write(b"appended after the stat")
+
+        target = io.BytesIO()
+        with zipfile.ZipFile(target, "w") as zipf:
+            writer = ParallelZipWriter(zipf, CompressionPolicy("deflate", 6))
+            writer.block_size = 64 * 1024
+            [(_file, zinfo, _stat, _hash)] = writer.write_members([(path, "text.txt", stat)])
+
+        self.assertEqual(zinfo.file_size, stat.st_size)
+        with zipfile.ZipFile(target) as zipf:
+            self.assertEqual(zipf.read("text.txt"), self.files["text.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()